@@ -0,0 +1,83 @@
+"""Compara la carga del modelo de corrección con pickle frente a joblib con mmap_mode.
+
+Uso: python benchmarks/bench_model_load.py [--classes 200] [--workers 4]
+
+Cada worker es un proceso nuevo que carga el modelo y hace una predicción; se informa
+el tiempo de carga y la memoria proporcional (PSS) que el modelo añade entre todos los workers.
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import joblib
+from config.settings import settings
+from learning.incremental_model import IncrementalCorrectionModel, build_correction_text
+from utils.helpers import save_joblib_atomic
+
+def proportional_memory_kb() -> int:
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1])
+    return 0
+
+def load_worker(loader: str, model_path: str, barrier, queue):
+    before = proportional_memory_kb()
+    start = time.perf_counter()
+    if loader == 'pickle':
+        with open(model_path, 'rb') as f:
+            model = pickle.load(f)
+    else:
+        model = joblib.load(model_path, mmap_mode='r')
+    elapsed = time.perf_counter() - start
+    model.predict([build_correction_text("nombre_proveedor", "ACME")])
+    # Medir con todos los workers vivos para que las páginas compartidas se repartan entre ellos
+    barrier.wait()
+    queue.put((elapsed, proportional_memory_kb() - before))
+    barrier.wait()
+
+def build_model(classes: int) -> IncrementalCorrectionModel:
+    model = IncrementalCorrectionModel()
+    texts = [build_correction_text("nombre_proveedor", f"PROVEEDOR {i} S.A.S") for i in range(classes)]
+    model.partial_fit(texts, [f"PROVEEDOR {i} SAS" for i in range(classes)])
+    return model
+
+def run(loader: str, model_path: str, workers: int):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    barrier = ctx.Barrier(workers)
+    processes = [ctx.Process(target=load_worker, args=(loader, model_path, barrier, queue)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    load_time = sum(r[0] for r in results) / len(results)
+    memory_mb = sum(r[1] for r in results) / 1024
+    print(f"{loader:>12}: carga media {load_time * 1000:8.1f} ms, memoria del modelo (PSS) {memory_mb:8.1f} MB ({workers} workers)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--classes', type=int, default=settings.CORRECTION_MODEL_MAX_LABELS)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    model = build_model(args.classes)
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'model.pkl')
+        joblib_path = os.path.join(directory, 'model.joblib')
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(model, f)
+        save_joblib_atomic(model, joblib_path)
+        print(f"Modelo con {args.classes} clases: {os.path.getsize(joblib_path) / 2 ** 20:.1f} MB en disco")
+        run('pickle', pickle_path, args.workers)
+        run('joblib-mmap', joblib_path, args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -58,5 +58,58 @@ class Settings:
     EMAIL_IMAP_SERVER = os.getenv("EMAIL_IMAP_SERVER", "imap.gmail.com") 
     EMAIL_FETCH_LIMIT = int(os.getenv("EMAIL_FETCH_LIMIT", 50)) 
     EMAIL_CHECK_INTERVAL_SECONDS = int(os.getenv("EMAIL_CHECK_INTERVAL_SECONDS", 60)) 
+    EMAIL_FETCH_WORKERS = int(os.getenv("EMAIL_FETCH_WORKERS", 8))
+    EMAIL_UID_WATERMARK = os.getenv("EMAIL_UID_WATERMARK", "true").lower() == "true"
+    EMAIL_CLAIM_STALE_SECONDS = int(os.getenv("EMAIL_CLAIM_STALE_SECONDS", 600))
+    EMAIL_IMAP_TIMEOUT_SECONDS = int(os.getenv("EMAIL_IMAP_TIMEOUT_SECONDS", 30))
+    EMAIL_ACCOUNT_DEADLINE_SECONDS = int(os.getenv("EMAIL_ACCOUNT_DEADLINE_SECONDS", 120))
+    EMAIL_MAX_ATTACHMENT_BYTES = int(os.getenv("EMAIL_MAX_ATTACHMENT_BYTES", 30 * 1024 * 1024))
+    EMAIL_FETCH_CHUNK_BYTES = int(os.getenv("EMAIL_FETCH_CHUNK_BYTES", 1024 * 1024))
+    EMAIL_SPOOL_DIR = os.getenv("EMAIL_SPOOL_DIR", os.path.join(BASE_DIR, "data", "mail_spool"))
+    EMAIL_SPOOL_MAX_BYTES = int(os.getenv("EMAIL_SPOOL_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+    ZIP_MAX_DECOMPRESSED_BYTES = int(os.getenv("ZIP_MAX_DECOMPRESSED_BYTES", 200 * 1024 * 1024))
+    ZIP_MAX_NESTING = int(os.getenv("ZIP_MAX_NESTING", 3))
+    ZIP_PARSE_WORKERS = int(os.getenv("ZIP_PARSE_WORKERS", 4))
+    ZIP_PARALLEL_MIN_INVOICES = int(os.getenv("ZIP_PARALLEL_MIN_INVOICES", 8))
+    PDF_SPLIT_ENABLED = os.getenv("PDF_SPLIT_ENABLED", "true").lower() == "true"
+    PDF_SPLIT_MIN_PAGES = int(os.getenv("PDF_SPLIT_MIN_PAGES", 2))
+    EMAIL_SESSION_POOL = os.getenv("EMAIL_SESSION_POOL", "true").lower() == "true"
+    EMAIL_POOL_MAX_SIZE = int(os.getenv("EMAIL_POOL_MAX_SIZE", 200))
+    EMAIL_POOL_HEALTHCHECK_SECONDS = int(os.getenv("EMAIL_POOL_HEALTHCHECK_SECONDS", 30))
+    EMAIL_POOL_KEEPALIVE_SECONDS = int(os.getenv("EMAIL_POOL_KEEPALIVE_SECONDS", 120))
+    EMAIL_POOL_IDLE_EVICT_SECONDS = int(os.getenv("EMAIL_POOL_IDLE_EVICT_SECONDS", 900))
+    EMAIL_IDLE_ENABLED = os.getenv("EMAIL_IDLE_ENABLED", "false").lower() == "true"
+    EMAIL_IDLE_TIMEOUT_SECONDS = int(os.getenv("EMAIL_IDLE_TIMEOUT_SECONDS", 300))
+    EMAIL_IDLE_BACKOFF_BASE_SECONDS = float(os.getenv("EMAIL_IDLE_BACKOFF_BASE_SECONDS", 2))
+    EMAIL_IDLE_BACKOFF_MAX_SECONDS = float(os.getenv("EMAIL_IDLE_BACKOFF_MAX_SECONDS", 300))
     PROCESSING_INTERVAL_SECONDS = int(os.getenv("PROCESSING_INTERVAL_SECONDS", 30))    
+    CORRECTIONS_BATCH_SIZE = int(os.getenv("CORRECTIONS_BATCH_SIZE", 200))
+    LEARNING_MIN_CORRECTIONS = int(os.getenv("LEARNING_MIN_CORRECTIONS", 5))
+    LEARNING_BATCH_SIZE = int(os.getenv("LEARNING_BATCH_SIZE", 1000))
+    LEARNING_DEBOUNCE_SECONDS = int(os.getenv("LEARNING_DEBOUNCE_SECONDS", 15))
+    LEARNING_MAX_DELAY_SECONDS = int(os.getenv("LEARNING_MAX_DELAY_SECONDS", 300))
+    LEARNING_POLL_SECONDS = int(os.getenv("LEARNING_POLL_SECONDS", 5))
+    CORRECTION_MODEL_PATH = os.getenv("CORRECTION_MODEL_PATH", os.path.join(BASE_DIR, "models", "correction_model.pkl"))
+    CORRECTION_MODEL_MODE = os.getenv("CORRECTION_MODEL_MODE", "incremental").lower()
+    CORRECTION_MODEL_BATCH_SIZE = int(os.getenv("CORRECTION_MODEL_BATCH_SIZE", 500))
+    CORRECTION_MODEL_CHECKPOINT_BATCHES = int(os.getenv("CORRECTION_MODEL_CHECKPOINT_BATCHES", 10))
+    CORRECTION_MODEL_UPDATE_SECONDS = int(os.getenv("CORRECTION_MODEL_UPDATE_SECONDS", 60))
+    CORRECTION_MODEL_FEATURES = int(os.getenv("CORRECTION_MODEL_FEATURES", 2 ** 14))
+    CORRECTION_MODEL_MAX_LABELS = int(os.getenv("CORRECTION_MODEL_MAX_LABELS", 64))
+    CORRECTION_MODEL_FIELDS = os.getenv("CORRECTION_MODEL_FIELDS", "moneda,metodo_pago,nombre_proveedor,nit_proveedor,nombre_cliente,nit_cliente").split(",")
+    RETRAINING_DAILY_AT = os.getenv("RETRAINING_DAILY_AT", "02:00")
+    MODEL_MMAP_MODE = os.getenv("MODEL_MMAP_MODE", "r")
+    SUPPLIER_INDEX_REFRESH_SECONDS = int(os.getenv("SUPPLIER_INDEX_REFRESH_SECONDS", 300))
+    SUPPLIER_FINGERPRINT_LINES = int(os.getenv("SUPPLIER_FINGERPRINT_LINES", 5))
+    SUPPLIER_CLASSIFIER_MODEL_PATH = os.getenv("SUPPLIER_CLASSIFIER_MODEL_PATH", os.path.join(BASE_DIR, "models", "supplier_classifier.pkl"))
+    GENERIC_EMAIL_DOMAINS = set(os.getenv("GENERIC_EMAIL_DOMAINS", "gmail.com,hotmail.com,outlook.com,yahoo.com,live.com,icloud.com").split(","))
+    SUPPLIER_TEMPLATES_FILE = os.getenv("SUPPLIER_TEMPLATES_FILE", os.path.join(BASE_DIR, 'learning', 'supplier_templates.json'))
+    TEMPLATE_MAX_FAILURES = int(os.getenv("TEMPLATE_MAX_FAILURES", 3))
+    TEMPLATE_REQUIRED_FIELDS = os.getenv("TEMPLATE_REQUIRED_FIELDS", "invoice_number,total_amount").split(",")
+    CASCADE_REQUIRED_FIELDS = os.getenv("CASCADE_REQUIRED_FIELDS", "invoice_number,issue_date,total_amount").split(",")
+    STAGE_GRAPH_WORKERS = int(os.getenv("STAGE_GRAPH_WORKERS", 4))
+    PROCESSING_WORKERS = int(os.getenv("PROCESSING_WORKERS", os.cpu_count() or 1))
+    PROCESSING_START_METHOD = os.getenv("PROCESSING_START_METHOD", "spawn")
+    PROCESSING_WARM_NLP = os.getenv("PROCESSING_WARM_NLP", "true").lower() == "true"
+    DOCUMENT_QUEUE_SIZE = int(os.getenv("DOCUMENT_QUEUE_SIZE", 100))
 settings = Settings()
\ No newline at end of file
@@ -1,10 +1,12 @@
 
 import logging
+from sqlalchemy import or_, and_, func
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError, OperationalError
-from typing import Dict, Any, List, Optional
-from .models import Factura, ItemFactura, CampoCorregido, ItemCorregido
-from datetime import datetime, date
+from typing import Dict, Any, List, Optional, Tuple
+from .models import Factura, ItemFactura, CampoCorregido, ItemCorregido, ConteoCorreccion, EstadoAprendizaje, ClaveProveedor, ORIGEN_CABECERA, ORIGEN_ITEM
+from .models import CorreoProcesado, MarcaCorreo, CORREO_RECLAMADO, CORREO_COMPLETADO, HuellaDocumento, CorreoDuplicado, CufeFactura
+from datetime import datetime, date, timedelta
 import json
 
 logger = logging.getLogger(__name__)
@@ -282,17 +284,43 @@ logger = logging.getLogger(__name__)
 #             return False
 
 
+def after_watermark(query, model, ultimo_id: int):
+    """Filtra las correcciones posteriores a la marca de agua.
+
+    La marca es el id autoincremental: fecha_correccion la pone la aplicación antes del commit y
+    cambia con cada re-corrección, así que no sirve para saber qué filas ya se contaron.
+    """
+    return query.filter(model.id > ultimo_id)
+
+def correction_count_key(origen: str, nombre_campo: Optional[str], valor_corregido: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Clave (campo, valor) con la que una corrección suma en conteos_correcciones, o None si no cuenta."""
+    if origen == ORIGEN_CABECERA:
+        return (nombre_campo, valor_corregido) if valor_corregido is not None else None
+    if nombre_campo != 'descripcion':
+        return None
+    corrected_desc = valor_corregido
+    if isinstance(corrected_desc, str) and corrected_desc.strip().startswith('{') and corrected_desc.strip().endswith('}'):
+        try:
+            item_dict = json.loads(corrected_desc)
+            if 'description' in item_dict:
+                corrected_desc = item_dict['description']
+        except json.JSONDecodeError:
+            pass
+    if not corrected_desc:
+        return None
+    return ('descripcion', str(corrected_desc)[:512])
+
 class InvoiceCRUD:
     def __init__(self, db_session: Session):
         self.db = db_session
-    def create_invoice(self, invoice_data: Dict[str, Any], items_data: List[Dict[str, Any]] = None) -> Optional[Factura]:
+    def create_invoice(self, invoice_data: Dict[str, Any], items_data: List[Dict[str, Any]] = None, commit: bool = True) -> Optional[Factura]:
         try:
             existing_invoice = self.db.query(Factura).filter(
                 Factura.ruta_archivo == invoice_data.get("ruta_archivo")
             ).first()
             if existing_invoice:
                 logger.info(f"Factura con ruta '{invoice_data.get('ruta_archivo')}' ya existe. Actualizando factura ID: {existing_invoice.id}")
-                return self.update_invoice(existing_invoice.id, invoice_data, items_data)
+                return self.update_invoice(existing_invoice.id, invoice_data, items_data, commit=commit)
 
             if isinstance(invoice_data.get("fecha_emision"), str):
                 try:
@@ -323,26 +351,39 @@ class InvoiceCRUD:
             new_invoice = Factura(**invoice_data)
             self.db.add(new_invoice)
             self.db.flush()
+            if new_invoice.cufe and new_invoice.cufe != "No encontrado":
+                # Misma transacción que la factura: si otro proceso ya guardó este CUFE, la factura tampoco se guarda
+                self.db.add(CufeFactura(cufe=new_invoice.cufe, id_factura=new_invoice.id))
+                self.db.flush()
 
             if items_data:
                 for item_data in items_data:
                     item = ItemFactura(id_factura=new_invoice.id, **item_data)
                     self.db.add(item)
 
+            if not commit:
+                self.db.flush()
+                return new_invoice
             self.db.commit()
             self.db.refresh(new_invoice)
             logger.info(f"Factura '{new_invoice.numero_factura}' creada exitosamente.")
             return new_invoice
         except IntegrityError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error de integridad al crear factura: {e}")
             logger.error(f"Posiblemente el número de factura '{invoice_data.get('numero_factura')}' ya existe.")
             return None
         except OperationalError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error operacional de base de datos al crear factura: {e}")
             return None
         except Exception as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error inesperado al crear factura: {e}", exc_info=True)
             return None
@@ -367,7 +408,7 @@ class InvoiceCRUD:
             logger.error(f"Error inesperado al obtener factura por ID: {e}", exc_info=True)
             return None
 
-    def update_invoice(self, id_factura: int, update_data: Dict[str, Any], new_items_data: List[Dict[str, Any]] = None) -> Optional[Factura]:
+    def update_invoice(self, id_factura: int, update_data: Dict[str, Any], new_items_data: List[Dict[str, Any]] = None, commit: bool = True) -> Optional[Factura]:
         try:
             factura = self.get_invoice_by_id(id_factura)
             if not factura:
@@ -406,15 +447,22 @@ class InvoiceCRUD:
                     item = ItemFactura(id_factura=factura.id, **item_data)
                     self.db.add(item)
 
+            if not commit:
+                self.db.flush()
+                return factura
             self.db.commit()
             self.db.refresh(factura)
             logger.info(f"Factura con ID {id_factura} actualizada exitosamente.")
             return factura
         except OperationalError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error operacional de base de datos al actualizar factura: {e}")
             return None
         except Exception as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error inesperado al actualizar factura: {e}", exc_info=True)
             return None
@@ -448,7 +496,8 @@ class CorrectedFieldCRUD:
     def __init__(self, db_session: Session):
         self.db = db_session
 
-    def add_corrected_field(self, id_factura: int, nombre_campo: str, valor_original: str, valor_corregido: str) -> Optional[CampoCorregido]:
+    def add_corrected_field(self, id_factura: int, nombre_campo: str, valor_original: str, valor_corregido: str,
+                            commit: bool = True) -> Optional[CampoCorregido]:
         try:
             existing_correction = self.db.query(CampoCorregido).filter_by(
                 id_factura=id_factura,
@@ -456,27 +505,41 @@ class CorrectedFieldCRUD:
             ).first()
 
             if existing_correction:
+                old_key = correction_count_key(ORIGEN_CABECERA, nombre_campo, existing_correction.valor_corregido)
                 existing_correction.valor_original = valor_original
                 existing_correction.valor_corregido = valor_corregido
                 existing_correction.fecha_correccion = datetime.now()
                 self.db.add(existing_correction)
-                logger.info(f"Corrección para la factura {id_factura}, campo '{nombre_campo}' actualizada.")
-                return existing_correction
+                LearningStateCRUD(self.db).replace_count(
+                    ORIGEN_CABECERA, existing_correction.id, old_key,
+                    correction_count_key(ORIGEN_CABECERA, nombre_campo, valor_corregido))
+                correction = existing_correction
+                message = f"Corrección para la factura {id_factura}, campo '{nombre_campo}' actualizada."
             else:
-                new_correction = CampoCorregido(
+                correction = CampoCorregido(
                     id_factura=id_factura,
                     nombre_campo=nombre_campo,
                     valor_original=valor_original,
                     valor_corregido=valor_corregido
                 )
-                self.db.add(new_correction)
-                logger.info(f"Nueva corrección para la factura {id_factura}, campo '{nombre_campo}' registrada.")
-                return new_correction
+                self.db.add(correction)
+                message = f"Nueva corrección para la factura {id_factura}, campo '{nombre_campo}' registrada."
+            if not commit:
+                self.db.flush()
+                return correction
+            self.db.commit()
+            self.db.refresh(correction)
+            logger.info(message)
+            return correction
         except OperationalError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error operacional de base de datos al añadir/actualizar campo corregido: {e}")
             return None
         except Exception as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error inesperado al añadir/actualizar campo corregido: {e}", exc_info=True)
             return None
@@ -495,11 +558,19 @@ class CorrectedFieldCRUD:
             logger.error(f"Error al obtener todos los campos corregidos: {e}", exc_info=True)
             return []
 
+    def get_corrected_fields_after(self, ultimo_id: int, limit: int) -> List[CampoCorregido]:
+        try:
+            query = after_watermark(self.db.query(CampoCorregido), CampoCorregido, ultimo_id)
+            return query.order_by(CampoCorregido.id).limit(limit).all()
+        except Exception as e:
+            logger.error(f"Error al obtener campos corregidos posteriores a la marca de agua: {e}", exc_info=True)
+            return []
+
 class ItemFacturaCRUD:
     def __init__(self, db_session: Session):
         self.db = db_session
 
-    def create_item(self, invoice_id: int, item_data: Dict[str, Any]) -> Optional[ItemFactura]:
+    def create_item(self, invoice_id: int, item_data: Dict[str, Any], commit: bool = True) -> Optional[ItemFactura]:
         try:
             for key in ["cantidad", "precio_unitario", "total_linea"]:
                 if key in item_data and isinstance(item_data[key], str):
@@ -511,19 +582,27 @@ class ItemFacturaCRUD:
             new_item = ItemFactura(id_factura=invoice_id, **item_data)
             self.db.add(new_item)
             self.db.flush()
+            if not commit:
+                return new_item
             self.db.commit()
             self.db.refresh(new_item)
             logger.info(f"Ítem creado exitosamente para la factura {invoice_id} con ID: {new_item.id}")
             return new_item
         except IntegrityError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error de integridad al crear ítem de factura: {e}")
             return None
         except OperationalError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error operacional de base de datos al crear ítem de factura: {e}")
             return None
         except Exception as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error inesperado al crear ítem de factura: {e}", exc_info=True)
             return None
@@ -545,7 +624,7 @@ class ItemFacturaCRUD:
             logger.error(f"Error al obtener ítems para la factura {invoice_id}: {e}", exc_info=True)
             return []
 
-    def update_item(self, item_id: int, update_data: Dict[str, Any]) -> Optional[ItemFactura]:
+    def update_item(self, item_id: int, update_data: Dict[str, Any], commit: bool = True) -> Optional[ItemFactura]:
         try:
             item = self.get_item_by_id(item_id)
             if not item:
@@ -562,21 +641,28 @@ class ItemFacturaCRUD:
                     setattr(item, key, value)
                 else:
                     logger.warning(f"Intento de actualizar campo '{key}' que no existe en el modelo ItemFactura.")
-            
+
+            if not commit:
+                self.db.flush()
+                return item
             self.db.commit()
             self.db.refresh(item)
             logger.info(f"Ítem con ID {item_id} actualizado exitosamente.")
             return item
         except OperationalError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error operacional de base de datos al actualizar ítem: {e}")
             return None
         except Exception as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error inesperado al actualizar ítem: {e}", exc_info=True)
             return None
 
-    def delete_item(self, item_id: int) -> bool:
+    def delete_item(self, item_id: int, commit: bool = True) -> bool:
         try:
             item = self.get_item_by_id(item_id)
             if not item:
@@ -584,14 +670,21 @@ class ItemFacturaCRUD:
                 return False
             
             self.db.delete(item)
+            if not commit:
+                self.db.flush()
+                return True
             self.db.commit()
             logger.info(f"Ítem con ID {item_id} eliminado exitosamente.")
             return True
         except OperationalError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error operacional de base de datos al eliminar ítem: {e}")
             return False
         except Exception as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error inesperado al eliminar ítem: {e}", exc_info=True)
             return False
@@ -607,7 +700,8 @@ class ItemCorrectionCRUD:
         campo_corregido: Optional[str] = None,
         valor_original: Optional[Any] = None,
         valor_corregido: Any = None,
-        id_item_original: Optional[int] = None
+        id_item_original: Optional[int] = None,
+        commit: bool = True
     ) -> Optional[ItemCorregido]:
         try:
             original_json = json.dumps(valor_original, ensure_ascii=False) if isinstance(valor_original, dict) else valor_original
@@ -622,15 +716,22 @@ class ItemCorrectionCRUD:
                 valor_corregido=corregido_json
             )
             self.db.add(new_correction)
+            if not commit:
+                self.db.flush()
+                return new_correction
             self.db.commit()
             self.db.refresh(new_correction)
             logger.info(f"Corrección de ítem registrada: Factura ID {id_factura}, Tipo: '{tipo_correccion}', Campo: '{campo_corregido}'.")
             return new_correction
         except OperationalError as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error operacional de base de datos al añadir corrección de ítem: {e}")
             return None
         except Exception as e:
+            if not commit:
+                raise
             self.db.rollback()
             logger.error(f"Error inesperado al añadir corrección de ítem: {e}", exc_info=True)
             return None
@@ -656,6 +757,7 @@ class ItemCorrectionCRUD:
                 logger.warning(f"Corrección de ítem con ID {correction_id} no encontrada para actualizar.")
                 return None
 
+            old_key = correction_count_key(ORIGEN_ITEM, correction.campo_corregido, correction.valor_corregido)
             for key, value in update_data.items():
                 if hasattr(correction, key):
                     if isinstance(value, dict):
@@ -663,6 +765,9 @@ class ItemCorrectionCRUD:
                     else:
                         setattr(correction, key, value)
             correction.fecha_correccion = datetime.now()
+            LearningStateCRUD(self.db).replace_count(
+                ORIGEN_ITEM, correction.id, old_key,
+                correction_count_key(ORIGEN_ITEM, correction.campo_corregido, correction.valor_corregido))
             self.db.commit()
             self.db.refresh(correction)
             logger.info(f"Corrección de ítem con ID {correction_id} actualizada exitosamente.")
@@ -699,4 +804,389 @@ class ItemCorrectionCRUD:
             return self.db.query(ItemCorregido).all()
         except Exception as e:
             logger.error(f"Error al obtener todas las correcciones de ítems: {e}", exc_info=True)
-            return []
\ No newline at end of file
+            return []
+
+class LearningStateCRUD:
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def get_state(self, for_update: bool = False) -> EstadoAprendizaje:
+        query = self.db.query(EstadoAprendizaje).filter(EstadoAprendizaje.id == 1)
+        if for_update:
+            query = query.with_for_update()
+        state = query.first()
+        if state:
+            return state
+        try:
+            with self.db.begin_nested():
+                self.db.add(EstadoAprendizaje(id=1, cabecera_ultimo_id=0, items_ultimo_id=0))
+        except IntegrityError:
+            logger.info("El estado de aprendizaje fue creado por otro proceso. Se reutiliza.")
+        return query.first()
+
+    def request_learning(self) -> bool:
+        try:
+            state = self.get_state(for_update=True)
+            now = datetime.now()
+            state.solicitado_en = now
+            if state.pendiente_desde is None:
+                state.pendiente_desde = now
+            self.db.commit()
+            logger.info("Aprendizaje incremental solicitado.")
+            return True
+        except OperationalError as e:
+            self.db.rollback()
+            logger.error(f"Error operacional de base de datos al solicitar aprendizaje: {e}")
+            return False
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error inesperado al solicitar aprendizaje: {e}", exc_info=True)
+            return False
+
+    def get_batch_end(self, origen: str, ultimo_id: int, limit: int) -> Optional[Tuple[int, bool]]:
+        """Devuelve (id, lote_completo) de la última corrección del siguiente lote tras la marca de agua."""
+        model = CampoCorregido if origen == ORIGEN_CABECERA else ItemCorregido
+        query = after_watermark(self.db.query(model.id), model, ultimo_id)
+        row = query.order_by(model.id).offset(limit - 1).limit(1).first()
+        if row:
+            return row[0], True
+        row = query.order_by(model.id.desc()).first()
+        if row:
+            return row[0], False
+        return None
+
+    def aggregate_corrections(self, origen: str, ultimo_id: int, hasta_id: int) -> List[Tuple[str, str, int]]:
+        """Cuenta en la base de datos las correcciones del rango (marca de agua, hasta] agrupadas por campo y valor."""
+        if origen == ORIGEN_CABECERA:
+            model = CampoCorregido
+            campo, valor = CampoCorregido.nombre_campo, CampoCorregido.valor_corregido
+            query = self.db.query(campo, valor, func.count(model.id))
+        else:
+            model = ItemCorregido
+            campo, valor = ItemCorregido.campo_corregido, ItemCorregido.valor_corregido
+            query = self.db.query(campo, valor, func.count(model.id)).filter(
+                ItemCorregido.campo_corregido == 'descripcion')
+        query = after_watermark(query, model, ultimo_id).filter(valor.isnot(None), model.id <= hasta_id)
+        return [(row[0], row[1], row[2]) for row in query.group_by(campo, valor).all()]
+
+    def add_counts(self, origen: str, counts: Dict[Tuple[str, str], int]) -> None:
+        values_by_field: Dict[str, Dict[str, int]] = {}
+        for (nombre_campo, valor_corregido), count in counts.items():
+            values_by_field.setdefault(nombre_campo, {})[valor_corregido] = count
+        for nombre_campo, values in values_by_field.items():
+            existing_rows = self.db.query(ConteoCorreccion).filter(
+                ConteoCorreccion.origen == origen,
+                ConteoCorreccion.nombre_campo == nombre_campo,
+                ConteoCorreccion.valor_corregido.in_(list(values.keys()))
+            ).all()
+            for row in existing_rows:
+                row.conteo += values.pop(row.valor_corregido)
+            for valor_corregido, count in values.items():
+                self.db.add(ConteoCorreccion(
+                    origen=origen,
+                    nombre_campo=nombre_campo,
+                    valor_corregido=valor_corregido,
+                    conteo=count
+                ))
+        self.db.flush()
+
+    def replace_count(self, origen: str, correction_id: int, old_key: Optional[Tuple[str, str]],
+                      new_key: Optional[Tuple[str, str]]) -> None:
+        """Pasa el voto de una corrección re-editada de old_key a new_key si ya estaba contada.
+
+        Si su id sigue por encima de la marca de agua, el siguiente lote la leerá con el valor nuevo.
+        """
+        if old_key == new_key:
+            return
+        state = self.get_state(for_update=True)
+        ultimo_id = state.cabecera_ultimo_id if origen == ORIGEN_CABECERA else state.items_ultimo_id
+        if correction_id is None or correction_id > ultimo_id:
+            return
+        if old_key:
+            row = self.db.query(ConteoCorreccion).filter(
+                ConteoCorreccion.origen == origen,
+                ConteoCorreccion.nombre_campo == old_key[0],
+                ConteoCorreccion.valor_corregido == old_key[1]
+            ).first()
+            if row:
+                row.conteo -= 1
+                if row.conteo <= 0:
+                    self.db.delete(row)
+        if new_key:
+            self.add_counts(origen, {new_key: 1})
+        self.db.flush()
+
+    def get_counts(self, origen: str, min_count: int = 1) -> List[ConteoCorreccion]:
+        try:
+            return self.db.query(ConteoCorreccion).filter(
+                ConteoCorreccion.origen == origen,
+                ConteoCorreccion.conteo >= min_count
+            ).order_by(ConteoCorreccion.nombre_campo, ConteoCorreccion.conteo.desc(), ConteoCorreccion.id).all()
+        except Exception as e:
+            logger.error(f"Error al obtener conteos de correcciones para '{origen}': {e}", exc_info=True)
+            return []
+
+    def get_winning_values(self, origen: str, min_count: int) -> List[ConteoCorreccion]:
+        """Valor más frecuente de cada campo cuyo conteo supera min_count."""
+        try:
+            max_per_field = self.db.query(
+                ConteoCorreccion.nombre_campo.label("nombre_campo"),
+                func.max(ConteoCorreccion.conteo).label("max_conteo")
+            ).filter(
+                ConteoCorreccion.origen == origen
+            ).group_by(
+                ConteoCorreccion.nombre_campo
+            ).having(func.max(ConteoCorreccion.conteo) > min_count).subquery()
+            rows = self.db.query(ConteoCorreccion).join(
+                max_per_field,
+                and_(
+                    ConteoCorreccion.nombre_campo == max_per_field.c.nombre_campo,
+                    ConteoCorreccion.conteo == max_per_field.c.max_conteo
+                )
+            ).filter(ConteoCorreccion.origen == origen).order_by(ConteoCorreccion.nombre_campo, ConteoCorreccion.id).all()
+            winners: Dict[str, ConteoCorreccion] = {}
+            for row in rows:
+                winners.setdefault(row.nombre_campo, row)
+            return list(winners.values())
+        except Exception as e:
+            logger.error(f"Error al obtener valores ganadores para '{origen}': {e}", exc_info=True)
+            return []
+
+    def get_top_corrected_fields(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Campos de cabecera más corregidos, leídos de los conteos agregados."""
+        try:
+            total = func.sum(ConteoCorreccion.conteo)
+            rows = self.db.query(
+                ConteoCorreccion.nombre_campo,
+                total.label("correcciones"),
+                func.count(ConteoCorreccion.id).label("valores_distintos")
+            ).filter(
+                ConteoCorreccion.origen == ORIGEN_CABECERA
+            ).group_by(ConteoCorreccion.nombre_campo).order_by(total.desc()).limit(limit).all()
+            return [
+                {"nombre_campo": row[0], "correcciones": int(row[1]), "valores_distintos": int(row[2])}
+                for row in rows
+            ]
+        except Exception as e:
+            logger.error(f"Error al obtener los campos más corregidos: {e}", exc_info=True)
+            return []
+
+    def reset(self) -> None:
+        self.db.query(ConteoCorreccion).delete()
+        state = self.get_state(for_update=True)
+        state.cabecera_ultimo_id = 0
+        state.items_ultimo_id = 0
+        self.db.flush()
+        logger.info("Conteos y marca de agua de aprendizaje reiniciados.")
+
+class SupplierKeyCRUD:
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def get_all_keys(self) -> List[ClaveProveedor]:
+        try:
+            return self.db.query(ClaveProveedor).all()
+        except Exception as e:
+            logger.error(f"Error al obtener las claves de proveedor: {e}", exc_info=True)
+            return []
+
+    def upsert_keys(self, nit_proveedor: str, nombre_proveedor: Optional[str], keys: List[Tuple[str, str]]) -> List[ClaveProveedor]:
+        """Registra claves de búsqueda para un proveedor; una clave ya usada por otro NIT queda marcada como ambigua."""
+        try:
+            rows = []
+            for tipo, clave in keys:
+                row = self.db.query(ClaveProveedor).filter_by(tipo=tipo, clave=clave).first()
+                if row is None:
+                    row = ClaveProveedor(tipo=tipo, clave=clave, nit_proveedor=nit_proveedor, nombre_proveedor=nombre_proveedor)
+                    self.db.add(row)
+                elif row.nit_proveedor == nit_proveedor:
+                    row.nombre_proveedor = nombre_proveedor or row.nombre_proveedor
+                elif row.nit_proveedor is not None:
+                    logger.info(f"La clave de proveedor {tipo}='{clave}' es compartida por varios NIT. Se marca como ambigua.")
+                    row.nit_proveedor = None
+                    row.nombre_proveedor = None
+                rows.append(row)
+            self.db.commit()
+            return rows
+        except IntegrityError:
+            self.db.rollback()
+            logger.info(f"Las claves del proveedor {nit_proveedor} fueron registradas por otro proceso.")
+            return []
+        except OperationalError as e:
+            self.db.rollback()
+            logger.error(f"Error operacional de base de datos al registrar claves de proveedor: {e}")
+            return []
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error inesperado al registrar claves de proveedor: {e}", exc_info=True)
+            return []
+class MailLedgerCRUD:
+    """Registro de correos por (cuenta, UIDVALIDITY, UID) compartido entre nodos de ingesta.
+
+    Un nodo reclama un UID insertando su fila en estado 'reclamado' (la restricción única hace que solo
+    uno lo consiga) y lo marca 'completado' al terminar. Un reclamo más antiguo que `stale_seconds`
+    se considera abandonado y otro nodo puede tomarlo con una actualización condicional.
+    """
+
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def claim(self, cuenta: str, uidvalidity: int, uids: List[int], nodo: str, stale_seconds: int) -> Tuple[List[int], List[int]]:
+        """Devuelve (uids reclamados por este nodo, uids reclamados por otro nodo y aún vigentes)."""
+        try:
+            existentes = {row.uid: row for row in self.db.query(CorreoProcesado).filter(
+                CorreoProcesado.cuenta == cuenta,
+                CorreoProcesado.uidvalidity == uidvalidity,
+                CorreoProcesado.uid.in_(uids)
+            )} if uids else {}
+            limite = datetime.now() - timedelta(seconds=stale_seconds)
+            reclamados, ocupados = [], []
+            for uid in uids:
+                row = existentes.get(uid)
+                if row is None:
+                    try:
+                        with self.db.begin_nested():
+                            self.db.add(CorreoProcesado(cuenta=cuenta, uidvalidity=uidvalidity, uid=uid,
+                                                        estado=CORREO_RECLAMADO, nodo=nodo, reclamado_en=datetime.now()))
+                        reclamados.append(uid)
+                    except IntegrityError:
+                        ocupados.append(uid)
+                    continue
+                if row.estado == CORREO_COMPLETADO:
+                    continue
+                tomado = self.db.query(CorreoProcesado).filter(
+                    CorreoProcesado.id == row.id,
+                    CorreoProcesado.estado == CORREO_RECLAMADO,
+                    CorreoProcesado.reclamado_en < limite
+                ).update({"nodo": nodo, "reclamado_en": datetime.now()}, synchronize_session=False)
+                if tomado:
+                    logger.info(f"Reclamo abandonado del UID {uid} de {cuenta} (nodo {row.nodo}) tomado por {nodo}.")
+                    reclamados.append(uid)
+                else:
+                    ocupados.append(uid)
+            self.db.commit()
+            return reclamados, ocupados
+        except OperationalError as e:
+            self.db.rollback()
+            logger.error(f"Error operacional de base de datos al reclamar correos de {cuenta}: {e}")
+            return [], list(uids)
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error inesperado al reclamar correos de {cuenta}: {e}", exc_info=True)
+            return [], list(uids)
+
+    def complete(self, cuenta: str, uidvalidity: int, uids: List[int]) -> bool:
+        try:
+            if uids:
+                self.db.query(CorreoProcesado).filter(
+                    CorreoProcesado.cuenta == cuenta,
+                    CorreoProcesado.uidvalidity == uidvalidity,
+                    CorreoProcesado.uid.in_(uids)
+                ).update({"estado": CORREO_COMPLETADO, "completado_en": datetime.now()}, synchronize_session=False)
+            self.db.commit()
+            return True
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error al completar correos de {cuenta}: {e}", exc_info=True)
+            return False
+
+    def release(self, cuenta: str, uidvalidity: int, uids: List[int], nodo: str) -> bool:
+        """Libera reclamos propios sin completar para que se reintenten en el siguiente ciclo."""
+        try:
+            if uids:
+                self.db.query(CorreoProcesado).filter(
+                    CorreoProcesado.cuenta == cuenta,
+                    CorreoProcesado.uidvalidity == uidvalidity,
+                    CorreoProcesado.uid.in_(uids),
+                    CorreoProcesado.estado == CORREO_RECLAMADO,
+                    CorreoProcesado.nodo == nodo
+                ).delete(synchronize_session=False)
+            self.db.commit()
+            return True
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error al liberar correos de {cuenta}: {e}", exc_info=True)
+            return False
+
+    def get_watermark(self, cuenta: str) -> Optional[MarcaCorreo]:
+        try:
+            return self.db.query(MarcaCorreo).filter(MarcaCorreo.cuenta == cuenta).first()
+        except Exception as e:
+            logger.error(f"Error al obtener la marca de UID de {cuenta}: {e}", exc_info=True)
+            return None
+
+    def advance_watermark(self, cuenta: str, uidvalidity: int, uid: int) -> bool:
+        """Guarda la marca solo si avanza o si cambió UIDVALIDITY (otro nodo pudo dejarla más adelante)."""
+        try:
+            marca = self.db.query(MarcaCorreo).filter(MarcaCorreo.cuenta == cuenta).with_for_update().first()
+            if marca is None:
+                try:
+                    with self.db.begin_nested():
+                        self.db.add(MarcaCorreo(cuenta=cuenta, uidvalidity=uidvalidity, uid=uid))
+                    self.db.commit()
+                    return True
+                except IntegrityError:
+                    marca = self.db.query(MarcaCorreo).filter(MarcaCorreo.cuenta == cuenta).with_for_update().first()
+            if marca.uidvalidity != uidvalidity or uid > marca.uid:
+                marca.uidvalidity = uidvalidity
+                marca.uid = uid
+            self.db.commit()
+            return True
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error al guardar la marca de UID de {cuenta}: {e}", exc_info=True)
+            return False
+
+class DocumentHashCRUD:
+    """Huellas SHA-256 de los adjuntos ya extraídos y correos duplicados vinculados a sus facturas."""
+
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def find_invoices(self, sha256: str) -> List[int]:
+        try:
+            return [row.id_factura for row in self.db.query(HuellaDocumento.id_factura).filter(
+                HuellaDocumento.sha256 == sha256).order_by(HuellaDocumento.id)]
+        except Exception as e:
+            logger.error(f"Error al buscar la huella {sha256}: {e}", exc_info=True)
+            return []
+
+    def find_invoice_by_cufe(self, cufe: str) -> Optional[int]:
+        try:
+            row = self.db.query(CufeFactura.id_factura).filter(CufeFactura.cufe == cufe).first()
+            return row.id_factura if row else None
+        except Exception as e:
+            logger.error(f"Error al buscar el CUFE {cufe}: {e}", exc_info=True)
+            return None
+
+    def register(self, sha256: str, facturas: List[Tuple[int, Optional[str]]]) -> bool:
+        """Registra la huella para cada (id_factura, cufe); las que ya existen se ignoran."""
+        try:
+            for id_factura, cufe in facturas:
+                try:
+                    with self.db.begin_nested():
+                        self.db.add(HuellaDocumento(sha256=sha256, id_factura=id_factura, cufe=cufe or None))
+                except IntegrityError:
+                    pass
+            self.db.commit()
+            return True
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error al registrar la huella {sha256}: {e}", exc_info=True)
+            return False
+
+    def link_email(self, ids_factura: List[int], sha256: Optional[str], metadatos: Dict[str, Any], ruta_archivo: Optional[str]) -> bool:
+        try:
+            for id_factura in ids_factura:
+                self.db.add(CorreoDuplicado(
+                    id_factura=id_factura, sha256=sha256, ruta_archivo=ruta_archivo,
+                    asunto_correo=metadatos.get("asunto_correo"),
+                    remitente_correo=metadatos.get("remitente_correo"),
+                    correo_cliente=metadatos.get("correo_cliente"),
+                ))
+            self.db.commit()
+            return True
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error al vincular el correo duplicado a las facturas {ids_factura}: {e}", exc_info=True)
+            return False
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, ForeignKey, inspect, Boolean
+from sqlalchemy import create_engine, func, Column, Integer, BigInteger, String, Float, DateTime, Text, ForeignKey, inspect, Boolean, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, date
@@ -6,6 +6,12 @@ from config.settings import settings
 
 Base = declarative_base()
 
+ORIGEN_CABECERA = "cabecera"
+ORIGEN_ITEM = "item"
+
+CORREO_RECLAMADO = "reclamado"
+CORREO_COMPLETADO = "completado"
+
 class Usuario(Base):
     __tablename__ = 'usuarios'
 
@@ -46,6 +52,9 @@ class Factura(Base):
     items = relationship("ItemFactura", back_populates="factura", cascade="all, delete-orphan")
     campos_corregidos = relationship("CampoCorregido", back_populates="factura", cascade="all, delete-orphan")
     items_corregidos = relationship("ItemCorregido", back_populates="factura", cascade="all, delete-orphan")
+    huellas = relationship("HuellaDocumento", back_populates="factura", cascade="all, delete-orphan")
+    correos_duplicados = relationship("CorreoDuplicado", back_populates="factura", cascade="all, delete-orphan")
+    cufe_registrado = relationship("CufeFactura", back_populates="factura", cascade="all, delete-orphan", uselist=False)
 
     def __repr__(self):
         return (f"<Factura(id={self.id}, numero='{self.numero_factura}', "
@@ -61,12 +70,27 @@ class ItemFactura(Base):
     precio_unitario = Column(Float)
     total_linea = Column(Float)
     factura = relationship("Factura", back_populates="items")
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "id_factura": self.id_factura,
+            "descripcion": self.descripcion,
+            "cantidad": self.cantidad,
+            "precio_unitario": self.precio_unitario,
+            "total_linea": self.total_linea,
+        }
+
     def __repr__(self):
         return (f"<ItemFactura(id={self.id}, id_factura={self.id_factura}, "
                 f"descripcion='{self.descripcion}', total={self.total_linea})>")
 
 class CampoCorregido(Base):
     __tablename__ = 'campos_corregidos'
+    __table_args__ = (
+        Index('ix_campos_corregidos_campo_valor', 'nombre_campo', 'valor_corregido'),
+        Index('ix_campos_corregidos_factura_campo', 'id_factura', 'nombre_campo'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_factura = Column(Integer, ForeignKey('facturas.id'), nullable=False)
     nombre_campo = Column(String(100), nullable=False)
@@ -82,6 +106,9 @@ class CampoCorregido(Base):
 
 class ItemCorregido(Base):
     __tablename__ = 'items_corregidos'
+    __table_args__ = (
+        Index('ix_items_corregidos_factura', 'id_factura'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_factura = Column(Integer, ForeignKey('facturas.id'), nullable=False)
@@ -97,21 +124,176 @@ class ItemCorregido(Base):
         return (f"<ItemCorregido(id_factura={self.id_factura}, tipo='{self.tipo_correccion}', "
                 f"campo='{self.campo_corregido}', valor_corregido='{self.valor_corregido[:50]}...')>")
 
+class ConteoCorreccion(Base):
+    __tablename__ = 'conteos_correcciones'
+    __table_args__ = (
+        UniqueConstraint('origen', 'nombre_campo', 'valor_corregido', name='uq_conteo_origen_campo_valor'),
+        Index('ix_conteos_origen_campo_conteo', 'origen', 'nombre_campo', 'conteo'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    origen = Column(String(20), nullable=False)
+    nombre_campo = Column(String(100), nullable=False)
+    valor_corregido = Column(String(512), nullable=False)
+    conteo = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return (f"<ConteoCorreccion(origen='{self.origen}', campo='{self.nombre_campo}', "
+                f"valor='{self.valor_corregido}', conteo={self.conteo})>")
+
+class EstadoAprendizaje(Base):
+    __tablename__ = 'estado_aprendizaje'
+
+    id = Column(Integer, primary_key=True)
+    cabecera_ultimo_id = Column(Integer, nullable=False, default=0)
+    items_ultimo_id = Column(Integer, nullable=False, default=0)
+    solicitado_en = Column(DateTime)
+    pendiente_desde = Column(DateTime)
+    aprendido_en = Column(DateTime)
+
+    def __repr__(self):
+        return (f"<EstadoAprendizaje(cabecera_ultimo_id={self.cabecera_ultimo_id}, "
+                f"items_ultimo_id={self.items_ultimo_id}, aprendido_en={self.aprendido_en})>")
+
+class ClaveProveedor(Base):
+    __tablename__ = 'claves_proveedor'
+    __table_args__ = (
+        UniqueConstraint('tipo', 'clave', name='uq_clave_proveedor_tipo_clave'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tipo = Column(String(20), nullable=False)
+    clave = Column(String(255), nullable=False)
+    nit_proveedor = Column(String(50))  # NULL cuando la clave apunta a varios proveedores
+    nombre_proveedor = Column(String(255))
+    actualizado_en = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f"<ClaveProveedor(tipo='{self.tipo}', clave='{self.clave}', nit='{self.nit_proveedor}')>"
+
+class CorreoProcesado(Base):
+    __tablename__ = 'correos_procesados'
+    __table_args__ = (
+        UniqueConstraint('cuenta', 'uidvalidity', 'uid', name='uq_correo_cuenta_uidvalidity_uid'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cuenta = Column(String(255), nullable=False)
+    uidvalidity = Column(BigInteger, nullable=False)
+    uid = Column(BigInteger, nullable=False)
+    estado = Column(String(20), nullable=False, default=CORREO_RECLAMADO)
+    nodo = Column(String(255))
+    reclamado_en = Column(DateTime, default=datetime.now)
+    completado_en = Column(DateTime)
+
+    def __repr__(self):
+        return f"<CorreoProcesado(cuenta='{self.cuenta}', uidvalidity={self.uidvalidity}, uid={self.uid}, estado='{self.estado}')>"
+
+class MarcaCorreo(Base):
+    __tablename__ = 'marcas_correo'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cuenta = Column(String(255), unique=True, nullable=False)
+    uidvalidity = Column(BigInteger, nullable=False)
+    uid = Column(BigInteger, nullable=False)
+    actualizado_en = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f"<MarcaCorreo(cuenta='{self.cuenta}', uidvalidity={self.uidvalidity}, uid={self.uid})>"
+
+class HuellaDocumento(Base):
+    __tablename__ = 'huellas_documento'
+    __table_args__ = (
+        UniqueConstraint('sha256', 'id_factura', name='uq_huella_sha256_factura'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sha256 = Column(String(64), nullable=False)
+    cufe = Column(String(255))
+    id_factura = Column(Integer, ForeignKey('facturas.id'), nullable=False)
+    creado_en = Column(DateTime, default=datetime.now)
+
+    factura = relationship("Factura", back_populates="huellas")
+
+    def __repr__(self):
+        return f"<HuellaDocumento(sha256='{self.sha256}', id_factura={self.id_factura})>"
+
+class CufeFactura(Base):
+    __tablename__ = 'cufes_factura'
+
+    # La clave primaria es el CUFE: dos workers que guardan la misma factura a la vez no pueden registrarlo ambos
+    cufe = Column(String(255), primary_key=True)
+    id_factura = Column(Integer, ForeignKey('facturas.id'), nullable=False)
+    creado_en = Column(DateTime, default=datetime.now)
+
+    factura = relationship("Factura", back_populates="cufe_registrado")
+
+    def __repr__(self):
+        return f"<CufeFactura(cufe='{self.cufe}', id_factura={self.id_factura})>"
+
+class CorreoDuplicado(Base):
+    __tablename__ = 'correos_duplicados'
+    __table_args__ = (
+        Index('ix_correos_duplicados_factura', 'id_factura'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    id_factura = Column(Integer, ForeignKey('facturas.id'), nullable=False)
+    sha256 = Column(String(64))
+    asunto_correo = Column(String(512))
+    remitente_correo = Column(String(255))
+    correo_cliente = Column(String(255))
+    ruta_archivo = Column(String(512))
+    recibido_en = Column(DateTime, default=datetime.now)
+
+    factura = relationship("Factura", back_populates="correos_duplicados")
+
+    def __repr__(self):
+        return f"<CorreoDuplicado(id_factura={self.id_factura}, remitente='{self.remitente_correo}')>"
+
 engine = create_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def init_db():
     try:
         inspector = inspect(engine)
-        required_tables = ["facturas", "items_factura", "campos_corregidos", "items_corregidos", "usuarios"]
+        required_tables = ["facturas", "items_factura", "campos_corregidos", "items_corregidos", "usuarios",
+                           "conteos_correcciones", "estado_aprendizaje", "claves_proveedor", "correos_procesados", "marcas_correo",
+                           "huellas_documento", "correos_duplicados", "cufes_factura"]
+        backfill_cufes = not inspector.has_table("cufes_factura")
         if not all(inspector.has_table(table_name) for table_name in required_tables):
             print("Creando o actualizando tablas en la base de datos...")
             Base.metadata.create_all(bind=engine)
             print("Tablas creadas/actualizadas exitosamente.")
         else:
             print("Las tablas ya existen en la base de datos.")
+        _ensure_indexes()
+        if backfill_cufes:
+            _backfill_cufes()
     except Exception as e:
         print(f"Error al inicializar la base de datos: {e}")
 
+def _ensure_indexes():
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                print(f"Índice '{index.name}' creado en '{table.name}'.")
+
+def _backfill_cufes():
+    """Registra en cufes_factura los CUFE de las facturas guardadas antes de que existiera la tabla."""
+    session = SessionLocal()
+    try:
+        rows = session.query(Factura.cufe, func.min(Factura.id)).filter(
+            Factura.cufe.isnot(None), Factura.cufe.notin_(["", "No encontrado"])
+        ).group_by(Factura.cufe).all()
+        session.add_all([CufeFactura(cufe=cufe, id_factura=id_factura) for cufe, id_factura in rows])
+        session.commit()
+        print(f"{len(rows)} CUFE de facturas existentes registrados.")
+    finally:
+        session.close()
+
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
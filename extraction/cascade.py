@@ -0,0 +1,150 @@
+import logging
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+from config.settings import settings
+from extraction.combiner import ResultCombiner
+from extraction.nlp_parser import NLPParser
+from extraction.ocr_engine import OCREngine
+from extraction.regex_parser import RegexParser
+
+logger = logging.getLogger(__name__)
+
+# Factor aplicado a la confianza de cada campo según la etapa que lo produjo
+STAGE_RELIABILITY = {
+    "xml": 1.0,
+    "plantilla": 1.0,
+    "regex": 1.0,
+    "nlp": 0.9,
+    "ocr": 0.8,
+}
+
+def stage_threshold(stage: str) -> float:
+    if stage == "nlp":
+        return settings.CONFIDENCE_THRESHOLD_NLP
+    if stage == "ocr":
+        return settings.CONFIDENCE_THRESHOLD_OCR
+    return settings.CONFIDENCE_THRESHOLD_REGEX
+
+def score_fields(data: Dict[str, Any], stage: str) -> Dict[str, float]:
+    """Confianza por campo a partir de comprobaciones baratas sobre el valor (tipo, rango, coherencia de totales)."""
+    subtotal, tax, total = data.get("subtotal_amount"), data.get("tax_amount"), data.get("total_amount")
+    totals_consistent = None
+    if all(isinstance(value, (int, float)) for value in (subtotal, tax, total)):
+        totals_consistent = abs(subtotal + tax - total) <= max(1.0, abs(total) * 0.01)
+    scores: Dict[str, float] = {}
+    for field, value in data.items():
+        if value is None or field == "items":
+            continue
+        if "amount" in field:
+            if not isinstance(value, (int, float)) or value < 0:
+                score = 0.3
+            elif totals_consistent is None:
+                score = 0.9
+            else:
+                score = 1.0 if totals_consistent else 0.5
+        elif "date" in field:
+            score = 0.95 if isinstance(value, datetime) and 2000 <= value.year <= datetime.now().year + 1 else 0.3
+        elif "tax_id" in field:
+            score = 0.95 if 6 <= len(re.sub(r'\D', '', str(value))) <= 15 else 0.4
+        elif field == "invoice_number":
+            score = 0.95 if re.search(r'\d', str(value)) else 0.4
+        elif field == "cufe":
+            score = 0.95 if len(str(value)) >= 32 else 0.4
+        else:
+            score = 0.9 if len(str(value).strip()) >= 3 else 0.4
+        scores[field] = round(score * STAGE_RELIABILITY.get(stage, 1.0), 3)
+    return scores
+
+class ExtractionCascade:
+    """Ejecuta las fuentes de la más barata a la más costosa pidiendo a cada una solo los campos pendientes.
+
+    Un campo queda resuelto cuando su mejor valor supera el umbral de confianza de la etapa que lo produjo.
+    Las etapas posteriores (NLP, OCR + regex) solo se ejecutan mientras falte algún campo obligatorio,
+    y el modelo spaCy y el motor OCR se cargan la primera vez que se necesitan.
+    """
+
+    def __init__(self, fields: Optional[List[str]] = None, required_fields: Optional[List[str]] = None):
+        self.regex_parser = RegexParser()
+        self.combiner = ResultCombiner()
+        self.fields = fields or list(dict.fromkeys(self.combiner.expected_fields + [
+            "subtotal_amount", "tax_amount", "due_date", "cufe", "payment_method"]))
+        self.required_fields = required_fields or settings.CASCADE_REQUIRED_FIELDS
+        self._nlp_parser = None
+        self._ocr_engine = None
+        self._lock = threading.Lock()
+
+    @property
+    def nlp_parser(self):
+        with self._lock:
+            if self._nlp_parser is None:
+                self._nlp_parser = NLPParser()
+            return self._nlp_parser
+
+    @property
+    def ocr_engine(self):
+        with self._lock:
+            if self._ocr_engine is None:
+                self._ocr_engine = OCREngine()
+            return self._ocr_engine
+
+    def pending_fields(self, stage_results: List[Tuple[str, Dict[str, Any], Dict[str, float]]]) -> Set[str]:
+        """Campos sin valor o cuyo mejor valor no alcanza el umbral de su etapa."""
+        best: Dict[str, Tuple[str, float]] = {}
+        for stage, data, confidences in stage_results:
+            for field, confidence in confidences.items():
+                if data.get(field) is not None and (field not in best or confidence > best[field][1]):
+                    best[field] = (stage, confidence)
+        return {field for field in self.fields
+                if field not in best or best[field][1] < stage_threshold(best[field][0])}
+
+    def _needs_more(self, pending: Set[str]) -> bool:
+        return any(field in pending for field in self.required_fields)
+
+    def run(self, text: str, pdf_path: Optional[str] = None,
+            prior_results: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> Dict[str, Any]:
+        """Extrae los campos de cabecera de `text` (capa de texto del PDF).
+
+        `prior_results` son (etapa, datos) ya obtenidos por fuentes más baratas (XML, plantilla del proveedor).
+        Devuelve los datos combinados con 'field_sources', 'field_confidence' y 'raw_text' (incluye el OCR si se usó).
+        """
+        stage_results = [(stage, data, score_fields(data, stage)) for stage, data in (prior_results or []) if data]
+        full_text = text or ""
+        pending = self.pending_fields(stage_results)
+
+        if pending and full_text.strip():
+            regex_data = self.regex_parser.extract_fields(full_text, fields=pending)
+            stage_results.append(("regex", regex_data, score_fields(regex_data, "regex")))
+            pending = self.pending_fields(stage_results)
+
+        if self._needs_more(pending) and full_text.strip():
+            nlp_data = {field: value for field, value in self.nlp_parser.extract_entities(full_text).items() if field in pending}
+            for field, value in nlp_data.items():
+                if isinstance(value, str) and ("date" in field or "amount" in field):
+                    nlp_data[field] = self.regex_parser.convert_field_value(field, value)
+            stage_results.append(("nlp", nlp_data, score_fields(nlp_data, "nlp")))
+            pending = self.pending_fields(stage_results)
+
+        if self._needs_more(pending) and pdf_path:
+            ocr_text = self.ocr_engine.pdf_to_text_ocr(pdf_path)
+            if ocr_text and ocr_text.strip() and ocr_text not in full_text:
+                ocr_data = self.regex_parser.extract_fields(ocr_text, fields=pending)
+                stage_results.append(("ocr", ocr_data, score_fields(ocr_data, "ocr")))
+                full_text = f"{full_text}\n{ocr_text}" if full_text else ocr_text
+
+        logger.info(f"Cascada de extracción: etapas ejecutadas {[stage for stage, _, _ in stage_results]}, "
+                    f"campos obligatorios pendientes {sorted(set(self.required_fields) & self.pending_fields(stage_results))}.")
+        combined_data = self.combiner.combine_stages(stage_results)
+        combined_data["raw_text"] = full_text
+        return combined_data
+
+_cascade: Optional[ExtractionCascade] = None
+_cascade_lock = threading.Lock()
+
+def get_extraction_cascade() -> ExtractionCascade:
+    global _cascade
+    with _cascade_lock:
+        if _cascade is None:
+            _cascade = ExtractionCascade()
+        return _cascade
@@ -1,5 +1,5 @@
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime
 logger = logging.getLogger(__name__)
 class ResultCombiner:
@@ -44,6 +44,29 @@ class ResultCombiner:
         self._cast_types(combined_data)
         logger.info("Combinación de resultados finalizada.")
         return combined_data
+    def combine_stages(self, stage_results: List[Tuple[str, Dict[str, Any], Dict[str, float]]]) -> Dict[str, Any]:
+        """Combina (etapa, datos, confianzas) quedándose por campo con el valor de mayor confianza.
+
+        Registra en 'field_sources' y 'field_confidence' la etapa y la confianza de cada valor usado.
+        """
+        combined_data: Dict[str, Any] = {field: None for field in self.expected_fields}
+        field_sources: Dict[str, str] = {}
+        field_confidence: Dict[str, float] = {}
+        for stage, data, confidences in stage_results:
+            for field, value in data.items():
+                if value is None or field == "items":
+                    continue
+                confidence = confidences.get(field, 0.0)
+                if field not in field_sources or confidence > field_confidence[field]:
+                    combined_data[field] = value
+                    field_sources[field] = stage
+                    field_confidence[field] = confidence
+                    logger.debug(f"Combiner: '{field}' tomado de {stage} (confianza {confidence:.2f}): {value}")
+        self._cast_types(combined_data)
+        combined_data["field_sources"] = field_sources
+        combined_data["field_confidence"] = field_confidence
+        logger.info("Combinación de resultados por etapas finalizada.")
+        return combined_data
     def _cast_types(self, data: Dict[str, Any]):
         if 'total_amount' in data and data['total_amount'] is not None:
             try:
@@ -4,6 +4,7 @@ import json
 import os   
 from typing import Dict, Any, List, Optional
 from config.settings import settings
+from learning.pattern_store import get_pattern_store
 from datetime import datetime 
 from spacy.pipeline import EntityRuler 
 from spacy.matcher import PhraseMatcher
@@ -17,6 +18,7 @@ class NLPParser:
             self.nlp = spacy.load(settings.SPACY_MODEL)
             self.matcher = PhraseMatcher(self.nlp.vocab) 
             self._add_default_patterns()
+            self.pattern_store = get_pattern_store()
             self._load_learned_nlp_terms()
             logger.info(f"Modelo spaCy '{settings.SPACY_MODEL}' cargado exitosamente.")
         except OSError:
@@ -33,31 +35,34 @@ class NLPParser:
         logger.info("Patrones por defecto añadidos al PhraseMatcher de NLPParser.")
 
     def _load_learned_nlp_terms(self):
-        if os.path.exists(settings.LEARNED_PATTERNS_FILE):
-            with open(settings.LEARNED_PATTERNS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    patterns_data = json.load(f)
-                    learned_terms = patterns_data.get("nlp_terms", [])
-                    
-                    if learned_terms:
-                        if "entity_ruler" not in self.nlp.pipe_names:
-                            ruler = self.nlp.add_pipe("entity_ruler", before="ner")
-                        else:
-                            ruler = self.nlp.get_pipe("entity_ruler")
-                        
-                        existing_patterns_text = {p['pattern'] for p in ruler.patterns}
-                        new_patterns = []
-                        for term in learned_terms:
-                            if term not in existing_patterns_text:
-                                new_patterns.append({"label": "LEARNED_TERM", "pattern": term})
-                        
-                        if new_patterns:
-                            ruler.add_patterns(new_patterns)
-                            logger.info(f"NLPParser: Añadidos {len(new_patterns)} términos aprendidos al EntityRuler.")
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error al decodificar JSON de patrones aprendidos para NLPParser: {e}. No se añadirán términos aprendidos.")
+        patterns_data, self.learned_terms_version = self.pattern_store.get_with_version()
+        learned_terms = patterns_data.get("nlp_terms", [])
+        if not learned_terms:
+            logger.info("NLPParser: No hay términos aprendidos para añadir al EntityRuler.")
+            return
+
+        if "entity_ruler" not in self.nlp.pipe_names:
+            ruler = self.nlp.add_pipe("entity_ruler", before="ner")
         else:
-            logger.info("No se encontró el archivo de patrones aprendidos para NLPParser. No se añadirán términos aprendidos.")
+            ruler = self.nlp.get_pipe("entity_ruler")
+
+        existing_patterns_text = {p['pattern'] for p in ruler.patterns}
+        new_patterns = []
+        for term in learned_terms:
+            if term not in existing_patterns_text:
+                new_patterns.append({"label": "LEARNED_TERM", "pattern": term})
+
+        if new_patterns:
+            ruler.add_patterns(new_patterns)
+            logger.info(f"NLPParser: Añadidos {len(new_patterns)} términos aprendidos al EntityRuler.")
+
+    def _refresh_learned_nlp_terms(self):
+        if self.pattern_store.version() == self.learned_terms_version:
+            return
+        if "entity_ruler" in self.nlp.pipe_names:
+            self.nlp.get_pipe("entity_ruler").clear()
+        self._load_learned_nlp_terms()
+        logger.info(f"NLPParser actualizó sus términos aprendidos a la versión {self.learned_terms_version}.")
 
     def _parse_amount(self, value: str) -> Optional[float]:
         value = value.strip()
@@ -114,6 +119,7 @@ class NLPParser:
         return None
     
     def extract_entities(self, text: str, invoice_id: Optional[int] = None) -> Dict[str, Any]:
+        self._refresh_learned_nlp_terms()
         doc = self.nlp(text)
         extracted_data: Dict[str, Any] = {}
         
@@ -173,7 +179,12 @@ class NLPParserML:
             raise
 
     def extract_entities(self, text: str) -> Dict[str, Any]:
-        doc = self.nlp(text)
+        return self._entities_from_doc(self.nlp(text))
+
+    def extract_entities_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        return [self._entities_from_doc(doc) for doc in self.nlp.pipe(texts)]
+
+    def _entities_from_doc(self, doc) -> Dict[str, Any]:
         extracted_data = {}
 
         for ent in doc.ents:
@@ -0,0 +1,78 @@
+import logging
+import os
+import re
+from typing import Dict, List, Tuple
+import pypdfium2 as pdfium
+from extraction.supplier_index import header_fingerprint
+
+logger = logging.getLogger(__name__)
+
+CUFE_PATTERN = re.compile(r'(?<![0-9a-fA-F])[0-9a-fA-F]{96}(?![0-9a-fA-F])')
+NUMERO_FACTURA_PATTERN = re.compile(
+    r'factura(?:\s+electr[oó]nica)?(?:\s+de\s+venta)?\s*(?:n[oº°]\.?|número|numero|#)\s*[:.]?\s*([A-Z]{0,6}-?\d{2,})',
+    re.IGNORECASE)
+PRIMERA_PAGINA_PATTERN = re.compile(r'p[áa]g(?:ina)?\.?\s*1\s*(?:de|/)\s*\d+', re.IGNORECASE)
+TOTAL_FACTURA_PATTERN = re.compile(
+    r'^[ \t]*(?:valor[ \t]+)?total(?:[ \t]+(?:a[ \t]+pagar|factura|general|neto))?[ \t]*[:=]?[ \t]*\$?[ \t]*\d[\d.,]*',
+    re.IGNORECASE | re.MULTILINE)
+
+def identificadores_de_pagina(texto: str) -> Dict[str, set]:
+    return {
+        "cufe": {cufe.lower() for cufe in CUFE_PATTERN.findall(texto or "")},
+        "numero": {numero.upper().replace('-', '') for numero in NUMERO_FACTURA_PATTERN.findall(texto or "")},
+    }
+
+def detectar_facturas(page_texts: List[str]) -> List[Tuple[int, int]]:
+    """Divide las páginas de un PDF en rangos [inicio, fin) de una factura cada uno.
+
+    Una página abre una factura nueva si trae un CUFE o un número de factura distinto del que ya
+    tiene la factura en curso, o si dice ser la página 1. Si ninguna página trae identificadores,
+    se usa la repetición del bloque de encabezado de la primera página de la factura en curso, pero
+    solo si esa factura ya mostró su total: una factura de varias páginas repite el encabezado en cada una.
+    """
+    if len(page_texts) < 2:
+        return [(0, len(page_texts))] if page_texts else []
+    identificadores = [identificadores_de_pagina(texto) for texto in page_texts]
+    sin_identificadores = not any(ids["cufe"] or ids["numero"] for ids in identificadores)
+    rangos = []
+    inicio = 0
+    actuales = {"cufe": set(), "numero": set()}
+    encabezado = header_fingerprint(page_texts[0])
+    cerrada = False
+    for indice in range(len(page_texts)):
+        ids = identificadores[indice]
+        if indice > inicio:
+            nueva = any(ids[clave] and actuales[clave] and not ids[clave] & actuales[clave] for clave in ids)
+            nueva = nueva or bool(PRIMERA_PAGINA_PATTERN.search(page_texts[indice]))
+            if sin_identificadores and not nueva:
+                nueva = cerrada and encabezado is not None and header_fingerprint(page_texts[indice]) == encabezado
+            if nueva:
+                rangos.append((inicio, indice))
+                inicio = indice
+                actuales = {"cufe": set(), "numero": set()}
+                encabezado = header_fingerprint(page_texts[indice])
+                cerrada = False
+        for clave in ids:
+            actuales[clave] |= ids[clave]
+        cerrada = cerrada or bool(TOTAL_FACTURA_PATTERN.search(page_texts[indice] or ""))
+    rangos.append((inicio, len(page_texts)))
+    return rangos
+
+def escribir_rangos(pdf_path: str, rangos: List[Tuple[int, int]], directorio: str) -> List[str]:
+    """Escribe un PDF por rango de páginas en `directorio` y devuelve sus rutas."""
+    base = os.path.splitext(os.path.basename(pdf_path))[0]
+    paths = []
+    doc = pdfium.PdfDocument(pdf_path)
+    try:
+        for inicio, fin in rangos:
+            parte = pdfium.PdfDocument.new()
+            try:
+                parte.import_pages(doc, list(range(inicio, fin)))
+                path = os.path.join(directorio, f"{base}_p{inicio + 1:03d}-{fin:03d}.pdf")
+                parte.save(path)
+                paths.append(path)
+            finally:
+                parte.close()
+    finally:
+        doc.close()
+    return paths
@@ -2,10 +2,11 @@ import re
 import logging
 import json 
 import os 
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterable
 from datetime import datetime
 from difflib import SequenceMatcher
 from config.settings import settings 
+from learning.pattern_store import get_pattern_store
 logger = logging.getLogger(__name__)
 class RegexParser:
     def __init__(self):
@@ -26,6 +27,7 @@ class RegexParser:
             "email": r"([\w\.-]+@[\w\.-]+(?:\.\w+)+)"        
             }
         
+        self.pattern_store = get_pattern_store()
         self.learned_patterns = self._load_learned_patterns_from_file()
         self.combined_patterns = {**self.base_patterns, **self.learned_patterns.get("regex_patterns", {})}
 
@@ -43,23 +45,36 @@ class RegexParser:
         }
 
     def _load_learned_patterns_from_file(self) -> Dict[str, Any]:
-        """Carga los patrones aprendidos desde el archivo JSON persistente."""
-        if os.path.exists(settings.LEARNED_PATTERNS_FILE):
-            with open(settings.LEARNED_PATTERNS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    patterns_data = json.load(f)
-                    logger.info(f"RegexParser ha cargado patrones aprendidos desde {settings.LEARNED_PATTERNS_FILE}")
-                    return patterns_data
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error al decodificar JSON de patrones aprendidos para RegexParser: {e}. Se usará un diccionario vacío para patrones regex.")
-                    return {"regex_patterns": {}}
-        logger.info("No se encontró el archivo de patrones aprendidos para RegexParser. Se iniciará con patrones base.")
-        return {"regex_patterns": {}}
-    def _normalizar_nit(self, nit: str) -> str:
+        """Carga los patrones aprendidos desde el almacén compartido; solo relee el archivo si cambió."""
+        patterns_data, self.learned_patterns_version = self.pattern_store.get_with_version()
+        return patterns_data
+
+    def _refresh_learned_patterns(self):
+        if self.pattern_store.version() != self.learned_patterns_version:
+            self.learned_patterns = self._load_learned_patterns_from_file()
+            self.combined_patterns = {**self.base_patterns, **self.learned_patterns.get("regex_patterns", {})}
+            logger.info(f"RegexParser actualizó sus patrones aprendidos a la versión {self.learned_patterns_version}.")
+
+    @staticmethod
+    def _normalizar_nit(nit: str) -> str:
         if nit:
             return re.sub(r'[\.\-\s]', '', nit)
         return nit
 
+    @staticmethod
+    def parse_subject(asunto_correo: Optional[str]) -> Optional[Dict[str, str]]:
+        """Interpreta el asunto con formato 'NIT;Empresa;Prefijo;Número;...' de la facturación electrónica."""
+        if not asunto_correo:
+            return None
+        partes_asunto = asunto_correo.strip().split(";")
+        if len(partes_asunto) < 4:
+            return None
+        return {
+            "nit": RegexParser._normalizar_nit(partes_asunto[0].strip()),
+            "empresa": partes_asunto[1].strip(),
+            "factura": f"{partes_asunto[2].strip()}{partes_asunto[3].strip()}".replace(' ', '').upper(),
+        }
+
     def _similares(self, a: str, b: str) -> float:
         if not a or not b:
             return 0.0
@@ -112,67 +127,69 @@ class RegexParser:
         logger.warning(f"No se pudo parsear la fecha '{value}' con los formatos conocidos.")
         return None
 
-    def extract_fields(self, text: str, remitente_correo: Optional[str] = None, asunto_correo: Optional[str] = None, invoice_id: Optional[int] = None) -> Dict[str, Any]:
+    def convert_field_value(self, field: str, value: str) -> Any:
+        """Convierte el texto capturado para un campo a su tipo (monto, fecha, NIT normalizado, moneda, CUFE)."""
+        if "amount" in field:
+            return self._parse_amount(value)
+        if "date" in field:
+            return self._parse_date(value)
+        if "tax_id" in field:
+            return self._normalizar_nit(value)
+        if field == "currency":
+            if '$' in value:
+                return 'COP'
+            if '€' in value:
+                return 'EUR'
+            if 'USD' in value.upper():
+                return 'USD'
+            if 'MXN' in value.upper():
+                return 'MXN'
+            return value.upper()
+        if field == "cufe":
+            url_match = re.search(r'https?:\/\/(?:www\.)?dian\.gov\.co\/validador\/.*\?cufe=([0-9a-fA-F\-]{32,96})', value, re.IGNORECASE)
+            if url_match:
+                return url_match.group(1).strip()
+        return value
+
+    def extract_fields(self, text: str, remitente_correo: Optional[str] = None, asunto_correo: Optional[str] = None, invoice_id: Optional[int] = None,
+                       fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Extrae los campos con los patrones base y aprendidos; con `fields` solo se evalúan esos campos."""
+        self._refresh_learned_patterns()
+        requested = set(fields) if fields is not None else None
         extracted_data: Dict[str, Any] = {}
         for field, pattern in self.combined_patterns.items():
+            if requested is not None and field not in requested:
+                continue
             match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
             if match and field not in extracted_data:  # Solo extraer si el campo no está en los datos del XML
-                extracted_data[field] = match.group(1).strip()
-                if "amount" in field:
-                    extracted_data[field] = self._parse_amount(extracted_data[field])
-                elif "date" in field:
-                    extracted_data[field] = self._parse_date(extracted_data[field])
-                elif "tax_id" in field:
-                    extracted_data[field] = self._normalizar_nit(extracted_data[field])
-                elif field == "currency":
-                    if '$' in extracted_data[field]:
-                        extracted_data[field] = 'COP'
-                    elif '€' in extracted_data[field]:
-                        extracted_data[field] = 'EUR'
-                    elif 'USD' in extracted_data[field].upper():
-                        extracted_data[field] = 'USD'
-                    elif 'MXN' in extracted_data[field].upper():
-                        extracted_data[field] = 'MXN'
-                    else:
-                        extracted_data[field] = extracted_data[field].upper() 
-                elif field == "cufe":
-                    url_match = re.search(r'https?:\/\/(?:www\.)?dian\.gov\.co\/validador\/.*\?cufe=([0-9a-fA-F\-]{32,96})', extracted_data[field], re.IGNORECASE)
-                    if url_match:
-                        extracted_data[field] = url_match.group(1).strip()
-                    else:
-                        extracted_data[field] = extracted_data[field]
-                elif field == "email": 
-                    extracted_data[field] = extracted_data[field]
-                else:
-                    extracted_data[field] = extracted_data[field]
+                extracted_data[field] = self.convert_field_value(field, match.group(1).strip())
                 logger.debug(f"Regex: Extraído '{field}': '{extracted_data.get(field)}' de '{extracted_data[field]}'")
             else:
                 extracted_data[field] = None
                 logger.debug(f"Regex: No se encontró '{field}'.")
 
-        if not extracted_data.get("supplier_name") and remitente_correo:
+        if "supplier_name" in extracted_data and not extracted_data["supplier_name"] and remitente_correo:
             if '@' in remitente_correo:
                 domain_part = remitente_correo.split('@')[1].split('.')[0]
                 if domain_part and len(domain_part) > 2:
                     extracted_data["supplier_name"] = domain_part.replace('-', ' ').replace('_', ' ').title()
                     logger.debug(f"Info Email: Extraído 'supplier_name': '{extracted_data['supplier_name']}' del dominio del remitente.")
         
-        if asunto_correo:
-            partes_asunto = asunto_correo.strip().split(";")
-            if len(partes_asunto) >= 4: 
-                nit_asunto = self._normalizar_nit(partes_asunto[0].strip())
-                empresa_asunto = partes_asunto[1].strip()
-                factura_asunto = f"{partes_asunto[2].strip()}{partes_asunto[3].strip()}".replace(' ', '').upper()
-                
-                if nit_asunto and (not extracted_data.get("supplier_tax_id") or self._similares(extracted_data["supplier_tax_id"], nit_asunto) < 0.7):
-                    extracted_data["supplier_tax_id"] = nit_asunto
-                    logger.debug(f"Info Asunto: Extraído 'supplier_tax_id': '{nit_asunto}' del asunto del correo.")
-                if empresa_asunto and (not extracted_data.get("supplier_name") or self._similares(extracted_data["supplier_name"], empresa_asunto) < 0.7):
-                    extracted_data["supplier_name"] = empresa_asunto
-                    logger.debug(f"Info Asunto: Extraído 'supplier_name': '{empresa_asunto}' del asunto del correo.")
-                if factura_asunto and (not extracted_data.get("invoice_number") or self._similares(extracted_data["invoice_number"], factura_asunto) < 0.7):
-                    extracted_data["invoice_number"] = factura_asunto
-                    logger.debug(f"Info Asunto: Extraído 'invoice_number': '{factura_asunto}' del asunto del correo.")
+        asunto = self.parse_subject(asunto_correo)
+        if asunto:
+            nit_asunto = asunto["nit"]
+            empresa_asunto = asunto["empresa"]
+            factura_asunto = asunto["factura"]
+
+            if nit_asunto and "supplier_tax_id" in extracted_data and (not extracted_data["supplier_tax_id"] or self._similares(extracted_data["supplier_tax_id"], nit_asunto) < 0.7):
+                extracted_data["supplier_tax_id"] = nit_asunto
+                logger.debug(f"Info Asunto: Extraído 'supplier_tax_id': '{nit_asunto}' del asunto del correo.")
+            if empresa_asunto and "supplier_name" in extracted_data and (not extracted_data["supplier_name"] or self._similares(extracted_data["supplier_name"], empresa_asunto) < 0.7):
+                extracted_data["supplier_name"] = empresa_asunto
+                logger.debug(f"Info Asunto: Extraído 'supplier_name': '{empresa_asunto}' del asunto del correo.")
+            if factura_asunto and "invoice_number" in extracted_data and (not extracted_data["invoice_number"] or self._similares(extracted_data["invoice_number"], factura_asunto) < 0.7):
+                extracted_data["invoice_number"] = factura_asunto
+                logger.debug(f"Info Asunto: Extraído 'invoice_number': '{factura_asunto}' del asunto del correo.")
 
         return extracted_data
 
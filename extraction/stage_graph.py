@@ -0,0 +1,61 @@
+import logging
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    """Etapa del grafo: `func` recibe, en orden, los valores de `inputs` y su resultado se publica con `name`."""
+
+    def __init__(self, name: str, func: Callable[..., Any], inputs: Sequence[str] = ()):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+
+class StageGraph:
+    """Ejecuta etapas en cuanto sus entradas están disponibles; las independientes corren a la vez en el pool.
+
+    Usa hilos: las etapas costosas (camelot/tabula, tesseract) pasan la mayor parte del tiempo en código
+    nativo o en subprocesos, y así comparten los extractores ya cargados sin serializarlos.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+
+    def run(self, initial: Dict[str, Any], executor: Optional[Executor] = None) -> Dict[str, Any]:
+        results = dict(initial)
+        unknown = {name for stage in self.stages.values() for name in stage.inputs} - set(self.stages) - set(results)
+        if unknown:
+            raise ValueError(f"Entradas sin etapa ni valor inicial: {sorted(unknown)}")
+        executor = executor or get_stage_executor()
+        pending = dict(self.stages)
+        running: Dict[Future, str] = {}
+        while pending or running:
+            ready = [stage for stage in pending.values() if all(name in results for name in stage.inputs)]
+            for stage in ready:
+                del pending[stage.name]
+            if len(ready) == 1 and not running:
+                # Sin nada en paralelo no vale la pena cambiar de hilo
+                stage = ready[0]
+                results[stage.name] = stage.func(*[results[name] for name in stage.inputs])
+                continue
+            for stage in ready:
+                running[executor.submit(stage.func, *[results[name] for name in stage.inputs])] = stage.name
+            if not running:
+                raise ValueError(f"Dependencias circulares entre las etapas: {sorted(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+        return results
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_stage_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.STAGE_GRAPH_WORKERS, thread_name_prefix="etapa")
+        return _executor
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from email.utils import parseaddr
+from typing import Any, Dict, List, Optional, Tuple
+from config.settings import settings
+from database.crud import SupplierKeyCRUD
+from database.models import SessionLocal
+from extraction.classifier import InvoiceClassifier
+from extraction.regex_parser import RegexParser
+
+logger = logging.getLogger(__name__)
+
+CLAVE_NIT = "nit"
+CLAVE_REMITENTE = "remitente"
+CLAVE_DOMINIO = "dominio"
+CLAVE_HUELLA = "huella"
+
+def normalize_email(remitente: Optional[str]) -> Optional[str]:
+    if not remitente:
+        return None
+    address = parseaddr(remitente)[1].strip().lower()
+    return address if '@' in address else None
+
+def email_domain(remitente: Optional[str]) -> Optional[str]:
+    address = normalize_email(remitente)
+    if not address:
+        return None
+    domain = address.rsplit('@', 1)[1]
+    return None if domain in settings.GENERIC_EMAIL_DOMAINS else domain
+
+def header_fingerprint(text: Optional[str], lines: Optional[int] = None) -> Optional[str]:
+    """Huella de las primeras líneas del documento; los dígitos se enmascaran para que número y fecha no la cambien."""
+    if not text:
+        return None
+    lines = lines or settings.SUPPLIER_FINGERPRINT_LINES
+    header = []
+    for line in text.splitlines():
+        normalized = re.sub(r'\s+', ' ', re.sub(r'\d', '#', line)).strip().lower()
+        if normalized:
+            header.append(normalized)
+        if len(header) >= lines:
+            break
+    if len(header) < lines:
+        return None
+    return hashlib.sha1('\n'.join(header).encode('utf-8')).hexdigest()
+
+class SupplierIndex:
+    """Identifica al proveedor con búsquedas exactas (NIT, remitente, dominio, huella del encabezado).
+
+    El clasificador de texto solo se consulta si ninguna clave coincide. Las claves se aprenden
+    de las facturas guardadas y se persisten en la tabla claves_proveedor.
+    """
+
+    def __init__(self, refresh_seconds: Optional[int] = None):
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else settings.SUPPLIER_INDEX_REFRESH_SECONDS
+        self._lock = threading.Lock()
+        self._keys: Dict[Tuple[str, str], Tuple[Optional[str], Optional[str]]] = {}
+        self._loaded_at: Optional[float] = None
+        self._classifier = None
+        self._classifier_loaded = False
+
+    def refresh(self):
+        db_session = SessionLocal()
+        try:
+            rows = SupplierKeyCRUD(db_session).get_all_keys()
+            keys = {(row.tipo, row.clave): (row.nit_proveedor, row.nombre_proveedor) for row in rows}
+        finally:
+            db_session.close()
+        with self._lock:
+            self._keys = keys
+            self._loaded_at = time.monotonic()
+        logger.info(f"Índice de proveedores cargado con {len(keys)} claves.")
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.refresh()
+
+    def _lookup(self, tipo: str, clave: Optional[str]) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        if not clave:
+            return None
+        with self._lock:
+            value = self._keys.get((tipo, clave))
+        if value is None or value[0] is None:
+            return None
+        return value
+
+    def identify(self, nit: Optional[str] = None, remitente: Optional[str] = None, asunto: Optional[str] = None,
+                 text: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Devuelve {'nit', 'nombre', 'fuente'} del proveedor o None si no se pudo identificar."""
+        self._ensure_fresh()
+        asunto_data = RegexParser.parse_subject(asunto)
+        for fuente, candidate_nit in (("nit", RegexParser._normalizar_nit(nit) if nit else None),
+                                      ("asunto", asunto_data["nit"] if asunto_data else None)):
+            if candidate_nit:
+                known = self._lookup(CLAVE_NIT, candidate_nit)
+                nombre = known[1] if known else (asunto_data["empresa"] if asunto_data and fuente == "asunto" else None)
+                return {"nit": candidate_nit, "nombre": nombre, "fuente": fuente}
+        for fuente, tipo, clave in (("remitente", CLAVE_REMITENTE, normalize_email(remitente)),
+                                    ("dominio", CLAVE_DOMINIO, email_domain(remitente)),
+                                    ("huella", CLAVE_HUELLA, header_fingerprint(text))):
+            known = self._lookup(tipo, clave)
+            if known:
+                return {"nit": known[0], "nombre": known[1], "fuente": fuente}
+        return self._classify(text)
+
+    def _classify(self, text: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not text:
+            return None
+        if not self._classifier_loaded:
+            self._classifier_loaded = True
+            if settings.SUPPLIER_CLASSIFIER_MODEL_PATH and os.path.exists(settings.SUPPLIER_CLASSIFIER_MODEL_PATH):
+                self._classifier = InvoiceClassifier(settings.SUPPLIER_CLASSIFIER_MODEL_PATH)
+        if self._classifier is None:
+            return None
+        try:
+            label = str(self._classifier.classify_invoice(text))
+        except Exception as e:
+            logger.error(f"Error al clasificar el proveedor con el modelo: {e}")
+            return None
+        known = self._lookup(CLAVE_NIT, RegexParser._normalizar_nit(label))
+        if known:
+            return {"nit": known[0], "nombre": known[1], "fuente": "clasificador"}
+        return {"nit": None, "nombre": label, "fuente": "clasificador"}
+
+    def keys_for(self, nit: str, invoice_data: Dict[str, Any]) -> List[Tuple[str, str]]:
+        keys = [(CLAVE_NIT, nit)]
+        for tipo, clave in ((CLAVE_REMITENTE, normalize_email(invoice_data.get("remitente_correo"))),
+                            (CLAVE_REMITENTE, normalize_email(invoice_data.get("email_proveedor"))),
+                            (CLAVE_DOMINIO, email_domain(invoice_data.get("remitente_correo"))),
+                            (CLAVE_HUELLA, header_fingerprint(invoice_data.get("raw_text")))):
+            if clave and (tipo, clave) not in keys:
+                keys.append((tipo, clave))
+        return keys
+
+    def register(self, invoice_data: Dict[str, Any]) -> None:
+        """Aprende las claves de una factura guardada cuyo NIT de proveedor se conoce."""
+        nit = RegexParser._normalizar_nit(invoice_data.get("nit_proveedor") or invoice_data.get("supplier_tax_id"))
+        if not nit:
+            return
+        nombre = invoice_data.get("nombre_proveedor") or invoice_data.get("supplier_name")
+        db_session = SessionLocal()
+        try:
+            rows = SupplierKeyCRUD(db_session).upsert_keys(nit, nombre, self.keys_for(nit, invoice_data))
+            with self._lock:
+                for row in rows:
+                    self._keys[(row.tipo, row.clave)] = (row.nit_proveedor, row.nombre_proveedor)
+        finally:
+            db_session.close()
+
+_index: Optional[SupplierIndex] = None
+_index_lock = threading.Lock()
+
+def get_supplier_index() -> SupplierIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SupplierIndex()
+        return _index
@@ -158,37 +158,40 @@ import logging
 import camelot
 import tabula
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import re
 
 logger = logging.getLogger(__name__)
 
 class TableExtractor:
     def __init__(self):
-        pass
+        self.last_strategy: Optional[Dict[str, Any]] = None
 
-    def extract_tables_camelot(self, pdf_path: str, flavor: str = 'lattice') -> List[pd.DataFrame]:
+    def extract_tables_camelot(self, pdf_path: str, flavor: str = 'lattice', pages: str = 'all') -> List[pd.DataFrame]:
+        return [df for _, df in self._camelot_tables(pdf_path, flavor, pages)]
+
+    def _camelot_tables(self, pdf_path: str, flavor: str, pages: str = 'all') -> List[Tuple[str, pd.DataFrame]]:
         tables = []
         try:
             if flavor == 'lattice':
-                extracted_tables = camelot.read_pdf(pdf_path, pages='all', flavor=flavor,
+                extracted_tables = camelot.read_pdf(pdf_path, pages=pages, flavor=flavor,
                                                     line_scale=40)
             elif flavor == 'stream':
-                extracted_tables = camelot.read_pdf(pdf_path, pages='all', flavor=flavor,
+                extracted_tables = camelot.read_pdf(pdf_path, pages=pages, flavor=flavor,
                                                     row_tol=10)
             else:
                 raise ValueError("Flavor no válido para Camelot. Debe ser 'lattice' o 'stream'.")
             logger.info(f"Camelot extrajo {len(extracted_tables)} tablas del PDF '{pdf_path}' con flavor '{flavor}'.")
             for table in extracted_tables:
-                tables.append(table.df)
+                tables.append((str(table.page), table.df))
         except Exception as e:
             logger.warning(f"Error al extraer tablas con Camelot (flavor '{flavor}') de '{pdf_path}': {e}")
         return tables
 
-    def extract_tables_tabula(self, pdf_path: str) -> List[pd.DataFrame]:
+    def extract_tables_tabula(self, pdf_path: str, pages: str = 'all') -> List[pd.DataFrame]:
         tables = []
         try:
-            df_list = tabula.read_pdf(pdf_path, pages='all', multiple_tables=True,
+            df_list = tabula.read_pdf(pdf_path, pages=pages, multiple_tables=True,
                                       guess=True, stream=True, encoding='utf-8')
             logger.info(f"Tabula-py extrajo {len(df_list)} tablas del PDF '{pdf_path}'.")
             tables.extend(df_list)
@@ -198,30 +201,28 @@ class TableExtractor:
 
     def extract_and_parse_line_items(self, pdf_path: str) -> List[Dict[str, Any]]:
         all_potential_items: List[Dict[str, Any]] = []
+        # Primera estrategia que produjo ítems; se guarda en la plantilla del proveedor
+        self.last_strategy = None
 
-        logger.debug(f"Intentando extracción de tablas con Camelot (lattice) para {pdf_path}")
-        camelot_lattice_tables = self.extract_tables_camelot(pdf_path, flavor='lattice')
-        for df in camelot_lattice_tables:
-            parsed_items = self._parse_dataframe_to_line_items(df)
-            if parsed_items:
-                all_potential_items.extend(parsed_items)
-                logger.info(f"Extraídos {len(parsed_items)} ítems con Camelot Lattice.")
-
-        logger.debug(f"Intentando extracción de tablas con Camelot (stream) para {pdf_path}")
-        camelot_stream_tables = self.extract_tables_camelot(pdf_path, flavor='stream')
-        for df in camelot_stream_tables:
-            parsed_items = self._parse_dataframe_to_line_items(df)
-            if parsed_items:
-                all_potential_items.extend(parsed_items)
-                logger.info(f"Extraídos {len(parsed_items)} ítems con Camelot Stream.")
+        for flavor in ('lattice', 'stream'):
+            logger.debug(f"Intentando extracción de tablas con Camelot ({flavor}) para {pdf_path}")
+            for page, df in self._camelot_tables(pdf_path, flavor):
+                detected_cols = self._detect_columns(df)
+                parsed_items = self._parse_dataframe_to_line_items(df, detected_cols)
+                if parsed_items:
+                    all_potential_items.extend(parsed_items)
+                    logger.info(f"Extraídos {len(parsed_items)} ítems con Camelot {flavor.capitalize()}.")
+                    self._remember_strategy({"extractor": "camelot", "flavor": flavor}, page, detected_cols)
 
         logger.debug(f"Intentando extracción de tablas con Tabula-py para {pdf_path}")
         tabula_tables = self.extract_tables_tabula(pdf_path)
         for df in tabula_tables:
-            parsed_items = self._parse_dataframe_to_line_items(df)
+            detected_cols = self._detect_columns(df)
+            parsed_items = self._parse_dataframe_to_line_items(df, detected_cols)
             if parsed_items:
                 all_potential_items.extend(parsed_items)
                 logger.info(f"Extraídos {len(parsed_items)} ítems con Tabula-py.")
+                self._remember_strategy({"extractor": "tabula"}, "all", detected_cols)
 
         if not all_potential_items:
             logger.warning(f"No se pudieron extraer ítems de línea en formato de tabla para {pdf_path} con las estrategias actuales.")
@@ -231,6 +232,27 @@ class TableExtractor:
         logger.info(f"Después de deduplicación, se tienen {len(unique_items)} ítems únicos.")
         return unique_items
 
+    def _remember_strategy(self, strategy: Dict[str, Any], page: str, detected_cols: Dict[str, str]):
+        if self.last_strategy is None:
+            self.last_strategy = {**strategy, "pages": [page], "column_mapping": detected_cols}
+        elif all(self.last_strategy.get(key) == value for key, value in strategy.items()) and page not in self.last_strategy["pages"]:
+            self.last_strategy["pages"].append(page)
+
+    def extract_with_strategy(self, pdf_path: str, strategy: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Extrae ítems solo con la estrategia, páginas y columnas que funcionaron antes para el proveedor."""
+        pages = ",".join(strategy.get("pages") or ["all"])
+        if strategy.get("extractor") == "camelot":
+            tables = self.extract_tables_camelot(pdf_path, flavor=strategy.get("flavor", "lattice"), pages=pages)
+        else:
+            tables = self.extract_tables_tabula(pdf_path, pages=pages)
+        items: List[Dict[str, Any]] = []
+        for df in tables:
+            self._normalize_columns(df)
+            column_mapping = strategy.get("column_mapping") or {}
+            if all(column in df.columns for column in column_mapping.values()):
+                items.extend(self._parse_dataframe_to_line_items(df, column_mapping))
+        return self._deduplicate_and_prioritize_items(items)
+
     def _deduplicate_and_prioritize_items(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         unique_items_map = {}
         for item in items:
@@ -243,10 +265,12 @@ class TableExtractor:
                     unique_items_map[key] = item
         return list(unique_items_map.values())
 
-    def _parse_dataframe_to_line_items(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
-        items: List[Dict[str, Any]] = []
-        original_columns = df.columns.tolist()
+    def _normalize_columns(self, df: pd.DataFrame):
         df.columns = [str(col).strip().lower().replace(' ', '_').replace('.', '').replace('á','a').replace('é','e').replace('í','i').replace('ó','o').replace('ú','u') for col in df.columns]
+
+    def _detect_columns(self, df: pd.DataFrame) -> Dict[str, str]:
+        original_columns = df.columns.tolist()
+        self._normalize_columns(df)
         logger.debug(f"Columnas originales de la tabla: {original_columns}")
         logger.debug(f"Columnas normalizadas de la tabla: {df.columns.tolist()}")
         col_mapping = {
@@ -280,7 +304,15 @@ class TableExtractor:
 
             if 'description' not in detected_cols or 'quantity' not in detected_cols or 'unit_price' not in detected_cols:
                 logger.warning(f"No se pudieron establecer todas las columnas necesarias para los ítems después de intentar por nombre y por índice. Columnas disponibles: {df.columns.tolist()}")
-                return []
+                return {}
+        return detected_cols
+
+    def _parse_dataframe_to_line_items(self, df: pd.DataFrame, detected_cols: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        if detected_cols is None:
+            detected_cols = self._detect_columns(df)
+        if not detected_cols:
+            return []
 
         for index, row in df.iterrows():
             try:
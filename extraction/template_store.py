@@ -0,0 +1,211 @@
+import logging
+import re
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+from config.settings import settings
+from extraction.regex_parser import RegexParser
+from extraction.table_extractor import TableExtractor
+from learning.feedback_handler import LEARNING_FIELD_MAPPING
+from learning.pattern_store import get_pattern_store
+
+logger = logging.getLogger(__name__)
+
+EMPTY_TEMPLATES = {"version": 0, "templates": {}}
+
+TEMPLATE_FIELD_MAPPING = {
+    **LEARNING_FIELD_MAPPING,
+    "monto_subtotal": "subtotal_amount",
+    "monto_impuesto": "tax_amount",
+    "cufe": "cufe",
+    "metodo_pago": "payment_method",
+}
+
+VALUE_PATTERNS = {
+    "amount": r"((?:€|\$|EUR|USD|MXN|COP)?\s*\d[\d\.,]*)",
+    "date": r"(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}-\d{2}-\d{2})",
+    "tax_id": r"(\d[\d\.\-]{4,19})",
+    "cufe": r"([0-9a-fA-F\-]{32,96})",
+    "invoice_number": r"([A-Za-z0-9][A-Za-z0-9\-\/]*)",
+    "text": r"([^\n]{3,120})",
+}
+
+def value_kind(field: str) -> Optional[str]:
+    if "amount" in field:
+        return "amount"
+    if "date" in field:
+        return "date"
+    if "tax_id" in field:
+        return "tax_id"
+    if field in ("cufe", "invoice_number"):
+        return field
+    if field.endswith("_name") or field == "payment_method":
+        return "text"
+    return None
+
+def validate_extraction(data: Dict[str, Any], expect_items: bool = False) -> bool:
+    """Comprueba que una extracción sea usable: campos obligatorios, totales coherentes e ítems si se esperaban."""
+    if any(data.get(field) in (None, "") for field in settings.TEMPLATE_REQUIRED_FIELDS):
+        return False
+    subtotal, tax, total = data.get("subtotal_amount"), data.get("tax_amount"), data.get("total_amount")
+    if all(isinstance(value, (int, float)) for value in (subtotal, tax, total)):
+        if abs(subtotal + tax - total) > max(1.0, abs(total) * 0.01):
+            return False
+    if expect_items and not data.get("items"):
+        return False
+    return True
+
+class SupplierTemplateStore:
+    """Plantillas de extracción por NIT de proveedor.
+
+    Cada plantilla guarda, por campo, la página y la expresión (etiqueta + valor) que lo ubicó,
+    y la estrategia de tabla (extractor, páginas y mapeo de columnas) que produjo los ítems.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.store = get_pattern_store(path or settings.SUPPLIER_TEMPLATES_FILE, EMPTY_TEMPLATES)
+        self.regex_parser = RegexParser()
+
+    def get(self, nit: str) -> Optional[Dict[str, Any]]:
+        return self.store.get().get("templates", {}).get(nit)
+
+    def extract(self, nit: str, page_texts: List[str], pdf_path: str,
+                table_extractor: Optional[TableExtractor] = None) -> Optional[Dict[str, Any]]:
+        """Aplica la plantilla del proveedor. Devuelve None si no hay plantilla o si el resultado no valida."""
+        template = self.get(nit)
+        if not template or not template.get("fields"):
+            return None
+        full_text = "\n".join(page_texts)
+        data: Dict[str, Any] = {}
+        for field, spec in template["fields"].items():
+            page = spec.get("page")
+            text = page_texts[page] if page is not None and page < len(page_texts) else full_text
+            match = re.search(spec["pattern"], text, re.IGNORECASE)
+            data[field] = self.regex_parser.convert_field_value(field, match.group(1).strip()) if match else None
+        strategy = template.get("table_strategy")
+        if strategy:
+            data["items"] = (table_extractor or TableExtractor()).extract_with_strategy(pdf_path, strategy)
+        else:
+            data["items"] = self.regex_parser.extract_line_items(full_text)
+        if not validate_extraction(data, expect_items=bool(strategy)):
+            logger.info(f"La plantilla del proveedor {nit} no validó para {pdf_path}. Se usará la extracción genérica.")
+            self._record_failure(nit)
+            return None
+        logger.info(f"Extracción con plantilla del proveedor {nit} para {pdf_path}.")
+        return data
+
+    def learn_from_extraction(self, nit: str, page_texts: List[str], data: Dict[str, Any],
+                              table_strategy: Optional[Dict[str, Any]] = None) -> bool:
+        if not nit or not validate_extraction(data):
+            return False
+        fields = {}
+        for field, value in data.items():
+            if value is not None and value_kind(field):
+                spec = self._find_field(field, value, page_texts)
+                if spec:
+                    fields[field] = spec
+        if not fields:
+            return False
+        current = self.get(nit) or {}
+        if current.get("fields") == {**current.get("fields", {}), **fields} and \
+                (table_strategy is None or current.get("table_strategy") == table_strategy):
+            return False
+
+        def mutator(patterns: Dict[str, Any]):
+            template = patterns.setdefault("templates", {}).setdefault(nit, {"fields": {}})
+            template["fields"].update(fields)
+            if table_strategy:
+                template["table_strategy"] = table_strategy
+            template["fallos"] = 0
+            template["aprendida_en"] = datetime.now().isoformat()
+
+        self.store.update(mutator)
+        logger.info(f"Plantilla del proveedor {nit} aprendida con los campos {sorted(fields)}.")
+        return True
+
+    def learn_from_corrections(self, corrections: List[Tuple[str, str, Any, str]]) -> int:
+        """Aprende la ubicación de valores corregidos; cada corrección es (nit, campo de BD, valor, texto crudo)."""
+        learned: Dict[str, Dict[str, Any]] = {}
+        for nit, db_field_name, value, raw_text in corrections:
+            field = TEMPLATE_FIELD_MAPPING.get(db_field_name)
+            if not nit or not field or value is None or not raw_text or not value_kind(field):
+                continue
+            spec = self._find_field(field, value, [raw_text])
+            if spec:
+                spec["page"] = None
+                learned.setdefault(nit, {})[field] = spec
+        if not learned:
+            return 0
+
+        def mutator(patterns: Dict[str, Any]):
+            templates = patterns.setdefault("templates", {})
+            for nit, fields in learned.items():
+                templates.setdefault(nit, {"fields": {}})["fields"].update(fields)
+
+        self.store.update(mutator)
+        logger.info(f"Plantillas actualizadas desde correcciones para {len(learned)} proveedores.")
+        return sum(len(fields) for fields in learned.values())
+
+    def _record_failure(self, nit: str):
+        def mutator(patterns: Dict[str, Any]):
+            templates = patterns.setdefault("templates", {})
+            template = templates.get(nit)
+            if template is None:
+                return
+            template["fallos"] = template.get("fallos", 0) + 1
+            if template["fallos"] >= settings.TEMPLATE_MAX_FAILURES:
+                del templates[nit]
+                logger.info(f"Plantilla del proveedor {nit} descartada tras {settings.TEMPLATE_MAX_FAILURES} fallos.")
+
+        self.store.update(mutator)
+
+    def _find_field(self, field: str, value: Any, page_texts: List[str]) -> Optional[Dict[str, Any]]:
+        """Busca la etiqueta que precede al valor en el texto y construye la expresión etiqueta + valor."""
+        kind = value_kind(field)
+        value_pattern = VALUE_PATTERNS[kind]
+        for page_index, text in enumerate(page_texts):
+            for line in text.splitlines():
+                for candidate_start, candidate in self._candidates(kind, value, line):
+                    if not self._same_value(field, candidate, value):
+                        continue
+                    # La etiqueta es el texto previo al valor desde el último dígito (evita incluir otros valores variables)
+                    label = re.split(r'\d', line[:candidate_start])[-1]
+                    label = re.sub(r'[\s:#\-\.]+$', '', label).strip()[-40:].strip()
+                    if len(re.findall(r'[A-Za-zÁÉÍÓÚáéíóúñÑ]', label)) < 3:
+                        continue
+                    pattern = re.escape(label) + r'\s*[:#\-\.]?\s*' + value_pattern
+                    first = re.search(pattern, text, re.IGNORECASE)
+                    if first and self._same_value(field, first.group(1).strip(), value):
+                        return {"page": page_index, "pattern": pattern}
+        return None
+
+    def _candidates(self, kind: str, value: Any, line: str):
+        if kind == "text":
+            position = line.lower().find(str(value).strip().lower())
+            if position >= 0:
+                yield position, line[position:].strip()
+            return
+        for match in re.finditer(VALUE_PATTERNS[kind], line):
+            yield match.start(1), match.group(1).strip()
+
+    def _same_value(self, field: str, candidate: str, value: Any) -> bool:
+        converted = self.regex_parser.convert_field_value(field, candidate)
+        if converted is None:
+            return False
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return isinstance(converted, (int, float)) and abs(converted - value) < 0.005
+        if isinstance(value, (datetime, date)):
+            value_date = value.date() if isinstance(value, datetime) else value
+            return isinstance(converted, datetime) and converted.date() == value_date
+        expected = RegexParser._normalizar_nit(str(value)) if value_kind(field) == "tax_id" else str(value)
+        return str(converted).strip().upper() == expected.strip().upper()
+
+_template_store: Optional[SupplierTemplateStore] = None
+_template_store_lock = threading.Lock()
+
+def get_template_store() -> SupplierTemplateStore:
+    global _template_store
+    with _template_store_lock:
+        if _template_store is None:
+            _template_store = SupplierTemplateStore()
+        return _template_store
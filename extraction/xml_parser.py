@@ -1,7 +1,7 @@
 import xml.etree.ElementTree as ET
 import re
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Union
 logger = logging.getLogger(__name__)
 def clean_and_parse_xml_string(xml_string: str):
     cleaned_xml_string = re.sub(r'[^\x09\x0A\x0D\x20-\x7E\x80-\xFF]+', ' ', xml_string)
@@ -10,7 +10,8 @@ def clean_and_parse_xml_string(xml_string: str):
     except ET.ParseError as e:
         logger.error(f"Error al parsear XML después de limpieza: {e}")
         return None
-def extract_nested_invoice_xml(attached_document_xml_path: str) -> Optional[str]:
+def extract_nested_invoice_xml(attached_document_xml_path: Union[str, bytes]) -> Optional[str]:
+    """Devuelve el XML de factura embebido en un AttachedDocument; acepta una ruta o el contenido en bytes."""
     namespaces = {
         'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
         'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
@@ -18,8 +19,10 @@ def extract_nested_invoice_xml(attached_document_xml_path: str) -> Optional[str]
         'ds': 'http://www.w3.org/2000/09/xmldsig#'
     }
     try:
-        tree = ET.parse(attached_document_xml_path)
-        root = tree.getroot()
+        if isinstance(attached_document_xml_path, bytes):
+            root = ET.fromstring(attached_document_xml_path)
+        else:
+            root = ET.parse(attached_document_xml_path).getroot()
 
         description_node = root.find('.//cac:Attachment/cac:ExternalReference/cbc:Description', namespaces)
         if description_node is not None and description_node.text:
@@ -0,0 +1,120 @@
+import logging
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from config.settings import settings
+from ingestion.email_reader import iterar_correos_con_facturas
+from ingestion.imap_parts import EXTENSIONES_FACTURA
+from ingestion.spool import recuperar_spool
+
+logger = logging.getLogger(__name__)
+
+# (ruta del archivo, metadatos del correo, es un adjunto temporal)
+DocumentJob = Tuple[str, Dict[str, Any], bool]
+
+class DocumentQueue:
+    """Cola acotada de documentos pendientes entre las fuentes de ingesta y el pool de procesamiento.
+
+    `put` bloquea mientras la cola está llena (contrapresión sobre las fuentes) y una misma ruta
+    no se encola dos veces mientras siga pendiente o en proceso.
+    """
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self._queue: "queue.Queue[DocumentJob]" = queue.Queue(maxsize=maxsize or settings.DOCUMENT_QUEUE_SIZE)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def put(self, job: DocumentJob, stop_event: threading.Event) -> bool:
+        with self._lock:
+            if job[0] in self._pending:
+                return False
+            self._pending.add(job[0])
+        while not stop_event.is_set():
+            try:
+                self._queue.put(job, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        self.done(job[0])
+        return False
+
+    def get(self, timeout: float) -> Optional[DocumentJob]:
+        try:
+            if timeout <= 0:
+                return self._queue.get_nowait()
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def done(self, file_path: str):
+        with self._lock:
+            self._pending.discard(file_path)
+
+    def is_pending(self, file_path: str) -> bool:
+        with self._lock:
+            return file_path in self._pending
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+def encolar_correos(cola: DocumentQueue, stop_event: threading.Event, correos: List[Dict[str, Any]]):
+    for correo in correos:
+        logger.info(f"Encolando adjuntos del correo de: {correo['from']} - Asunto: {correo['subject']}")
+        email_metadata_for_invoice = {
+            "asunto_correo": correo.get("subject"),
+            "remitente_correo": correo.get("from"),
+            "correo_cliente": correo.get("cliente_correo")
+        }
+        for adjunto_path_temp in correo["adjuntos_temp_paths"]:
+            cola.put((adjunto_path_temp, email_metadata_for_invoice, True), stop_event)
+
+def producir_desde_correos(cola: DocumentQueue, stop_event: threading.Event,
+                           iterar_correos: Callable[[], Iterable[List[Dict[str, Any]]]] = iterar_correos_con_facturas):
+    """Encola los adjuntos de cada cuenta en cuanto termina; solo espera EMAIL_CHECK_INTERVAL_SECONDS cuando no hubo correos.
+
+    Antes del primer ciclo encola los adjuntos que quedaron en el spool de una ejecución anterior.
+    """
+    for job in recuperar_spool():
+        cola.put(job, stop_event)
+    while not stop_event.is_set():
+        encontrados = 0
+        try:
+            for correos in iterar_correos():
+                encolar_correos(cola, stop_event, correos)
+                encontrados += len(correos)
+        except Exception as e:
+            logger.critical(f"Error crítico en la etapa de ingesta de correos: {e}", exc_info=True)
+        if not encontrados:
+            logger.info("No se encontraron nuevas facturas en los correos.")
+            stop_event.wait(settings.EMAIL_CHECK_INTERVAL_SECONDS)
+
+def metadatos_desde_nombre(filename: str) -> Dict[str, Any]:
+    email_metadata_for_invoice = {}
+    parts = filename.split('_')
+    if len(parts) >= 3:
+        if len(parts) > 3 and '@' in parts[2]:
+            email_metadata_for_invoice["correo_cliente"] = parts[2]
+    return email_metadata_for_invoice
+
+def producir_desde_inbox(cola: DocumentQueue, stop_event: threading.Event, directorio: Optional[str] = None):
+    """Encola los PDF/ZIP/XML del inbox que no estén ya en curso; solo espera PROCESSING_INTERVAL_SECONDS si no hubo nuevos."""
+    directorio = directorio or settings.PDF_INPUT_DIR
+    while not stop_event.is_set():
+        nuevos = 0
+        try:
+            filenames = sorted(os.listdir(directorio))
+        except OSError as e:
+            logger.error(f"No se pudo listar el inbox {directorio}: {e}")
+            filenames = []
+        for filename in filenames:
+            file_full_path = os.path.join(directorio, filename)
+            if not filename.lower().endswith(EXTENSIONES_FACTURA):
+                continue
+            if cola.is_pending(file_full_path) or not os.path.isfile(file_full_path):
+                continue
+            if cola.put((file_full_path, metadatos_desde_nombre(filename), False), stop_event):
+                logger.info(f"Archivo del inbox encolado: {filename}")
+                nuevos += 1
+        if not nuevos:
+            stop_event.wait(settings.PROCESSING_INTERVAL_SECONDS)
@@ -1,17 +1,26 @@
 import os
-from imap_tools import MailBox
-import tempfile
+import hashlib
+from imap_tools import AND, OR, U
 import shutil
 import re
 import logging 
+import time
+from email.parser import BytesHeaderParser
+from email.policy import default as politica_email
+from email.utils import parseaddr
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from database.models import SessionLocal, Usuario 
 from config.settings import settings 
-from ingestion.utils import cargar_uids_procesados, guardar_uid
+from ingestion.utils import sanitize_email, reclamar_uids, completar_uids, liberar_uids, cargar_marca_uid, guardar_marca_uid, migrar_registros_locales
+from ingestion.utils import facturas_por_huella, vincular_correo_duplicado
+from ingestion.mailbox_pool import abrir_buzon, get_mailbox_pool
+from ingestion.imap_parts import parsear_respuesta_fetch, partes_de_factura
+from ingestion.spool import DecodificadorIncremental, crear_directorio_correo, confirmar_directorio_correo, uso_spool
 logger = logging.getLogger(__name__) 
+PALABRAS_CLAVE_FACTURA = ["factura", "invoice", "comprobante", "recibo", "cuenta", "estado de cuenta", "billing", "cxc", "facturación", "orden de compra", "remisión", "nota crédito", "nota débito"]
 def contiene_factura(texto):
     texto = texto.lower()
-    palabras_clave = ["factura", "invoice", "comprobante", "recibo", "cuenta", "estado de cuenta", "billing", "cxc", "facturación", "orden de compra", "remisión", "nota crédito", "nota débito"]
-    return any(palabra in texto for palabra in palabras_clave)
+    return any(palabra in texto for palabra in PALABRAS_CLAVE_FACTURA)
 def obtener_usuarios_db():
     session = SessionLocal()
     usuarios_list = []
@@ -27,56 +36,224 @@ def obtener_usuarios_db():
     finally:
         session.close()
     return usuarios_list
-def obtener_correos_con_facturas():
-    correos = []
-    usuarios = obtener_usuarios_db()
+def criterio_factura():
+    return OR(subject=PALABRAS_CLAVE_FACTURA, body=PALABRAS_CLAVE_FACTURA)
+def buscar_uids_pendientes(mailbox, email):
+    """Pide al servidor los UID posteriores a la marca de la cuenta cuyo asunto o cuerpo menciona una palabra clave.
 
-    if not usuarios:
-        logger.warning("No se encontraron usuarios configurados en la base de datos para la lectura de correos.")
-        return []
+    Si no hay marca, cambió UIDVALIDITY o EMAIL_UID_WATERMARK está desactivado se toman los últimos
+    EMAIL_FETCH_LIMIT candidatos. Devuelve (uids ascendentes, uidvalidity, uidnext).
+    """
+    estado = mailbox.folder.status('INBOX', ['UIDVALIDITY', 'UIDNEXT'])
+    uidvalidity, uidnext = int(estado['UIDVALIDITY']), int(estado['UIDNEXT'])
+    criterio = criterio_factura()
+    marca = None
+    if settings.EMAIL_UID_WATERMARK:
+        marca = cargar_marca_uid(email)
+        if marca is None:
+            migrar_registros_locales(email, uidvalidity)
+            marca = cargar_marca_uid(email)
+    if marca and marca["uidvalidity"] == uidvalidity:
+        # 'UID n:*' siempre devuelve al menos el último mensaje, aunque su UID sea menor que n
+        uids = [uid for uid in mailbox.uids(AND(criterio, uid=U(marca["uid"] + 1, '*')), charset='UTF-8') if int(uid) > marca["uid"]]
+        return sorted(uids, key=int), uidvalidity, uidnext
+    if marca:
+        logger.warning(f"UIDVALIDITY de {email} cambió ({marca['uidvalidity']} -> {uidvalidity}); se reinicia la marca de UID.")
+    uids = sorted(mailbox.uids(criterio, charset='UTF-8'), key=int)[-settings.EMAIL_FETCH_LIMIT:]
+    return uids, uidvalidity, uidnext
+def obtener_cabeceras(mailbox, uids):
+    """Fase 1: trae solo remitente, asunto y BODYSTRUCTURE de los UID indicados, sin descargar el contenido."""
+    typ, data = mailbox.client.uid('FETCH', ','.join(uids), '(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)])')
+    if typ != 'OK':
+        raise ConnectionError(f"FETCH de cabeceras falló: {typ} {data}")
+    cabeceras = {}
+    for uid, items in parsear_respuesta_fetch(data).items():
+        crudo = next((valor for clave, valor in items.items() if clave.startswith('BODY[HEADER')), b'') or b''
+        encabezado = BytesHeaderParser(policy=politica_email).parsebytes(crudo if isinstance(crudo, bytes) else crudo.encode())
+        cabeceras[uid] = {
+            "from": parseaddr(str(encabezado.get('from', '')))[1],
+            "subject": str(encabezado.get('subject', '')),
+            "partes": partes_de_factura(items.get('BODYSTRUCTURE') or []),
+        }
+    return cabeceras
+def descargar_parte(mailbox, uid, parte, path):
+    """Descarga una parte por bloques de EMAIL_FETCH_CHUNK_BYTES (BODY.PEEK[sección]<inicio.tamaño>) decodificándola al vuelo.
 
-    for usuario in usuarios:
-        email = usuario.get("correo")
-        password = usuario.get("password")
+    Devuelve el SHA-256 del adjunto decodificado, o None si el servidor no devolvió la parte.
+    """
+    decodificador = DecodificadorIncremental(parte['encoding'])
+    sha256 = hashlib.sha256()
+    prefijo = f"BODY[{parte['seccion']}]"
+    offset = 0
+    with open(path, 'wb') as f:
+        while True:
+            typ, data = mailbox.client.uid('FETCH', str(uid), f"(BODY.PEEK[{parte['seccion']}]<{offset}.{settings.EMAIL_FETCH_CHUNK_BYTES}>)")
+            if typ != 'OK':
+                raise ConnectionError(f"FETCH de adjuntos falló para UID {uid}: {typ} {data}")
+            items = parsear_respuesta_fetch(data).get(str(uid), {})
+            bloque = next((valor for clave, valor in items.items() if clave.startswith(prefijo)), None)
+            if not bloque:
+                if offset == 0:
+                    return None
+                break
+            if isinstance(bloque, str):
+                bloque = bloque.encode()
+            datos = decodificador.feed(bloque)
+            sha256.update(datos)
+            f.write(datos)
+            offset += len(bloque)
+            if len(bloque) < settings.EMAIL_FETCH_CHUNK_BYTES:
+                break
+        datos = decodificador.flush()
+        sha256.update(datos)
+        f.write(datos)
+    return sha256.hexdigest()
+def descargar_partes(mailbox, uid, partes, metadatos, prefijo):
+    """Fase 2: descarga con BODY.PEEK solo las partes indicadas a un directorio del spool; ante un error no deja nada.
 
-        if not email or not password:
-            logger.warning(f"Usuario sin correo o contraseña, se omite: {email}")
-            continue
+    Devuelve (rutas en el spool, cuántas partes eran duplicados exactos de adjuntos ya extraídos). Los
+    duplicados no llegan al spool: sus metadatos se vinculan a las facturas existentes.
+    """
+    directorio = crear_directorio_correo(prefijo, metadatos)
+    paths = []
+    duplicados = 0
+    try:
+        for parte in partes:
+            path = os.path.join(directorio, f"{uid}_{parte['seccion']}_{parte['filename']}")
+            sha256 = descargar_parte(mailbox, uid, parte, path)
+            if not sha256:
+                os.remove(path)
+                logger.warning(f"    El servidor no devolvió la parte {parte['seccion']} del UID {uid}.")
+                continue
+            existentes = facturas_por_huella(sha256)
+            if existentes:
+                os.remove(path)
+                vincular_correo_duplicado(existentes, sha256, metadatos, parte['filename'])
+                duplicados += 1
+                logger.info(f"    Adjunto '{parte['filename']}' del UID {uid} ya extraído (facturas {existentes}); se vincula sin procesarlo.")
+                continue
+            paths.append(path)
+            logger.info(f"    Adjunto guardado en el spool: {os.path.basename(path)} ({os.path.getsize(path)} bytes)")
+        if not paths:
+            shutil.rmtree(directorio, ignore_errors=True)
+            return [], duplicados
+        return confirmar_directorio_correo(directorio, paths), duplicados
+    except Exception:
+        shutil.rmtree(directorio, ignore_errors=True)
+        raise
+def leer_correos_de_buzon(mailbox, email, inicio=None):
+    """Lee los correos con facturas pendientes de un buzón ya abierto y guarda sus adjuntos en el spool.
 
-        logger.info(f"Buscando correos para: {email}")
-        uids_procesados = cargar_uids_procesados(email)
+    Solo se leen los UID que este nodo logra reclamar en el registro; al terminar se completan los leídos
+    y se liberan los demás para reintentarlos.
+    """
+    correos = []
+    inicio = inicio if inicio is not None else time.monotonic()
+    uids, uidvalidity, uidnext = buscar_uids_pendientes(mailbox, email)
+    lote = [int(uid) for uid in uids[:settings.EMAIL_FETCH_LIMIT]]
+    reclamados, ocupados = reclamar_uids(email, uidvalidity, lote) if lote else ([], [])
+    logger.info(f"  {len(uids)} correos candidatos nuevos en {email}; se leerán {len(reclamados)}"
+                f"{f' ({len(ocupados)} en curso en otro nodo)' if ocupados else ''}.")
+    leidos = []
+    ultimo_uid = None
+    completo = True
+    try:
+        cabeceras = obtener_cabeceras(mailbox, [str(uid) for uid in reclamados]) if reclamados else {}
+        for uid in lote:
+            if time.monotonic() - inicio > settings.EMAIL_ACCOUNT_DEADLINE_SECONDS:
+                logger.warning(f"Se agotó el tiempo de la cuenta {email}; el resto de correos se leerá en el siguiente ciclo.")
+                completo = False
+                break
+            ultimo_uid = uid
+            if uid not in reclamados:
+                continue
+            mensaje = cabeceras.get(str(uid))
+            if not mensaje:
+                continue
+            partes = []
+            for parte in mensaje["partes"]:
+                if parte["size"] > settings.EMAIL_MAX_ATTACHMENT_BYTES:
+                    logger.warning(f"    Adjunto '{parte['filename']}' del UID {uid} omitido: {parte['size']} bytes declarados "
+                                   f"superan EMAIL_MAX_ATTACHMENT_BYTES ({settings.EMAIL_MAX_ATTACHMENT_BYTES}).")
+                    continue
+                partes.append(parte)
+            if not partes:
+                leidos.append(uid)
+                continue
+            if uso_spool() + sum(parte["size"] for parte in partes) > settings.EMAIL_SPOOL_MAX_BYTES:
+                logger.warning(f"El spool de adjuntos superaría EMAIL_SPOOL_MAX_BYTES ({settings.EMAIL_SPOOL_MAX_BYTES}); "
+                               f"los correos restantes de {email} se leerán en el siguiente ciclo.")
+                completo = False
+                break
+            metadatos = {"asunto_correo": mensaje["subject"], "remitente_correo": mensaje["from"], "correo_cliente": email}
+            adjuntos_procesados_temp_paths, duplicados = descargar_partes(mailbox, uid, partes, metadatos, f"{sanitize_email(email)}_{uid}")
+            if duplicados and not adjuntos_procesados_temp_paths:
+                leidos.append(uid)
+            if adjuntos_procesados_temp_paths:
+                correos.append({
+                    "from": mensaje["from"],
+                    "subject": mensaje["subject"],
+                    "uid": str(uid),
+                    "adjuntos_temp_paths": adjuntos_procesados_temp_paths, 
+                    "correo_cliente": email 
+                })
+                leidos.append(uid)
+    finally:
+        completar_uids(email, uidvalidity, leidos)
+        sin_leer = [uid for uid in reclamados if uid not in leidos]
+        if sin_leer:
+            liberar_uids(email, uidvalidity, sin_leer)
+        if leidos:
+            logger.info(f"  {len(leidos)} correos de '{email}' marcados como procesados.")
+    if settings.EMAIL_UID_WATERMARK:
+        if completo and len(lote) == len(uids):
+            # Sin pendientes: la marca avanza hasta el último UID del buzón, incluidos los que no coincidieron
+            marca = max(uidnext - 1, ultimo_uid or 0)
+        else:
+            marca = ultimo_uid
+        # No se pasa de los UID en curso en otro nodo o sin leer, para volver a verlos si su reclamo vence
+        bloqueados = ocupados + sin_leer
+        if marca and bloqueados:
+            marca = min(marca, min(bloqueados) - 1)
+        if marca:
+            guardar_marca_uid(email, uidvalidity, marca)
+    return correos
+def obtener_correos_de_cuenta(usuario):
+    email = usuario.get("correo")
+    password = usuario.get("password")
 
-        try:
-            imap_server = settings.EMAIL_IMAP_SERVER 
-            with MailBox(imap_server).login(email, password, 'INBOX') as mailbox:
-                for msg in mailbox.fetch(reverse=True, limit=settings.EMAIL_FETCH_LIMIT): 
-                    if str(msg.uid) in uids_procesados:
-                        continue
-                    cuerpo = msg.text or msg.html or ""
-                    asunto = msg.subject or ""
-                    if contiene_factura(cuerpo) or contiene_factura(asunto):
-                        adjuntos_procesados_temp_paths = []
-                        temp_dir_for_attachments = None 
-                        for att in msg.attachments:
-                            if att.filename.lower().endswith(('.pdf', '.zip')):
-                                if not temp_dir_for_attachments:
-                                    temp_dir_for_attachments = tempfile.mkdtemp()
-                                path = os.path.join(temp_dir_for_attachments, f"{msg.uid}_{att.filename}")
-                                with open(path, 'wb') as f:
-                                    f.write(att.payload)
-                                adjuntos_procesados_temp_paths.append(path)
-                                logger.info(f"    Adjunto guardado temporalmente: {path}")
+    if not email or not password:
+        logger.warning(f"Usuario sin correo o contraseña, se omite: {email}")
+        return []
+
+    logger.info(f"Buscando correos para: {email}")
+    inicio = time.monotonic()
 
-                        if adjuntos_procesados_temp_paths:
-                            correos.append({
-                                "from": msg.from_,
-                                "subject": asunto,
-                                "uid": msg.uid,
-                                "adjuntos_temp_paths": adjuntos_procesados_temp_paths, 
-                                "correo_cliente": email 
-                            })
-                            guardar_uid(str(msg.uid), email)
-                            logger.info(f"  Correo UID {msg.uid} de '{email}' marcado como procesado.")
-        except Exception as e:
-            logger.error(f"Error al obtener correos para {email}: {e}", exc_info=True)
-    return correos
\ No newline at end of file
+    try:
+        if settings.EMAIL_SESSION_POOL:
+            with get_mailbox_pool().sesion(email, password) as mailbox:
+                return leer_correos_de_buzon(mailbox, email, inicio)
+        with abrir_buzon(email, password) as mailbox:
+            return leer_correos_de_buzon(mailbox, email, inicio)
+    except Exception as e:
+        logger.error(f"Error al obtener correos para {email}: {e}", exc_info=True)
+    return []
+def iterar_correos_con_facturas(usuarios=None):
+    """Consulta las cuentas en paralelo (EMAIL_FETCH_WORKERS sesiones) y entrega los correos de cada una en cuanto termina."""
+    if usuarios is None:
+        usuarios = obtener_usuarios_db()
+        if not usuarios:
+            logger.warning("No se encontraron usuarios configurados en la base de datos para la lectura de correos.")
+            return
+    if not usuarios:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(settings.EMAIL_FETCH_WORKERS, len(usuarios)), thread_name_prefix="imap") as executor:
+        futures = {executor.submit(obtener_correos_de_cuenta, usuario): usuario.get("correo") for usuario in usuarios}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error(f"Error al obtener correos para {futures[future]}: {e}", exc_info=True)
+def obtener_correos_con_facturas():
+    return [correo for correos_cuenta in iterar_correos_con_facturas() for correo in correos_cuenta]
@@ -0,0 +1,106 @@
+import logging
+import random
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from config.settings import settings
+from ingestion.email_reader import abrir_buzon, iterar_correos_con_facturas, leer_correos_de_buzon, obtener_usuarios_db
+
+logger = logging.getLogger(__name__)
+
+def espera_con_jitter(intentos: int, base: float, maximo: float) -> float:
+    """Backoff exponencial con jitter completo: un valor al azar entre la mitad y el total del tope del intento."""
+    tope = min(maximo, base * (2 ** max(0, intentos - 1)))
+    return random.uniform(tope / 2, tope)
+
+class IdleListener(threading.Thread):
+    """Mantiene una conexión IMAP en IDLE para una cuenta y lee los correos nuevos en cuanto llega un EXISTS.
+
+    Al conectar (y al reconectar) lee los pendientes desde la marca de UID, así que no se pierden los
+    correos que llegaron mientras la conexión estaba caída. Si el servidor no anuncia IDLE el hilo
+    termina con estado 'sin_idle' y la cuenta queda en el sondeo periódico.
+    """
+
+    def __init__(self, usuario: Dict[str, Any], on_correos: Callable[[List[Dict[str, Any]]], None],
+                 stop_event: threading.Event, mailbox_factory: Optional[Callable[[str, str], Any]] = None,
+                 backoff_base: Optional[float] = None, backoff_max: Optional[float] = None):
+        super().__init__(name=f"idle-{usuario.get('correo')}", daemon=True)
+        self.email = usuario.get("correo")
+        self.password = usuario.get("password")
+        self.on_correos = on_correos
+        self.stop_event = stop_event
+        self.mailbox_factory = mailbox_factory or abrir_buzon
+        self.backoff_base = backoff_base if backoff_base is not None else settings.EMAIL_IDLE_BACKOFF_BASE_SECONDS
+        self.backoff_max = backoff_max if backoff_max is not None else settings.EMAIL_IDLE_BACKOFF_MAX_SECONDS
+        # conectando | idle | espera | sin_idle | detenido
+        self.estado = "conectando"
+
+    def atendida(self) -> bool:
+        """True mientras la cuenta no necesita sondeo: conectando por primera vez o en IDLE."""
+        return self.is_alive() and self.estado in ("conectando", "idle")
+
+    def _leer(self, mailbox):
+        correos = leer_correos_de_buzon(mailbox, self.email)
+        if correos:
+            self.on_correos(correos)
+
+    def _escuchar(self, mailbox):
+        self._leer(mailbox)
+        self.estado = "idle"
+        while not self.stop_event.is_set():
+            respuestas = mailbox.idle.wait(timeout=settings.EMAIL_IDLE_TIMEOUT_SECONDS)
+            if any(b'EXISTS' in respuesta.upper() for respuesta in respuestas):
+                logger.info(f"IDLE: correo nuevo en {self.email}.")
+                self._leer(mailbox)
+
+    def run(self):
+        intentos = 0
+        while not self.stop_event.is_set():
+            try:
+                with self.mailbox_factory(self.email, self.password) as mailbox:
+                    if 'IDLE' not in mailbox.client.capabilities:
+                        logger.warning(f"El servidor IMAP de {self.email} no soporta IDLE; la cuenta se seguirá sondeando.")
+                        self.estado = "sin_idle"
+                        return
+                    intentos = 0
+                    logger.info(f"Conexión IDLE abierta para {self.email}.")
+                    self._escuchar(mailbox)
+            except Exception as e:
+                intentos += 1
+                self.estado = "espera"
+                espera = espera_con_jitter(intentos, self.backoff_base, self.backoff_max)
+                logger.warning(f"Conexión IDLE de {self.email} perdida ({e}); reintento {intentos} en {espera:.1f}s.")
+                self.stop_event.wait(espera)
+                self.estado = "conectando"
+        self.estado = "detenido"
+
+class IdleSupervisor:
+    """Arranca un IdleListener por cuenta y deja en el sondeo solo las cuentas que no están en IDLE."""
+
+    def __init__(self, on_correos: Callable[[List[Dict[str, Any]]], None], stop_event: threading.Event,
+                 mailbox_factory: Optional[Callable[[str, str], Any]] = None):
+        self.on_correos = on_correos
+        self.stop_event = stop_event
+        self.mailbox_factory = mailbox_factory
+        self.listeners: Dict[str, IdleListener] = {}
+
+    def sincronizar(self, usuarios: List[Dict[str, Any]]):
+        for usuario in usuarios:
+            email = usuario.get("correo")
+            if not email or not usuario.get("password"):
+                continue
+            listener = self.listeners.get(email)
+            if listener is not None and (listener.is_alive() or listener.estado == "sin_idle"):
+                continue
+            listener = IdleListener(usuario, self.on_correos, self.stop_event, self.mailbox_factory)
+            self.listeners[email] = listener
+            listener.start()
+
+    def cuentas_atendidas(self) -> set:
+        return {email for email, listener in self.listeners.items() if listener.atendida()}
+
+    def iterar_correos(self) -> Iterator[List[Dict[str, Any]]]:
+        """Para el productor de correos: sondea solo las cuentas sin conexión IDLE activa."""
+        usuarios = obtener_usuarios_db()
+        self.sincronizar(usuarios)
+        atendidas = self.cuentas_atendidas()
+        return iterar_correos_con_facturas([usuario for usuario in usuarios if usuario.get("correo") not in atendidas])
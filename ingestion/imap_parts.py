@@ -0,0 +1,155 @@
+import email.header
+import os
+import urllib.parse
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+EXTENSIONES_FACTURA = ('.pdf', '.zip', '.xml')
+TIPOS_FACTURA = {
+    "application/pdf": ".pdf",
+    "application/zip": ".zip",
+    "application/x-zip-compressed": ".zip",
+}
+
+def _leer_valor(datos: bytes, pos: int) -> Tuple[Any, int]:
+    """Lee un valor IMAP (lista, cadena entre comillas, literal {n}, NIL o átomo) a partir de `pos`."""
+    while pos < len(datos) and datos[pos:pos + 1] in (b' ', b'\r', b'\n'):
+        pos += 1
+    if pos >= len(datos):
+        raise ValueError("Respuesta IMAP incompleta")
+    inicial = datos[pos:pos + 1]
+    if inicial == b'(':
+        lista = []
+        pos += 1
+        while True:
+            while datos[pos:pos + 1] in (b' ', b'\r', b'\n'):
+                pos += 1
+            if datos[pos:pos + 1] == b')':
+                return lista, pos + 1
+            if pos >= len(datos):
+                raise ValueError("Lista IMAP sin cerrar")
+            valor, pos = _leer_valor(datos, pos)
+            lista.append(valor)
+    if inicial == b'"':
+        pos += 1
+        texto = bytearray()
+        while datos[pos:pos + 1] != b'"':
+            if pos >= len(datos):
+                raise ValueError("Cadena IMAP sin cerrar")
+            if datos[pos:pos + 1] == b'\\':
+                pos += 1
+            texto += datos[pos:pos + 1]
+            pos += 1
+        return texto.decode('utf-8', errors='replace'), pos + 1
+    if inicial == b'{':
+        # Literal: imaplib deja el marcador {n} y a continuación los n bytes, sin CRLF
+        fin = datos.index(b'}', pos)
+        tamano = int(datos[pos + 1:fin])
+        return bytes(datos[fin + 1:fin + 1 + tamano]), fin + 1 + tamano
+    inicio = pos
+    while pos < len(datos) and datos[pos:pos + 1] not in (b' ', b'(', b')', b'\r', b'\n'):
+        if datos[pos:pos + 1] == b'[':
+            # Átomos como BODY[HEADER.FIELDS (FROM SUBJECT)] incluyen espacios y paréntesis
+            pos = datos.index(b']', pos)
+        pos += 1
+    atomo = datos[inicio:pos].decode('ascii', errors='replace')
+    return (None if atomo.upper() == 'NIL' else atomo), pos
+
+def unir_respuesta_fetch(data: List[Any]) -> bytes:
+    """Reconstruye en un solo bloque la respuesta de `imaplib.uid('FETCH', ...)`, que parte cada literal en una tupla."""
+    partes = []
+    for elemento in data:
+        if elemento is None:
+            continue
+        if isinstance(elemento, tuple):
+            partes.append(elemento[0] + elemento[1])
+        else:
+            partes.append(b' ' + elemento)
+    return b''.join(partes)
+
+def parsear_respuesta_fetch(data: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """Devuelve {uid: {ITEM: valor}} a partir de la respuesta de un UID FETCH (p. ej. 'BODYSTRUCTURE', 'BODY[2]')."""
+    datos = unir_respuesta_fetch(data)
+    mensajes: Dict[str, Dict[str, Any]] = {}
+    pos = 0
+    while datos[pos:].strip():
+        _, pos = _leer_valor(datos, pos)
+        items, pos = _leer_valor(datos, pos)
+        if not isinstance(items, list):
+            raise ValueError(f"Respuesta FETCH inesperada: {items!r}")
+        valores = {str(items[i]).upper(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+        if valores.get("UID") is not None:
+            mensajes.setdefault(str(valores["UID"]), {}).update(valores)
+    return mensajes
+
+def _texto(valor: Any) -> Optional[str]:
+    if isinstance(valor, bytes):
+        return valor.decode('utf-8', errors='replace')
+    return valor
+
+def _parametros(lista: Any) -> Dict[str, str]:
+    if not isinstance(lista, list):
+        return {}
+    return {str(_texto(lista[i])).lower(): _texto(lista[i + 1]) for i in range(0, len(lista) - 1, 2)}
+
+def _nombre_de_archivo(parametros: Dict[str, str], clave: str) -> Optional[str]:
+    if parametros.get(f"{clave}*"):
+        # RFC 2231: charset'idioma'valor-codificado
+        partes = parametros[f"{clave}*"].split("'", 2)
+        if len(partes) < 3:
+            return urllib.parse.unquote(partes[-1])
+        try:
+            return urllib.parse.unquote(partes[2], encoding=partes[0] or 'utf-8', errors='replace')
+        except LookupError:
+            return urllib.parse.unquote(partes[2], errors='replace')
+    if parametros.get(clave):
+        return str(email.header.make_header(email.header.decode_header(parametros[clave])))
+    return None
+
+def _parte_simple(estructura: List[Any], seccion: str) -> Dict[str, Any]:
+    tipo = f"{_texto(estructura[0])}/{_texto(estructura[1])}".lower()
+    # Los campos de extensión (md5, disposición) van después de los específicos de text/* y message/rfc822
+    if tipo.startswith("text/"):
+        indice_disposicion = 9
+    elif tipo == "message/rfc822":
+        indice_disposicion = 11
+    else:
+        indice_disposicion = 8
+    disposicion = estructura[indice_disposicion] if len(estructura) > indice_disposicion else None
+    parametros_disposicion = _parametros(disposicion[1]) if isinstance(disposicion, list) and len(disposicion) > 1 else {}
+    filename = _nombre_de_archivo(parametros_disposicion, "filename") or _nombre_de_archivo(_parametros(estructura[2]), "name")
+    try:
+        size = int(estructura[6])
+    except (TypeError, ValueError, IndexError):
+        size = 0
+    return {
+        "seccion": seccion,
+        "tipo": tipo,
+        "filename": filename,
+        "encoding": (_texto(estructura[5]) or "7bit").lower(),
+        "size": size,
+    }
+
+def iterar_partes(estructura: List[Any], seccion: str = "") -> Iterator[Dict[str, Any]]:
+    """Recorre el BODYSTRUCTURE y entrega las partes hoja con su número de sección IMAP (p. ej. '2', '1.2')."""
+    if estructura and isinstance(estructura[0], list):
+        # multipart: las subpartes van primero y después el subtipo y la extensión
+        for indice, subparte in enumerate(estructura, start=1):
+            if not isinstance(subparte, list):
+                break
+            yield from iterar_partes(subparte, f"{seccion}.{indice}" if seccion else str(indice))
+        return
+    yield _parte_simple(estructura, seccion or "1")
+
+def partes_de_factura(estructura: List[Any]) -> List[Dict[str, Any]]:
+    """Partes PDF, ZIP o XML del mensaje; las PDF/ZIP sin nombre reciben uno a partir de su sección."""
+    partes = []
+    for parte in iterar_partes(estructura):
+        filename = parte["filename"]
+        if filename and filename.lower().endswith(EXTENSIONES_FACTURA):
+            partes.append(parte)
+        elif not filename and parte["tipo"] in TIPOS_FACTURA:
+            parte["filename"] = f"adjunto_{parte['seccion']}{TIPOS_FACTURA[parte['tipo']]}"
+            partes.append(parte)
+    for parte in partes:
+        parte["filename"] = os.path.basename(parte["filename"].replace("\\", "/"))
+    return partes
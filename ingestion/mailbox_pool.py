@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional
+from imap_tools import MailBox
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+def abrir_buzon(email, password):
+    return MailBox(settings.EMAIL_IMAP_SERVER, timeout=settings.EMAIL_IMAP_TIMEOUT_SECONDS).login(email, password, 'INBOX')
+
+def cerrar_buzon(mailbox):
+    try:
+        mailbox.logout()
+    except Exception as e:
+        logger.debug(f"Error al cerrar una sesión IMAP: {e}")
+
+class PooledSession:
+    def __init__(self, email: str, password: str, mailbox: Any):
+        self.email = email
+        self.password = password
+        self.mailbox = mailbox
+        self.ultimo_uso = time.monotonic()
+
+    def inactiva(self) -> float:
+        return time.monotonic() - self.ultimo_uso
+
+    def sana(self) -> bool:
+        try:
+            typ, _ = self.mailbox.client.noop()
+            return typ == 'OK'
+        except Exception as e:
+            logger.info(f"La sesión IMAP de {self.email} no respondió al NOOP: {e}")
+            return False
+
+class MailboxPool:
+    """Sesiones IMAP autenticadas (con INBOX seleccionado) reutilizables entre ciclos.
+
+    Solo las sesiones libres viven en el pool; `sesion` saca la de la cuenta, comprueba con NOOP las
+    que llevan más de EMAIL_POOL_HEALTHCHECK_SECONDS sin uso y la devuelve al terminar. Una sesión que
+    falla durante el uso se cierra en vez de devolverse. Con más de `max_size` sesiones libres se
+    cierran las usadas hace más tiempo, y un hilo envía NOOP a las libres y cierra las inactivas.
+    """
+
+    def __init__(self, factory: Optional[Callable[[str, str], Any]] = None, max_size: Optional[int] = None):
+        self.factory = factory or abrir_buzon
+        self.max_size = max_size or settings.EMAIL_POOL_MAX_SIZE
+        self._libres: "OrderedDict[str, PooledSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._keepalive: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    @contextmanager
+    def sesion(self, email: str, password: str) -> Iterator[Any]:
+        session = self._tomar(email, password)
+        try:
+            yield session.mailbox
+        except Exception:
+            cerrar_buzon(session.mailbox)
+            raise
+        self._devolver(session)
+
+    def _tomar(self, email: str, password: str) -> PooledSession:
+        self._iniciar_keepalive()
+        with self._lock:
+            session = self._libres.pop(email, None)
+        if session is not None:
+            if session.password == password and \
+                    (session.inactiva() < settings.EMAIL_POOL_HEALTHCHECK_SECONDS or session.sana()):
+                return session
+            cerrar_buzon(session.mailbox)
+        logger.info(f"Abriendo sesión IMAP para {email}.")
+        return PooledSession(email, password, self.factory(email, password))
+
+    def _devolver(self, session: PooledSession):
+        session.ultimo_uso = time.monotonic()
+        sobrantes: List[PooledSession] = []
+        with self._lock:
+            anterior = self._libres.pop(session.email, None)
+            if anterior is not None:
+                sobrantes.append(anterior)
+            self._libres[session.email] = session
+            while len(self._libres) > self.max_size:
+                sobrantes.append(self._libres.popitem(last=False)[1])
+        for sobrante in sobrantes:
+            cerrar_buzon(sobrante.mailbox)
+
+    def mantener(self):
+        """Cierra las sesiones libres inactivas por más de EMAIL_POOL_IDLE_EVICT_SECONDS y envía NOOP al resto."""
+        with self._lock:
+            revisar = [session for session in self._libres.values()
+                       if session.inactiva() >= settings.EMAIL_POOL_KEEPALIVE_SECONDS]
+            for session in revisar:
+                del self._libres[session.email]
+        for session in revisar:
+            if session.inactiva() >= settings.EMAIL_POOL_IDLE_EVICT_SECONDS:
+                logger.info(f"Sesión IMAP de {session.email} cerrada por inactividad.")
+                cerrar_buzon(session.mailbox)
+                continue
+            if not session.sana():
+                cerrar_buzon(session.mailbox)
+                continue
+            with self._lock:
+                # El NOOP no cuenta como uso: la sesión sigue envejeciendo hacia el desalojo
+                duplicada = session.email in self._libres
+                if not duplicada:
+                    self._libres[session.email] = session
+            if duplicada:
+                cerrar_buzon(session.mailbox)
+
+    def _iniciar_keepalive(self):
+        with self._lock:
+            if self._keepalive is not None and self._keepalive.is_alive():
+                return
+            self._keepalive = threading.Thread(target=self._ciclo_keepalive, name="imap-keepalive", daemon=True)
+            self._keepalive.start()
+
+    def _ciclo_keepalive(self):
+        while not self._stop_event.wait(settings.EMAIL_POOL_KEEPALIVE_SECONDS):
+            try:
+                self.mantener()
+            except Exception as e:
+                logger.error(f"Error en el mantenimiento del pool IMAP: {e}", exc_info=True)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._libres)
+
+    def cerrar(self):
+        self._stop_event.set()
+        with self._lock:
+            sesiones = list(self._libres.values())
+            self._libres.clear()
+        for session in sesiones:
+            cerrar_buzon(session.mailbox)
+
+_pool: Optional[MailboxPool] = None
+_pool_lock = threading.Lock()
+
+def get_mailbox_pool() -> MailboxPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MailboxPool()
+        return _pool
@@ -0,0 +1,142 @@
+import base64
+import json
+import logging
+import os
+import quopri
+import re
+import shutil
+import tempfile
+from typing import Any, Dict, List, Tuple
+from config.settings import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+METADATOS_CORREO = "correo.json"
+SUFIJO_DESCARGA = ".descargando"
+SUFIJO_BLOQUEO = ".bloqueo"
+
+_bloqueos: Dict[str, Any] = {}
+
+class DecodificadorIncremental:
+    """Decodifica una parte MIME por bloques de tamaño arbitrario (base64, quoted-printable o sin codificar)."""
+
+    def __init__(self, encoding: str):
+        self.encoding = (encoding or "").lower()
+        self._pendiente = b""
+
+    def feed(self, datos: bytes) -> bytes:
+        if self.encoding == "base64":
+            datos = self._pendiente + re.sub(rb'[^A-Za-z0-9+/=]', b'', datos)
+            completo = len(datos) - len(datos) % 4
+            self._pendiente = datos[completo:]
+            return base64.b64decode(datos[:completo])
+        if self.encoding == "quoted-printable":
+            # Solo se decodifican líneas completas: un '=XX' o un salto suave pueden quedar partidos entre bloques
+            datos = self._pendiente + datos
+            corte = datos.rfind(b"\n") + 1
+            self._pendiente = datos[corte:]
+            return quopri.decodestring(datos[:corte])
+        return datos
+
+    def flush(self) -> bytes:
+        pendiente, self._pendiente = self._pendiente, b""
+        if not pendiente:
+            return b""
+        if self.encoding == "base64":
+            return base64.b64decode(pendiente + b"=" * (-len(pendiente) % 4))
+        if self.encoding == "quoted-printable":
+            return quopri.decodestring(pendiente)
+        return pendiente
+
+def uso_spool(directorio: str = None) -> int:
+    directorio = directorio or settings.EMAIL_SPOOL_DIR
+    total = 0
+    for raiz, _, archivos in os.walk(directorio):
+        for archivo in archivos:
+            try:
+                total += os.path.getsize(os.path.join(raiz, archivo))
+            except OSError:
+                pass
+    return total
+
+def crear_directorio_correo(prefijo: str, metadatos: Dict[str, Any]) -> str:
+    """Directorio del spool para los adjuntos de un correo, con sus metadatos para recuperarlo tras un reinicio.
+
+    Se crea con SUFIJO_DESCARGA; `confirmar_directorio_correo` lo renombra cuando la descarga terminó,
+    así un reinicio a mitad de descarga nunca deja adjuntos incompletos para procesar.
+    """
+    os.makedirs(settings.EMAIL_SPOOL_DIR, exist_ok=True)
+    directorio = tempfile.mkdtemp(prefix=f"{prefijo}_", suffix=SUFIJO_DESCARGA, dir=settings.EMAIL_SPOOL_DIR)
+    with open(os.path.join(directorio, METADATOS_CORREO), "w", encoding="utf-8") as f:
+        json.dump(metadatos, f, ensure_ascii=False)
+    return directorio
+
+def confirmar_directorio_correo(directorio: str, paths: List[str]) -> List[str]:
+    final = directorio[:-len(SUFIJO_DESCARGA)]
+    os.rename(directorio, final)
+    return [os.path.join(final, os.path.basename(path)) for path in paths]
+
+def liberar_adjunto(file_path: str):
+    """Borra un adjunto del spool y, si era el último de su correo, también los metadatos y el directorio."""
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    directorio = os.path.dirname(file_path)
+    try:
+        restantes = os.listdir(directorio)
+    except OSError:
+        return
+    if not restantes or restantes == [METADATOS_CORREO]:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+def bloquear_spool() -> bool:
+    """Toma EMAIL_SPOOL_DIR en exclusiva para este proceso hasta que termine; False si otro proceso ya lo tiene.
+
+    La recuperación borra descargas a medias y reencola lo pendiente, así que solo es segura si ningún otro
+    proceso usa el mismo spool: cada proceso de ingesta necesita su propio EMAIL_SPOOL_DIR.
+    """
+    directorio = os.path.abspath(settings.EMAIL_SPOOL_DIR)
+    if directorio in _bloqueos or fcntl is None:
+        return True
+    os.makedirs(os.path.dirname(directorio), exist_ok=True)
+    bloqueo = open(directorio + SUFIJO_BLOQUEO, "w")
+    try:
+        fcntl.flock(bloqueo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        bloqueo.close()
+        return False
+    _bloqueos[directorio] = bloqueo
+    return True
+
+def recuperar_spool() -> List[Tuple[str, Dict[str, Any], bool]]:
+    """Adjuntos que quedaron en el spool (descargados y registrados pero sin procesar) al detenerse el proceso."""
+    trabajos = []
+    if not bloquear_spool():
+        logger.error(f"El spool {settings.EMAIL_SPOOL_DIR} lo usa otro proceso; no se recupera.")
+        return trabajos
+    if not os.path.isdir(settings.EMAIL_SPOOL_DIR):
+        return trabajos
+    for nombre in sorted(os.listdir(settings.EMAIL_SPOOL_DIR)):
+        directorio = os.path.join(settings.EMAIL_SPOOL_DIR, nombre)
+        if not os.path.isdir(directorio):
+            continue
+        if nombre.endswith(SUFIJO_DESCARGA):
+            shutil.rmtree(directorio, ignore_errors=True)
+            continue
+        try:
+            with open(os.path.join(directorio, METADATOS_CORREO), "r", encoding="utf-8") as f:
+                metadatos = json.load(f)
+        except (OSError, ValueError):
+            metadatos = {}
+        adjuntos = [os.path.join(directorio, archivo) for archivo in sorted(os.listdir(directorio)) if archivo != METADATOS_CORREO]
+        if not adjuntos:
+            shutil.rmtree(directorio, ignore_errors=True)
+            continue
+        trabajos.extend((adjunto, metadatos, True) for adjunto in adjuntos)
+    if trabajos:
+        logger.info(f"{len(trabajos)} adjuntos pendientes recuperados del spool {settings.EMAIL_SPOOL_DIR}.")
+    return trabajos
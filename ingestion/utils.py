@@ -1,20 +1,101 @@
 import os
 import re
+import json
+import hashlib
+import socket
+import logging
+from database.models import SessionLocal
+from database.crud import DocumentHashCRUD, MailLedgerCRUD
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+NODO = f"{socket.gethostname()}:{os.getpid()}"
 
 def sanitize_email(email):
     return re.sub(r'[^a-zA-Z0-9]', '_', email)
-def cargar_uids_procesados(email=None):
-    archivo = "uids_procesados.txt"
-    if email:
-        archivo = f"uids_procesados_{sanitize_email(email)}.txt"
-    if not os.path.exists(archivo):
-        return set()
-    with open(archivo, "r") as f:
-        return set(line.strip() for line in f if line.strip())
-
-def guardar_uid(uid, email=None):
-    archivo = "uids_procesados.txt"
-    if email:
-        archivo = f"uids_procesados_{sanitize_email(email)}.txt"
-    with open(archivo, "a") as f:
-        f.write(f"{uid}\n")
+def reclamar_uids(email, uidvalidity, uids):
+    """Reclama los UID para este nodo; devuelve (reclamados, ocupados por otro nodo). Los completados no aparecen."""
+    session = SessionLocal()
+    try:
+        return MailLedgerCRUD(session).claim(email, int(uidvalidity), [int(uid) for uid in uids],
+                                             NODO, settings.EMAIL_CLAIM_STALE_SECONDS)
+    finally:
+        session.close()
+def completar_uids(email, uidvalidity, uids):
+    session = SessionLocal()
+    try:
+        return MailLedgerCRUD(session).complete(email, int(uidvalidity), [int(uid) for uid in uids])
+    finally:
+        session.close()
+def liberar_uids(email, uidvalidity, uids):
+    session = SessionLocal()
+    try:
+        return MailLedgerCRUD(session).release(email, int(uidvalidity), [int(uid) for uid in uids], NODO)
+    finally:
+        session.close()
+def cargar_marca_uid(email):
+    """Devuelve {'uidvalidity', 'uid'} del último UID leído de la cuenta, o None si no hay marca."""
+    session = SessionLocal()
+    try:
+        marca = MailLedgerCRUD(session).get_watermark(email)
+        return {"uidvalidity": marca.uidvalidity, "uid": marca.uid} if marca else None
+    finally:
+        session.close()
+def guardar_marca_uid(email, uidvalidity, uid):
+    session = SessionLocal()
+    try:
+        return MailLedgerCRUD(session).advance_watermark(email, int(uidvalidity), int(uid))
+    finally:
+        session.close()
+def migrar_registros_locales(email, uidvalidity):
+    """Pasa al registro en BD los UID y la marca que versiones anteriores guardaban en archivos de texto/JSON."""
+    archivo_uids = f"uids_procesados_{sanitize_email(email)}.txt"
+    if os.path.exists(archivo_uids):
+        with open(archivo_uids, "r") as f:
+            uids = sorted({int(line.strip()) for line in f if line.strip().isdigit()})
+        reclamados, _ = reclamar_uids(email, uidvalidity, uids)
+        if completar_uids(email, uidvalidity, reclamados):
+            os.replace(archivo_uids, f"{archivo_uids}.migrado")
+            logger.info(f"{len(uids)} UID procesados de {email} migrados desde {archivo_uids}.")
+    archivo_marca = f"marca_uid_{sanitize_email(email)}.json"
+    if os.path.exists(archivo_marca):
+        try:
+            with open(archivo_marca, "r", encoding="utf-8") as f:
+                marca = json.load(f)
+            if guardar_marca_uid(email, marca["uidvalidity"], marca["uid"]):
+                os.replace(archivo_marca, f"{archivo_marca}.migrado")
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"No se pudo migrar la marca de UID de {archivo_marca}: {e}")
+def sha256_de_archivo(path, bloque=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for datos in iter(lambda: f.read(bloque), b""):
+            sha256.update(datos)
+    return sha256.hexdigest()
+def facturas_por_huella(sha256):
+    """IDs de las facturas ya extraídas de un adjunto con este SHA-256 (vacío si es nuevo)."""
+    session = SessionLocal()
+    try:
+        return DocumentHashCRUD(session).find_invoices(sha256)
+    finally:
+        session.close()
+def factura_por_cufe(cufe):
+    session = SessionLocal()
+    try:
+        return DocumentHashCRUD(session).find_invoice_by_cufe(cufe)
+    finally:
+        session.close()
+def registrar_huellas(sha256, facturas):
+    """Liga el SHA-256 de un adjunto a las facturas [(id_factura, cufe)] que se extrajeron de él."""
+    session = SessionLocal()
+    try:
+        return DocumentHashCRUD(session).register(sha256, facturas)
+    finally:
+        session.close()
+def vincular_correo_duplicado(ids_factura, sha256, metadatos, ruta_archivo=None):
+    session = SessionLocal()
+    try:
+        return DocumentHashCRUD(session).link_email(ids_factura, sha256, metadatos or {}, ruta_archivo)
+    finally:
+        session.close()
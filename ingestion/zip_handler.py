@@ -15,36 +15,95 @@
 #     return pdfs
 
  
-import zipfile
-import tempfile
+import io
+import re
 import os
+import zipfile
 import logging
+from typing import Dict, List, Optional, Tuple, Union
+from config.settings import settings
 
 logger = logging.getLogger(__name__)
 
-def extraer_archivos_de_zip(ruta_zip: str):
-    temp_dir = tempfile.mkdtemp()
-    extracted_paths = {'pdfs': [], 'xmls': []}
+EXTENSIONES_ZIP = ('.pdf', '.xml')
+
+class ZipDemasiadoGrande(Exception):
+    pass
+
+def _leer_miembro(archivo_zip: zipfile.ZipFile, info: zipfile.ZipInfo, disponible: int) -> bytes:
+    """Lee un miembro sin descomprimir más de `disponible` bytes, aunque la cabecera declare un tamaño menor."""
+    if info.file_size > disponible:
+        raise ZipDemasiadoGrande(f"{info.filename} declara {info.file_size} bytes descomprimidos")
+    with archivo_zip.open(info) as miembro:
+        contenido = miembro.read(disponible + 1)
+    if len(contenido) > disponible:
+        raise ZipDemasiadoGrande(f"{info.filename} se descomprime a más de lo que declara")
+    return contenido
+
+def _recorrer_zip(archivo_zip: zipfile.ZipFile, prefijo: str, profundidad: int, disponible: List[int],
+                  encontrados: Dict[str, List[Tuple[str, bytes]]]):
+    for info in archivo_zip.infolist():
+        if info.is_dir():
+            continue
+        nombre = info.filename
+        extension = os.path.splitext(nombre)[1].lower()
+        if extension == '.zip':
+            if profundidad >= settings.ZIP_MAX_NESTING:
+                logger.warning(f"ZIP anidado {prefijo}{nombre} ignorado: supera {settings.ZIP_MAX_NESTING} niveles.")
+                continue
+            contenido = _leer_miembro(archivo_zip, info, disponible[0])
+            disponible[0] -= len(contenido)
+            with zipfile.ZipFile(io.BytesIO(contenido)) as anidado:
+                _recorrer_zip(anidado, f"{prefijo}{nombre}/", profundidad + 1, disponible, encontrados)
+        elif extension in EXTENSIONES_ZIP:
+            contenido = _leer_miembro(archivo_zip, info, disponible[0])
+            disponible[0] -= len(contenido)
+            encontrados[extension[1:] + 's'].append((prefijo + nombre, contenido))
+        else:
+            logger.info(f"Archivo no procesado en ZIP: {prefijo}{nombre}")
+
+def leer_archivos_de_zip(origen: Union[str, bytes], limite: Optional[int] = None) -> Dict[str, List[Tuple[str, bytes]]]:
+    """Lee en memoria los PDF y XML de un ZIP (también de ZIP anidados) sin extraerlos a disco.
+
+    Devuelve {'pdfs': [(nombre, contenido)], 'xmls': [...]}; los nombres de miembros anidados llevan
+    la ruta del ZIP interior ('interno.zip/factura.xml'). Si el total descomprimido supera `limite`
+    (ZIP_MAX_DECOMPRESSED_BYTES por defecto) se descarta el ZIP completo.
+    """
+    limite = limite if limite is not None else settings.ZIP_MAX_DECOMPRESSED_BYTES
+    encontrados = {'pdfs': [], 'xmls': []}
+    etiqueta = origen if isinstance(origen, str) else "ZIP en memoria"
     try:
-        with zipfile.ZipFile(ruta_zip, 'r') as archivo_zip:
-            for nombre in archivo_zip.namelist():
-                if nombre.endswith('/'):
-                    continue
-                nombre_base = os.path.basename(nombre)
-                temp_file_path = os.path.join(temp_dir, nombre_base)
-                with archivo_zip.open(nombre) as archivo_en_zip:
-                    with open(temp_file_path, 'wb') as temp_f:
-                        temp_f.write(archivo_en_zip.read())
-                if nombre.lower().endswith('.pdf'):
-                    extracted_paths['pdfs'].append(temp_file_path)
-                elif nombre.lower().endswith('.xml'):
-                    extracted_paths['xmls'].append(temp_file_path)
-                else:
-                    logger.info(f"Archivo no procesado en ZIP: {nombre}")
+        with zipfile.ZipFile(io.BytesIO(origen) if isinstance(origen, bytes) else origen, 'r') as archivo_zip:
+            _recorrer_zip(archivo_zip, "", 0, [limite], encontrados)
+    except ZipDemasiadoGrande as e:
+        logger.error(f"ZIP {etiqueta} descartado: supera el límite de {limite} bytes descomprimidos ({e}).")
+        return {'pdfs': [], 'xmls': []}
     except Exception as e:
-        logger.error(f"Error al extraer de ZIP {ruta_zip}: {e}", exc_info=True)
-        if os.path.exists(temp_dir):
-            import shutil
-            shutil.rmtree(temp_dir)
-        return {'pdfs': [], 'xmls': [], 'temp_dir': None}
-    return {'pdfs': extracted_paths['pdfs'], 'xmls': extracted_paths['xmls'], 'temp_dir': temp_dir}
\ No newline at end of file
+        logger.error(f"Error al leer el ZIP {etiqueta}: {e}", exc_info=True)
+        return {'pdfs': [], 'xmls': []}
+    return encontrados
+
+def _clave_factura(nombre: str) -> str:
+    """Nombre base sin extensión ni el prefijo de la DIAN (ad/fv/nc/nd) que distingue el XML del PDF."""
+    base = os.path.splitext(os.path.basename(nombre))[0].lower()
+    return re.sub(r'^(ad|fv|nc|nd)(?=\d)', '', base)
+
+def emparejar_facturas(encontrados: Dict[str, List[Tuple[str, bytes]]]) -> List[Dict[str, Optional[Tuple[str, bytes]]]]:
+    """Agrupa los miembros de un ZIP en facturas {'xml': (nombre, contenido) | None, 'pdf': ... | None}.
+
+    El XML y el PDF de una factura se emparejan por nombre; si tras eso queda un único XML y un único
+    PDF sueltos se asume que son la misma factura.
+    """
+    pdfs = {}
+    for pdf in encontrados['pdfs']:
+        pdfs.setdefault(_clave_factura(pdf[0]), []).append(pdf)
+    facturas = []
+    for xml in encontrados['xmls']:
+        candidatos = pdfs.get(_clave_factura(xml[0]))
+        facturas.append({'xml': xml, 'pdf': candidatos.pop(0) if candidatos else None})
+    sueltos = [pdf for candidatos in pdfs.values() for pdf in candidatos]
+    sin_pdf = [factura for factura in facturas if factura['pdf'] is None]
+    if len(sueltos) == 1 and len(sin_pdf) == 1:
+        sin_pdf[0]['pdf'] = sueltos.pop()
+    facturas.extend({'xml': None, 'pdf': pdf} for pdf in sueltos)
+    return facturas
@@ -2,41 +2,44 @@ import logging
 import json
 import os
 import re
-from typing import Dict, Any, Optional, List
-from database.crud import CorrectedFieldCRUD, ItemCorrectionCRUD 
-from database.models import SessionLocal, CampoCorregido, ItemCorregido 
+from typing import Dict, Any, Optional, List, Tuple
+from database.crud import CorrectedFieldCRUD, ItemCorrectionCRUD, LearningStateCRUD, correction_count_key
+from database.models import SessionLocal, CampoCorregido, ItemCorregido, ORIGEN_CABECERA, ORIGEN_ITEM
 from datetime import datetime
 from config.settings import settings
-from sklearn.ensemble import RandomForestClassifier
+from learning.pattern_store import get_pattern_store
+from learning.incremental_model import build_correction_text
+from learning.model_store import ReloadableModel
 import pandas as pd
-import pickle
 
 logger = logging.getLogger(__name__)
 
+LEARNING_FIELD_MAPPING = {
+    "numero_factura": "invoice_number",
+    "nombre_proveedor": "supplier_name",
+    "nit_proveedor": "supplier_tax_id",
+    "nombre_cliente": "customer_name",
+    "nit_cliente": "customer_tax_id",
+    "fecha_emision": "issue_date",
+    "fecha_vencimiento": "due_date",
+    "monto_total": "total_amount",
+    "moneda": "currency",
+}
+
 class FeedbackHandler:
     def __init__(self):
         self.db_session = SessionLocal()
         self.corrected_field_crud = CorrectedFieldCRUD(self.db_session)
         self.item_correction_crud = ItemCorrectionCRUD(self.db_session) 
+        self.learning_state_crud = LearningStateCRUD(self.db_session)
+        self.pattern_store = get_pattern_store()
         self.learned_patterns = self._load_learned_patterns()
 
     def _load_learned_patterns(self) -> Dict[str, Any]:
-        if os.path.exists(settings.LEARNED_PATTERNS_FILE):
-            with open(settings.LEARNED_PATTERNS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    patterns = json.load(f)
-                    logger.info(f"Patrones de aprendizaje cargados desde {settings.LEARNED_PATTERNS_FILE}")
-                    return patterns
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error al decodificar JSON de patrones aprendidos: {e}. Se usará un diccionario vacío.")
-                    return {"regex_patterns": {}, "nlp_terms": [], "item_patterns": {}}
-        logger.info("No se encontró el archivo de patrones aprendidos. Se iniciará con patrones vacíos.")
-        return {"regex_patterns": {}, "nlp_terms": [], "item_patterns": {}}
+        return dict(self.pattern_store.get())
 
     def _save_learned_patterns(self):
-        with open(settings.LEARNED_PATTERNS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.learned_patterns, f, indent=4, ensure_ascii=False)
-        logger.info(f"Patrones de aprendizaje guardados en {settings.LEARNED_PATTERNS_FILE}")
+        self.learned_patterns["version"] = self.pattern_store.save(self.learned_patterns)
 
     def record_correction(self, invoice_id: int, field_name: str, original_value: str, corrected_value: str) -> Optional[CampoCorregido]:
         try:
@@ -44,7 +47,8 @@ class FeedbackHandler:
                 id_factura=invoice_id,
                 nombre_campo=field_name,
                 valor_original=original_value,
-                valor_corregido=corrected_value
+                valor_corregido=corrected_value,
+                commit=False
             )
             self.db_session.commit()
             return correction
@@ -78,76 +82,88 @@ class FeedbackHandler:
             logger.error(f"Error al registrar corrección de ítem en DB: {e}")
             return None
 
-    def learn_from_corrections(self) -> None:
-        all_header_corrections = self.corrected_field_crud.get_all_corrected_fields()
-        all_item_corrections = self.item_correction_crud.get_all_item_corrections()
-        logger.info(f"Procesando {len(all_header_corrections)} correcciones de cabecera y {len(all_item_corrections)} correcciones de ítems para aprendizaje incremental.")
+    def request_learning(self) -> bool:
+        return self.learning_state_crud.request_learning()
+
+    def learn_from_corrections(self, full_rebuild: bool = False) -> None:
+        started_at = datetime.now()
+        if full_rebuild:
+            self.learning_state_crud.reset()
+            self.db_session.commit()
+        header_count = self._consume_corrections(ORIGEN_CABECERA)
+        item_count = self._consume_corrections(ORIGEN_ITEM)
+        logger.info(f"Procesadas {header_count} correcciones de cabecera y {item_count} correcciones de ítems nuevas para aprendizaje incremental.")
+        new_patterns = self._build_learned_patterns()
+        if any(self.learned_patterns.get(key) != value for key, value in new_patterns.items()):
+            self.learned_patterns.update(new_patterns)
+            self._save_learned_patterns()
+        else:
+            logger.info("Los patrones aprendidos no cambiaron. No se reescribe el archivo.")
+        state = self.learning_state_crud.get_state(for_update=True)
+        state.aprendido_en = started_at
+        if state.solicitado_en is None or state.solicitado_en <= started_at:
+            state.pendiente_desde = None
+        self.db_session.commit()
+        logger.info("Proceso de aprendizaje completado.")
+
+    def _consume_corrections(self, origen: str) -> int:
+        processed = 0
+        while True:
+            state = self.learning_state_crud.get_state(for_update=True)
+            ultimo_id = state.cabecera_ultimo_id if origen == ORIGEN_CABECERA else state.items_ultimo_id
+            batch_end = self.learning_state_crud.get_batch_end(origen, ultimo_id, settings.LEARNING_BATCH_SIZE)
+            if batch_end is None:
+                self.db_session.commit()
+                return processed
+            hasta_id, full_batch = batch_end
+            counts: Dict[tuple, int] = {}
+            for nombre_campo, valor_corregido, count in self.learning_state_crud.aggregate_corrections(origen, ultimo_id, hasta_id):
+                key = correction_count_key(origen, nombre_campo, valor_corregido)
+                if key:
+                    counts[key] = counts.get(key, 0) + count
+                    processed += count
+            if counts:
+                self.learning_state_crud.add_counts(origen, counts)
+            if origen == ORIGEN_CABECERA:
+                state.cabecera_ultimo_id = hasta_id
+            else:
+                state.items_ultimo_id = hasta_id
+            self.db_session.commit()
+            if not full_batch:
+                return processed
+
+    def _build_learned_patterns(self) -> Dict[str, Any]:
         new_regex_patterns = {}
         new_nlp_terms = []
         new_item_patterns = {}
 
-        field_corrections: Dict[str, Dict[str, int]] = {}
-        for correction in all_header_corrections:
-            if correction.nombre_campo not in field_corrections:
-                field_corrections[correction.nombre_campo] = {}
-            field_corrections[correction.nombre_campo][correction.valor_corregido] = \
-                field_corrections[correction.nombre_campo].get(correction.valor_corregido, 0) + 1
-
-        for field_name_es, values_count in field_corrections.items():
-            most_frequent_value = max(values_count, key=values_count.get)
-            count = values_count[most_frequent_value]
-
-            if count > 5:
-                logger.info(f"Corrección frecuente para '{field_name_es}': '{most_frequent_value}' ({count} veces).")
+        for row in self.learning_state_crud.get_winning_values(ORIGEN_CABECERA, settings.LEARNING_MIN_CORRECTIONS):
+            field_name_es = row.nombre_campo
+            most_frequent_value = row.valor_corregido
+            logger.info(f"Corrección frecuente para '{field_name_es}': '{most_frequent_value}' ({row.conteo} veces).")
+            field_name_en = LEARNING_FIELD_MAPPING.get(field_name_es)
+            if field_name_en:
+                if field_name_en == "invoice_number":
+                    new_regex_patterns[field_name_en] = f"(?i){re.escape(most_frequent_value)}"
+                    logger.info(f"Regex aprendido para '{field_name_en}': '{new_regex_patterns[field_name_en]}'")
+                elif field_name_en in ["supplier_name", "customer_name", "supplier_tax_id", "customer_tax_id"]:
+                    if most_frequent_value not in new_nlp_terms:
+                        new_nlp_terms.append(most_frequent_value)
+                    logger.info(f"NLP: Añadido término aprendido para '{field_name_en}': '{most_frequent_value}'")
+            else:
+                logger.warning(f"No se encontró mapeo en inglés para el campo '{field_name_es}' para el aprendizaje.")
+        for row in self.learning_state_crud.get_counts(ORIGEN_ITEM):
+            if row.valor_corregido not in new_nlp_terms:
+                new_nlp_terms.append(row.valor_corregido)
+                logger.debug(f"NLP: Añadido término aprendido de ítem: '{row.valor_corregido}'")
+        return {
+            "regex_patterns": new_regex_patterns,
+            "nlp_terms": new_nlp_terms,
+            "item_patterns": new_item_patterns,
+        }
 
-                field_name_en = None
-                if field_name_es == "numero_factura":
-                    field_name_en = "invoice_number"
-                elif field_name_es == "nombre_proveedor":
-                    field_name_en = "supplier_name"
-                elif field_name_es == "nit_proveedor":
-                    field_name_en = "supplier_tax_id"
-                elif field_name_es == "nombre_cliente":
-                    field_name_en = "customer_name"
-                elif field_name_es == "nit_cliente":
-                    field_name_en = "customer_tax_id"
-                elif field_name_es == "fecha_emision":
-                    field_name_en = "issue_date"
-                elif field_name_es == "fecha_vencimiento":
-                    field_name_en = "due_date"
-                elif field_name_es == "monto_total":
-                    field_name_en = "total_amount"
-                elif field_name_es == "moneda":
-                    field_name_en = "currency"
-                if field_name_en:
-                    if field_name_en == "invoice_number":
-                        new_regex_patterns[field_name_en] = f"(?i){re.escape(most_frequent_value)}"
-                        logger.info(f"Regex aprendido para '{field_name_en}': '{new_regex_patterns[field_name_en]}'")
-                    elif field_name_en in ["supplier_name", "customer_name", "supplier_tax_id", "customer_tax_id"]:
-                        if most_frequent_value not in new_nlp_terms:
-                            new_nlp_terms.append(most_frequent_value)
-                        logger.info(f"NLP: Añadido término aprendido para '{field_name_en}': '{most_frequent_value}'")
-                else:
-                    logger.warning(f"No se encontró mapeo en inglés para el campo '{field_name_es}' para el aprendizaje.")
-        for item_correction in all_item_corrections:
-            logger.debug(f"Procesando corrección de ítem (para aprendizaje futuro): {item_correction.tipo_correccion} - {item_correction.campo_corregido} - {item_correction.valor_corregido}")
-            if item_correction.campo_corregido == 'descripcion' and item_correction.valor_corregido:
-                corrected_desc = item_correction.valor_corregido
-                if isinstance(corrected_desc, str) and corrected_desc.strip().startswith('{') and corrected_desc.strip().endswith('}'):
-                    try:
-                        item_dict = json.loads(corrected_desc)
-                        if 'description' in item_dict:
-                            corrected_desc = item_dict['description']
-                    except json.JSONDecodeError:
-                        pass 
-                if corrected_desc not in new_nlp_terms:
-                    new_nlp_terms.append(corrected_desc)
-                    logger.info(f"NLP: Añadido término aprendido de ítem: '{corrected_desc}'")
-        self.learned_patterns["regex_patterns"] = new_regex_patterns
-        self.learned_patterns["nlp_terms"] = new_nlp_terms
-        self.learned_patterns["item_patterns"] = new_item_patterns 
-        self._save_learned_patterns()
-        logger.info("Proceso de aprendizaje completado y patrones guardados.")
+    def get_top_corrected_fields(self, limit: int = 10) -> List[Dict[str, Any]]:
+        return self.learning_state_crud.get_top_corrected_fields(limit)
 
     def close_db_session(self):
         if self.db_session and self.db_session.is_active:
@@ -294,16 +310,21 @@ class FeedbackHandler:
 class FeedbackHandlerML:
     def __init__(self, model_path: str):
         try:
-            with open(model_path, 'rb') as f:
-                self.model = pickle.load(f)
+            self._model = ReloadableModel(model_path)
             logger.info(f"Modelo de corrección cargado desde '{model_path}'.")
         except FileNotFoundError:
             logger.error(f"No se encontró el modelo en '{model_path}'. Por favor, entrene el modelo primero.")
             raise
+    @property
+    def model(self):
+        return self._model.get()
+
     def predict_correction(self, field_name: str, original_value: str) -> str:
-        features = pd.DataFrame([{
-            "field_name": field_name,
-            "original_value": original_value
-        }])
-        predicted_value = self.model.predict(features)[0]
-        return predicted_value
\ No newline at end of file
+        return self.predict_corrections([(field_name, original_value)])[0]
+
+    def predict_corrections(self, fields: List[Tuple[str, Any]]) -> List[str]:
+        """Predice en una sola llamada al modelo las correcciones de pares (campo, valor) de una o varias facturas."""
+        if not fields:
+            return []
+        texts = [build_correction_text(field_name, original_value) for field_name, original_value in fields]
+        return list(self.model.predict(texts))
\ No newline at end of file
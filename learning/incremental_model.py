@@ -0,0 +1,116 @@
+import logging
+import os
+from typing import Any, Dict, List, Optional
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from config.settings import settings
+from database.crud import CorrectedFieldCRUD
+from database.models import SessionLocal
+from utils.helpers import save_joblib_atomic
+
+logger = logging.getLogger(__name__)
+
+def build_correction_text(field_name: str, original_value: Any) -> str:
+    """Texto de entrada común a los modelos de corrección: nombre del campo más valor extraído."""
+    return f"{field_name} {'' if original_value is None else original_value}"
+
+class IncrementalCorrectionModel:
+    """Modelo de corrección multiclase que se actualiza con partial_fit.
+
+    Un solo SGDClassifier con `max_labels` clases fijas: cada valor corregido nuevo ocupa una clase
+    libre y, con todas ocupadas, sus correcciones se ignoran. Así el tamaño del modelo
+    (max_labels x n_features) y el coste de cada lote no crecen con el número de valores corregidos.
+    Solo se aprenden los campos de CORRECTION_MODEL_FIELDS, de pocos valores distintos. El id de la última
+    corrección aprendida viaja con el checkpoint como marca de agua.
+    """
+
+    def __init__(self, n_features: Optional[int] = None, max_labels: Optional[int] = None):
+        self.vectorizer = HashingVectorizer(n_features=n_features or settings.CORRECTION_MODEL_FEATURES, analyzer='char_wb',
+                                            ngram_range=(2, 4), alternate_sign=False, norm='l2')
+        self.max_labels = max_labels or settings.CORRECTION_MODEL_MAX_LABELS
+        self.classifier = SGDClassifier(loss='modified_huber', alpha=1e-5, random_state=0)
+        self.labels: List[str] = []
+        self.label_index: Dict[str, int] = {}
+        self.ultimo_id = 0
+        self.muestras = 0
+
+    def partial_fit(self, texts: List[str], labels: List[str]):
+        rows, y = [], []
+        for text, label in zip(texts, labels):
+            if label not in self.label_index:
+                if len(self.labels) >= self.max_labels:
+                    continue
+                self.label_index[label] = len(self.labels)
+                self.labels.append(label)
+            rows.append(text)
+            y.append(self.label_index[label])
+        if len(rows) < len(texts):
+            logger.warning(f"{len(texts) - len(rows)} correcciones ignoradas: el modelo ya tiene {self.max_labels} valores corregidos.")
+        if not rows:
+            return
+        self.classifier.partial_fit(self.vectorizer.transform(rows), np.asarray(y), classes=np.arange(self.max_labels))
+        self.muestras += len(rows)
+
+    def predict(self, texts: List[str]) -> np.ndarray:
+        if not self.labels:
+            raise ValueError("El modelo de corrección incremental aún no tiene correcciones aprendidas.")
+        scores = self.classifier.decision_function(self.vectorizer.transform(texts))
+        if scores.ndim == 1:
+            # Con max_labels=2 sklearn entrena un único clasificador binario
+            scores = np.column_stack([-scores, scores])
+        # Solo compiten las clases con un valor asignado
+        scores = scores[:, :len(self.labels)]
+        return np.asarray(self.labels, dtype=object)[scores.argmax(axis=1)]
+
+    def save(self, model_path: str):
+        save_joblib_atomic(self, model_path)
+        logger.info(f"Checkpoint del modelo de corrección incremental guardado en '{model_path}' "
+                    f"({len(self.labels)} clases, {self.muestras} muestras).")
+
+    @classmethod
+    def load(cls, model_path: str) -> "IncrementalCorrectionModel":
+        if os.path.exists(model_path):
+            model = joblib.load(model_path)
+            if isinstance(model, cls) and hasattr(model, 'label_index'):
+                return model
+            logger.info(f"El modelo en '{model_path}' no es incremental. Se iniciará un modelo incremental nuevo.")
+        return cls()
+
+def update_correction_model(model_path: Optional[str] = None, batch_size: Optional[int] = None,
+                            checkpoint_batches: Optional[int] = None) -> int:
+    """Aprende las correcciones de cabecera posteriores a la marca de agua del checkpoint. Devuelve cuántas procesó."""
+    model_path = model_path or settings.CORRECTION_MODEL_PATH
+    batch_size = batch_size or settings.CORRECTION_MODEL_BATCH_SIZE
+    checkpoint_batches = checkpoint_batches or settings.CORRECTION_MODEL_CHECKPOINT_BATCHES
+    model = IncrementalCorrectionModel.load(model_path)
+    db_session = SessionLocal()
+    corrected_field_crud = CorrectedFieldCRUD(db_session)
+    processed = 0
+    batches = 0
+    try:
+        while True:
+            corrections = corrected_field_crud.get_corrected_fields_after(model.ultimo_id, batch_size)
+            if not corrections:
+                break
+            # Números de factura, montos y fechas no se repiten entre facturas: no son clases aprendibles
+            usable = [c for c in corrections if c.valor_corregido is not None and c.nombre_campo in settings.CORRECTION_MODEL_FIELDS]
+            model.partial_fit(
+                [build_correction_text(c.nombre_campo, c.valor_original) for c in usable],
+                [c.valor_corregido for c in usable]
+            )
+            model.ultimo_id = corrections[-1].id
+            processed += len(corrections)
+            batches += 1
+            if batches % checkpoint_batches == 0:
+                model.save(model_path)
+            if len(corrections) < batch_size:
+                break
+    finally:
+        db_session.close()
+    if batches % checkpoint_batches:
+        model.save(model_path)
+    if processed:
+        logger.info(f"Modelo de corrección actualizado incrementalmente con {processed} correcciones.")
+    return processed
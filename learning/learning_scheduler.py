@@ -0,0 +1,67 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Optional
+from config.settings import settings
+from database.crud import LearningStateCRUD
+from database.models import SessionLocal
+from learning.feedback_handler import FeedbackHandler
+
+logger = logging.getLogger(__name__)
+
+def learning_due(state: Any, now: datetime, debounce_seconds: int, max_delay_seconds: int) -> bool:
+    """Indica si hay una solicitud de aprendizaje pendiente cuyo periodo de espera ya venció."""
+    if state is None or state.solicitado_en is None:
+        return False
+    if state.aprendido_en is not None and state.solicitado_en <= state.aprendido_en:
+        return False
+    if (now - state.solicitado_en).total_seconds() >= debounce_seconds:
+        return True
+    pendiente_desde = state.pendiente_desde or state.solicitado_en
+    return (now - pendiente_desde).total_seconds() >= max_delay_seconds
+
+class LearningScheduler:
+    def __init__(self, debounce_seconds: Optional[int] = None, max_delay_seconds: Optional[int] = None,
+                 poll_seconds: Optional[int] = None):
+        self.debounce_seconds = debounce_seconds if debounce_seconds is not None else settings.LEARNING_DEBOUNCE_SECONDS
+        self.max_delay_seconds = max_delay_seconds if max_delay_seconds is not None else settings.LEARNING_MAX_DELAY_SECONDS
+        self.poll_seconds = poll_seconds if poll_seconds is not None else settings.LEARNING_POLL_SECONDS
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="learning-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Planificador de aprendizaje iniciado (espera {self.debounce_seconds}s, máximo {self.max_delay_seconds}s).")
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_seconds):
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Error en el planificador de aprendizaje: {e}", exc_info=True)
+
+    def run_pending(self) -> bool:
+        db_session = SessionLocal()
+        try:
+            state = LearningStateCRUD(db_session).get_state()
+            due = learning_due(state, datetime.now(), self.debounce_seconds, self.max_delay_seconds)
+            db_session.commit()
+        finally:
+            db_session.close()
+        if not due:
+            return False
+        feedback_handler = FeedbackHandler()
+        try:
+            feedback_handler.learn_from_corrections()
+        finally:
+            feedback_handler.close_db_session()
+        return True
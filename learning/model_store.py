@@ -0,0 +1,39 @@
+import logging
+import threading
+import joblib
+from typing import Any
+from config.settings import settings
+from utils.helpers import file_signature
+
+logger = logging.getLogger(__name__)
+
+class ReloadableModel:
+    """Modelo en disco que se vuelve a cargar cuando el servicio de reentrenamiento lo reemplaza.
+
+    El servicio escribe los modelos con un rename atómico, así que un cambio de firma
+    (inodo, mtime, tamaño) indica que hay una versión nueva completa para cargar.
+    """
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._model = None
+        self.get()
+
+    def get(self) -> Any:
+        signature = file_signature(self.model_path)
+        if signature is None:
+            if self._model is None:
+                raise FileNotFoundError(self.model_path)
+            return self._model
+        with self._lock:
+            if signature != self._signature:
+                self._model = self._load()
+                self._signature = signature
+                logger.info(f"Modelo cargado desde '{self.model_path}'.")
+            return self._model
+
+    def _load(self) -> Any:
+        # Con mmap_mode los arrays del modelo quedan en la caché de páginas y se comparten entre workers
+        return joblib.load(self.model_path, mmap_mode=settings.MODEL_MMAP_MODE or None)
@@ -0,0 +1,101 @@
+import copy
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Optional, Tuple
+from config.settings import settings
+from utils.helpers import save_json_atomic, file_signature
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+EMPTY_PATTERNS = {"version": 0, "regex_patterns": {}, "nlp_terms": [], "item_patterns": {}}
+
+class LearnedPatternStore:
+    """Patrones aprendidos compartidos entre procesos.
+
+    Las escrituras son atómicas (archivo temporal + rename) y cada una incrementa "version".
+    Los lectores solo vuelven a parsear el archivo cuando cambia su firma (inodo, mtime, tamaño).
+    """
+
+    def __init__(self, path: Optional[str] = None, empty: Optional[Dict[str, Any]] = None):
+        self.path = path or settings.LEARNED_PATTERNS_FILE
+        self.empty = empty if empty is not None else EMPTY_PATTERNS
+        self._lock = threading.Lock()
+        self._signature = None
+        self._patterns: Dict[str, Any] = copy.deepcopy(self.empty)
+
+    def get(self) -> Dict[str, Any]:
+        """Devuelve los patrones vigentes. El diccionario es compartido: no debe modificarse."""
+        return self.get_with_version()[0]
+
+    def get_with_version(self) -> Tuple[Dict[str, Any], int]:
+        signature = file_signature(self.path)
+        with self._lock:
+            if signature != self._signature:
+                self._patterns = self._read()
+                self._signature = signature
+            return self._patterns, self._patterns.get("version", 0)
+
+    def version(self) -> int:
+        return self.get_with_version()[1]
+
+    def save(self, patterns: Dict[str, Any]) -> int:
+        with self._write_lock():
+            current_version = self._read().get("version", 0)
+            data = dict(patterns)
+            data["version"] = current_version + 1
+            save_json_atomic(data, self.path)
+        logger.info(f"Patrones de aprendizaje guardados en {self.path} (versión {data['version']}).")
+        return data["version"]
+
+    def update(self, mutator: Callable[[Dict[str, Any]], None]) -> int:
+        """Lee la versión en disco, la modifica con mutator y la guarda bajo el mismo bloqueo (sin perder escrituras concurrentes)."""
+        with self._write_lock():
+            data = self._read()
+            mutator(data)
+            data["version"] = data.get("version", 0) + 1
+            save_json_atomic(data, self.path)
+        logger.info(f"Patrones de aprendizaje actualizados en {self.path} (versión {data['version']}).")
+        return data["version"]
+
+    def _read(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            logger.info(f"No se encontró el archivo de patrones aprendidos {self.path}. Se usarán patrones vacíos.")
+            return copy.deepcopy(self.empty)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                patterns = json.load(f)
+            logger.info(f"Patrones de aprendizaje cargados desde {self.path} (versión {patterns.get('version', 0)}).")
+            return patterns
+        except json.JSONDecodeError as e:
+            logger.error(f"Error al decodificar JSON de patrones aprendidos: {e}. Se usarán patrones vacíos.")
+            return copy.deepcopy(self.empty)
+
+    @contextmanager
+    def _write_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+_stores: Dict[str, LearnedPatternStore] = {}
+_stores_lock = threading.Lock()
+
+def get_pattern_store(path: Optional[str] = None, empty: Optional[Dict[str, Any]] = None) -> LearnedPatternStore:
+    path = path or settings.LEARNED_PATTERNS_FILE
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = LearnedPatternStore(path, empty)
+        return _stores[path]
@@ -0,0 +1,74 @@
+import logging
+import time
+import pandas as pd
+import schedule
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.pipeline import make_pipeline
+from config.settings import settings
+from database.crud import CorrectedFieldCRUD
+from database.models import SessionLocal
+from learning.incremental_model import build_correction_text, update_correction_model
+from utils.helpers import save_joblib_atomic
+
+logger = logging.getLogger(__name__)
+
+def retrain_correction_model(full_refit: bool = False):
+    if not full_refit and settings.CORRECTION_MODEL_MODE != "full":
+        update_correction_model()
+        return
+
+    # Recolectar datos de correcciones
+    db_session = SessionLocal()
+    try:
+        corrections = CorrectedFieldCRUD(db_session).get_all_corrected_fields()
+        data = pd.DataFrame([{
+            "text": build_correction_text(c.nombre_campo, c.valor_original),
+            "corrected_value": c.valor_corregido
+        } for c in corrections])
+    finally:
+        db_session.close()
+
+    # Validar datos antes del entrenamiento
+    if data.empty or data.isnull().any().any():
+        logger.error("No hay datos o contienen valores nulos. No se puede entrenar el modelo.")
+        return
+
+    # Vectorización y entrenamiento
+    vectorizer = TfidfVectorizer()
+    model = RandomForestClassifier()
+    pipeline = make_pipeline(vectorizer, model)
+    pipeline.fit(data["text"], data["corrected_value"])
+
+    # Guardar el pipeline completo; los workers lo recargan al detectar el archivo nuevo
+    save_joblib_atomic(pipeline, settings.CORRECTION_MODEL_PATH)
+
+    logger.info("Modelo de corrección reentrenado desde cero y guardado.")
+
+def _run_job(job, *args, **kwargs):
+    try:
+        job(*args, **kwargs)
+    except Exception as e:
+        logger.error(f"Error en la tarea de reentrenamiento '{job.__name__}': {e}", exc_info=True)
+
+def build_scheduler() -> schedule.Scheduler:
+    scheduler = schedule.Scheduler()
+    if settings.CORRECTION_MODEL_MODE == "full":
+        scheduler.every().day.at(settings.RETRAINING_DAILY_AT).do(_run_job, retrain_correction_model, full_refit=True)
+    else:
+        scheduler.every(settings.CORRECTION_MODEL_UPDATE_SECONDS).seconds.do(_run_job, update_correction_model)
+    return scheduler
+
+def run_retraining_service():
+    """Servicio independiente de reentrenamiento; se ejecuta fuera de los workers de procesamiento."""
+    scheduler = build_scheduler()
+    logger.info(f"Servicio de reentrenamiento iniciado en modo '{settings.CORRECTION_MODEL_MODE}'.")
+    if settings.CORRECTION_MODEL_MODE == "incremental":
+        _run_job(update_correction_model)
+    while True:
+        scheduler.run_pending()
+        time.sleep(1)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=settings.LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    run_retraining_service()
@@ -5,105 +5,153 @@ import json
 import time
 import shutil
 import tempfile
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime, date
 from config.settings import settings
-from database.models import init_db, SessionLocal, Factura, ItemFactura, Usuario
+from database.models import init_db, SessionLocal, Factura, ItemFactura, Usuario, engine
 from database.crud import InvoiceCRUD, CorrectedFieldCRUD, ItemFacturaCRUD, ItemCorrectionCRUD
 from extraction.pdf_reader import PDFReader
-from extraction.ocr_engine import OCREngine
-from extraction.regex_parser import RegexParser
-from extraction.nlp_parser import NLPParser
 from extraction.table_extractor import TableExtractor
-from extraction.combiner import ResultCombiner
+from extraction.supplier_index import get_supplier_index
+from extraction.template_store import get_template_store
+from extraction.cascade import get_extraction_cascade
+from extraction.stage_graph import Stage, StageGraph
+from extraction.pdf_splitter import detectar_facturas, escribir_rangos
 from learning.feedback_handler import FeedbackHandler
-from ingestion.email_reader import obtener_correos_con_facturas
-from ingestion.zip_handler import extraer_archivos_de_zip
+from learning.learning_scheduler import LearningScheduler
+from learning.retraining_service import run_retraining_service
+from ingestion.zip_handler import emparejar_facturas, leer_archivos_de_zip
+from ingestion.document_queue import DocumentQueue, DocumentJob, encolar_correos, producir_desde_correos, producir_desde_inbox
+from ingestion.email_reader import iterar_correos_con_facturas
+from ingestion.idle_listener import IdleSupervisor
+from ingestion.mailbox_pool import get_mailbox_pool
+from ingestion.utils import factura_por_cufe, facturas_por_huella, registrar_huellas, sha256_de_archivo, vincular_correo_duplicado
+from ingestion.spool import bloquear_spool, confirmar_directorio_correo, crear_directorio_correo, liberar_adjunto
+from utils.helpers import move_to_unique_path
 from extraction.xml_parser import parse_invoice_xml, extract_nested_invoice_xml
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 logging.basicConfig(level=settings.LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
-def process_document_logic(file_path: str, email_metadata: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
-    extracted_data_from_xml = None
-    extracted_data_from_pdf = None
-    pdf_path_to_process = None
-    temp_dir_for_zip_extraction = None
-    if file_path.lower().endswith('.zip'):
-        logger.info(f"Manejando archivo ZIP: {file_path}")
-        extracted_content = extraer_archivos_de_zip(file_path)
-        xml_files = extracted_content['xmls']
-        pdf_files = extracted_content['pdfs']
-        temp_dir_for_zip_extraction = extracted_content['temp_dir']
-        if xml_files:
-            for xml_zip_path in xml_files:
-                logger.info(f"  Intentando extraer XML de factura anidado de: {xml_zip_path}")
-                nested_invoice_xml_string = extract_nested_invoice_xml(xml_zip_path)
-                if not nested_invoice_xml_string:
-                    logger.info(f"  No se encontró XML anidado en {xml_zip_path}. Intentando leer el archivo directamente como XML de factura.")
-                    try:
-                        with open(xml_zip_path, 'r', encoding='utf-8') as f:
-                            direct_xml_content = f.read()
-                        if '<Invoice' in direct_xml_content or '<FacturaElectronica' in direct_xml_content or '<DianExtensions>' in direct_xml_content:
-                            nested_invoice_xml_string = direct_xml_content
-                            logger.info("  El archivo ZIP XML parece ser directamente el XML de la factura.")
-                        else:
-                            logger.warning(f"  El archivo {xml_zip_path} no parece ser un XML de factura directo.")
-                    except Exception as e:
-                        logger.warning(f"  Error al leer {xml_zip_path} directamente como XML: {e}")
-                if nested_invoice_xml_string:
-                    logger.info("  XML de factura disponible. Intentando parsear para datos esenciales...")
-                    parsed_xml_data = parse_invoice_xml(nested_invoice_xml_string)
-                    if parsed_xml_data and parsed_xml_data.get('numero_factura') and parsed_xml_data.get('monto_total'):
-                        extracted_data_from_xml = parsed_xml_data
-                        extracted_data_from_xml['file_path'] = xml_zip_path 
-                        logger.info("  Datos esenciales de la factura extraídos exitosamente del XML. **Se omitirá el procesamiento de PDF.**")
-                        break
-                    else:
-                        logger.warning("  XML parseado, pero faltan 'numero_factura' o 'monto_total' esenciales. Se procederá a intentar con PDF.")
-                else:
-                    logger.warning(f"  No se encontró XML de factura anidado o directo válido en {xml_zip_path}.")
-        if not extracted_data_from_xml and pdf_files:
-            pdf_path_to_process = pdf_files[0] 
-    elif file_path.lower().endswith('.pdf'):
-        pdf_path_to_process = file_path
-        logger.info(f"Procesando archivo PDF directamente: {file_path}")
-    if not extracted_data_from_xml and pdf_path_to_process:
-        logger.info(f"No se encontraron datos XML válidos o no había XML. Iniciando extracción por PDF para: {pdf_path_to_process}")
-        pdf_reader = PDFReader()
-        raw_text_pdf_direct = pdf_reader.extract_text(pdf_path_to_process)
-        ocr_engine = OCREngine()
-        raw_text_ocr = ocr_engine.pdf_to_text_ocr(pdf_path_to_process)
-        
-        full_text_content = raw_text_pdf_direct if raw_text_pdf_direct else ""
-        if raw_text_ocr and raw_text_ocr not in full_text_content:
-            full_text_content += "\n" + raw_text_ocr
+def identify_supplier(email_metadata: Optional[Dict[str, Any]], nit: Optional[str] = None, text: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    email_metadata = email_metadata or {}
+    try:
+        proveedor = get_supplier_index().identify(
+            nit=nit,
+            remitente=email_metadata.get("remitente_correo"),
+            asunto=email_metadata.get("asunto_correo"),
+            text=text
+        )
+    except Exception as e:
+        logger.error(f"Error al identificar el proveedor: {e}", exc_info=True)
+        return None
+    if proveedor:
+        logger.info(f"Proveedor identificado por {proveedor['fuente']}: {proveedor.get('nombre')} ({proveedor.get('nit')})")
+    return proveedor
+def extract_pdf_data(pdf_path: str, email_metadata: Optional[Dict[str, Any]] = None,
+                     page_texts: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Extrae cabecera e ítems de un PDF con un grafo de etapas: las tablas corren a la vez que la cascada (regex, NLP, OCR).
+
+    Si el llamador ya leyó el texto de las páginas (`page_texts`), se reutiliza en vez de volver a leer el PDF.
+    """
+    pdf_reader = PDFReader()
+    table_extractor = TableExtractor()
+    template_store = get_template_store()
+    cascade = get_extraction_cascade()
+
+    def apply_template(page_texts, proveedor):
+        nit_proveedor = proveedor.get('nit') if proveedor else None
+        if nit_proveedor and "".join(page_texts).strip():
+            return template_store.extract(nit_proveedor, page_texts, pdf_path, table_extractor)
+        return None
+
+    def extract_tables(template_data):
+        if template_data:
+            return template_data['items']
+        return table_extractor.extract_and_parse_line_items(pdf_path)
+
+    def extract_header(page_texts, template_data):
+        return cascade.run("\n".join(page_texts), pdf_path,
+                           prior_results=[("plantilla", template_data)] if template_data else None)
 
-        if not full_text_content.strip():
-            logger.warning(f"No se pudo extraer texto significativo de {pdf_path_to_process}. No se podrá extraer datos del PDF.")
-        regex_parser = RegexParser()
-        regex_data = regex_parser.extract_fields(full_text_content)
-        
-        table_extractor = TableExtractor()
-        extracted_line_items = table_extractor.extract_and_parse_line_items(pdf_path_to_process)
+    stages = [] if page_texts is not None else [Stage("page_texts", pdf_reader.extract_pages, ["pdf_path"])]
+    graph = StageGraph(stages + [
+        Stage("proveedor", lambda page_texts: identify_supplier(email_metadata, text="\n".join(page_texts)), ["page_texts"]),
+        Stage("plantilla", apply_template, ["page_texts", "proveedor"]),
+        Stage("items", extract_tables, ["plantilla"]),
+        Stage("cabecera", extract_header, ["page_texts", "plantilla"]),
+    ])
+    initial = {"pdf_path": pdf_path}
+    if page_texts is not None:
+        initial["page_texts"] = page_texts
+    results = graph.run(initial)
+    page_texts, proveedor, template_data = results["page_texts"], results["proveedor"], results["plantilla"]
+    extracted_data = results["cabecera"]
+    extracted_line_items = results["items"]
+    full_text_content = extracted_data['raw_text']
+    if not full_text_content.strip():
+        logger.warning(f"No se pudo extraer texto significativo de {pdf_path}. No se podrá extraer datos del PDF.")
+    if proveedor is None and full_text_content != "\n".join(page_texts):
+        proveedor = identify_supplier(email_metadata, text=full_text_content)
+    if template_data:
+        extracted_data['plantilla_proveedor'] = True
+    else:
         if not extracted_line_items:
-            logger.info(f"No se encontraron ítems de tabla para {pdf_path_to_process}, intentando con RegexParser.")
-            extracted_line_items = regex_parser.extract_line_items(full_text_content)
-        nlp_parser = NLPParser()
-        nlp_data = nlp_parser.extract_entities(full_text_content)
-        combiner = ResultCombiner()
-        extracted_data_from_pdf = combiner.combine_results(
-            pdf_direct_data={},
-            ocr_data={},
-            regex_data=regex_data,
-            nlp_data=nlp_data
-        )
-        extracted_data_from_pdf['items'] = extracted_line_items
-        extracted_data_from_pdf['raw_text'] = full_text_content
-        extracted_data_from_pdf['file_path'] = pdf_path_to_process
-        logger.info(f"Extracción por PDF completada para {pdf_path_to_process}.")
+            logger.info(f"No se encontraron ítems de tabla para {pdf_path}, intentando con RegexParser.")
+            extracted_line_items = cascade.regex_parser.extract_line_items(full_text_content)
+        if proveedor and proveedor.get('nit') and page_texts:
+            # Solo se aprende del texto nativo del PDF: la plantilla se aplica antes del OCR
+            template_store.learn_from_extraction(
+                proveedor['nit'], page_texts, extracted_data,
+                table_extractor.last_strategy if extracted_line_items else None)
+    extracted_data['items'] = extracted_line_items
+    extracted_data['file_path'] = pdf_path
+    extracted_data['proveedor'] = proveedor
+    return extracted_data
+def read_invoice_xml(xml_path: str, contenido: Optional[bytes] = None) -> Optional[Dict[str, Any]]:
+    """Lee un XML de factura (anidado en un AttachedDocument o directo); None si no trae los datos esenciales.
+
+    Con `contenido` el XML se toma de memoria (p. ej. un miembro de ZIP) y `xml_path` solo lo identifica.
+    """
+    logger.info(f"  Intentando extraer XML de factura anidado de: {xml_path}")
+    nested_invoice_xml_string = extract_nested_invoice_xml(contenido if contenido is not None else xml_path)
+    if not nested_invoice_xml_string:
+        logger.info(f"  No se encontró XML anidado en {xml_path}. Intentando leer el archivo directamente como XML de factura.")
+        try:
+            if contenido is not None:
+                direct_xml_content = contenido.decode('utf-8')
+            else:
+                with open(xml_path, 'r', encoding='utf-8') as f:
+                    direct_xml_content = f.read()
+            if '<Invoice' in direct_xml_content or '<FacturaElectronica' in direct_xml_content or '<DianExtensions>' in direct_xml_content:
+                nested_invoice_xml_string = direct_xml_content
+                logger.info("  El archivo XML parece ser directamente el XML de la factura.")
+            else:
+                logger.warning(f"  El archivo {xml_path} no parece ser un XML de factura directo.")
+        except Exception as e:
+            logger.warning(f"  Error al leer {xml_path} directamente como XML: {e}")
+    if not nested_invoice_xml_string:
+        logger.warning(f"  No se encontró XML de factura anidado o directo válido en {xml_path}.")
+        return None
+    logger.info("  XML de factura disponible. Intentando parsear para datos esenciales...")
+    parsed_xml_data = parse_invoice_xml(nested_invoice_xml_string)
+    if parsed_xml_data and parsed_xml_data.get('numero_factura') and parsed_xml_data.get('monto_total'):
+        parsed_xml_data['file_path'] = xml_path
+        logger.info("  Datos esenciales de la factura extraídos exitosamente del XML. **Se omitirá el procesamiento de PDF.**")
+        return parsed_xml_data
+    logger.warning("  XML parseado, pero faltan 'numero_factura' o 'monto_total' esenciales. Se procederá a intentar con PDF.")
+    return None
+def combine_extracted_data(file_path: str, extracted_data_from_xml: Optional[Dict[str, Any]],
+                           extracted_data_from_pdf: Optional[Dict[str, Any]],
+                           email_metadata: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Prioriza el XML sobre el PDF, añade los metadatos del correo y completa el proveedor identificado."""
     final_extracted_data = {}
     if extracted_data_from_xml:
         final_extracted_data.update(extracted_data_from_xml)
+        final_extracted_data['proveedor'] = identify_supplier(email_metadata, nit=extracted_data_from_xml.get('nit_proveedor'))
         logger.info("Datos finales obtenidos del XML (priorizado).")
     elif extracted_data_from_pdf:
         final_extracted_data.update(extracted_data_from_pdf)
@@ -112,9 +160,12 @@ def process_document_logic(file_path: str, email_metadata: Dict[str, Any] = None
         logger.warning(f"No se pudieron extraer datos de XML ni de PDF para {file_path}.")
     if email_metadata:
         final_extracted_data.update(email_metadata)
-    if temp_dir_for_zip_extraction and os.path.exists(temp_dir_for_zip_extraction):
-        shutil.rmtree(temp_dir_for_zip_extraction)
-        logger.info(f"Directorio temporal '{temp_dir_for_zip_extraction}' limpiado.")
+    proveedor = final_extracted_data.get('proveedor')
+    if proveedor:
+        if proveedor.get('nit') and not final_extracted_data.get('nit_proveedor'):
+            final_extracted_data['nit_proveedor'] = proveedor['nit']
+        if proveedor.get('nombre') and not final_extracted_data.get('nombre_proveedor'):
+            final_extracted_data['nombre_proveedor'] = proveedor['nombre']
     if 'file_path' not in final_extracted_data and file_path:
         final_extracted_data['file_path'] = file_path
     if not final_extracted_data or (len(final_extracted_data) == 1 and 'file_path' in final_extracted_data and final_extracted_data['file_path'] == file_path):
@@ -122,67 +173,95 @@ def process_document_logic(file_path: str, email_metadata: Dict[str, Any] = None
         return None
     logger.info(f"--- Proceso completado para {file_path}. Resultado: {final_extracted_data}")
     return final_extracted_data
+def process_document_logic(file_path: str, email_metadata: Dict[str, Any] = None,
+                           page_texts: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """Extrae la factura de un PDF o XML suelto; los ZIP van por `process_zip_document`."""
+    extracted_data_from_xml = None
+    extracted_data_from_pdf = None
+    pdf_path_to_process = None
+    if file_path.lower().endswith('.xml'):
+        logger.info(f"Procesando archivo XML directamente: {file_path}")
+        extracted_data_from_xml = read_invoice_xml(file_path)
+    elif file_path.lower().endswith('.pdf'):
+        pdf_path_to_process = file_path
+        logger.info(f"Procesando archivo PDF directamente: {file_path}")
+    if not extracted_data_from_xml and pdf_path_to_process:
+        logger.info(f"No se encontraron datos XML válidos o no había XML. Iniciando extracción por PDF para: {pdf_path_to_process}")
+        extracted_data_from_pdf = extract_pdf_data(pdf_path_to_process, email_metadata, page_texts)
+        logger.info(f"Extracción por PDF completada para {pdf_path_to_process}.")
+    return combine_extracted_data(file_path, extracted_data_from_xml, extracted_data_from_pdf, email_metadata)
+def process_zip_invoice(file_path: str, factura: Dict[str, Any], email_metadata: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Extrae una factura de un ZIP a partir de su XML y, si el XML no basta, de su PDF (ambos en memoria)."""
+    extracted_data_from_xml = None
+    extracted_data_from_pdf = None
+    if factura['xml']:
+        nombre, contenido = factura['xml']
+        extracted_data_from_xml = read_invoice_xml(f"{file_path}::{nombre}", contenido)
+    if not extracted_data_from_xml and factura['pdf']:
+        nombre, contenido = factura['pdf']
+        # Las tablas (camelot/tabula) y el OCR necesitan una ruta: solo el PDF que se extrae pasa por disco
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_pdf:
+            temp_pdf.write(contenido)
+        try:
+            logger.info(f"Iniciando extracción por PDF para: {file_path}::{nombre}")
+            extracted_data_from_pdf = extract_pdf_data(temp_pdf.name, email_metadata)
+            extracted_data_from_pdf['file_path'] = f"{file_path}::{nombre}"
+        finally:
+            os.remove(temp_pdf.name)
+    miembro = (factura['xml'] or factura['pdf'])[0]
+    return combine_extracted_data(f"{file_path}::{miembro}", extracted_data_from_xml, extracted_data_from_pdf, email_metadata)
+def process_zip_document(file_path: str, email_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Extrae todas las facturas de un ZIP (una por XML, emparejado con su PDF), en paralelo si son muchas."""
+    logger.info(f"Manejando archivo ZIP: {file_path}")
+    facturas = emparejar_facturas(leer_archivos_de_zip(file_path))
+    if len(facturas) >= settings.ZIP_PARALLEL_MIN_INVOICES and settings.ZIP_PARSE_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=settings.ZIP_PARSE_WORKERS, thread_name_prefix="zip") as executor:
+            resultados = list(executor.map(lambda factura: process_zip_invoice(file_path, factura, email_metadata), facturas))
+    else:
+        resultados = [process_zip_invoice(file_path, factura, email_metadata) for factura in facturas]
+    extraidas = [resultado for resultado in resultados if resultado]
+    logger.info(f"ZIP {file_path}: {len(extraidas)} de {len(facturas)} facturas extraídas.")
+    return extraidas
+def extract_document_invoices(file_path: str, email_metadata: Optional[Dict[str, Any]] = None,
+                              page_texts: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    if file_path.lower().endswith('.zip'):
+        return process_zip_document(file_path, email_metadata)
+    extracted_data = process_document_logic(file_path, email_metadata, page_texts)
+    return [extracted_data] if extracted_data else []
 def process_invoice(pdf_path: str) -> Optional[Dict[str, Any]]:
     logger.info(f"Iniciando extracción para PDF: {pdf_path}")
-    pdf_reader = PDFReader()
-    raw_text_pdf_direct = pdf_reader.extract_text(pdf_path)
-    ocr_engine = OCREngine()
-    raw_text_ocr = ocr_engine.pdf_to_text_ocr(pdf_path)
-    full_text_content = raw_text_pdf_direct if raw_text_pdf_direct else ""
-    if raw_text_ocr and raw_text_ocr not in full_text_content:
-        full_text_content += "\n" + raw_text_ocr
-    if not full_text_content.strip():
+    combined_data = extract_pdf_data(pdf_path)
+    if not combined_data['raw_text'].strip():
         logger.warning(f"No se pudo extraer texto significativo de {pdf_path}.")
         return None
-    regex_parser = RegexParser()
-    regex_data = regex_parser.extract_fields(full_text_content)
-    table_extractor = TableExtractor()
-    extracted_line_items = table_extractor.extract_and_parse_line_items(pdf_path)
-    if not extracted_line_items:
-        logger.info(f"No se encontraron ítems de tabla para {pdf_path}, intentando con RegexParser.")
-        extracted_line_items = regex_parser.extract_line_items(full_text_content)
-    nlp_parser = NLPParser()
-    nlp_data = nlp_parser.extract_entities(full_text_content)
-    combiner = ResultCombiner()
-    combined_data = combiner.combine_results(
-        pdf_direct_data={}, 
-        ocr_data={},        
-        regex_data=regex_data,
-        nlp_data=nlp_data
-    )
-    combined_data['items'] = extracted_line_items
-    combined_data['raw_text'] = full_text_content
-    combined_data['file_path'] = pdf_path 
     logger.info(f"Extracción completada para {pdf_path}.")
     return combined_data
-def save_invoice_to_db(invoice_data: Dict[str, Any], user_id: Optional[int] = None) -> Optional[int]:
-    db_session = SessionLocal()
-    invoice_crud = InvoiceCRUD(db_session)
-    corrected_field_crud = CorrectedFieldCRUD(db_session)
-    field_name_mapping = {
-        "numero_factura": "numero_factura", 
-        "fecha_emision": "fecha_emision",
-        "fecha_vencimiento": "fecha_vencimiento",
-        "monto_subtotal": "monto_subtotal",
-        "monto_impuesto": "monto_impuesto",
-        "monto_total": "monto_total",
-        "moneda": "moneda",
-        "nombre_proveedor": "nombre_proveedor",
-        "nit_proveedor": "nit_proveedor",
-        "nombre_cliente": "nombre_cliente",
-        "nit_cliente": "nit_cliente",
-        "cufe": "cufe",
-        "metodo_pago": "metodo_pago",
-        "raw_text": "texto_crudo",
-        "file_path": "ruta_archivo", 
-        "asunto_correo": "asunto_correo",
-        "remitente_correo": "remitente_correo",
-        "correo_cliente": "correo_cliente",
-        "hora_emision": "hora_emision", 
-        "email_proveedor": "email_proveedor" 
-    }
+INVOICE_FIELD_MAPPING = {
+    "numero_factura": "numero_factura", 
+    "fecha_emision": "fecha_emision",
+    "fecha_vencimiento": "fecha_vencimiento",
+    "monto_subtotal": "monto_subtotal",
+    "monto_impuesto": "monto_impuesto",
+    "monto_total": "monto_total",
+    "moneda": "moneda",
+    "nombre_proveedor": "nombre_proveedor",
+    "nit_proveedor": "nit_proveedor",
+    "nombre_cliente": "nombre_cliente",
+    "nit_cliente": "nit_cliente",
+    "cufe": "cufe",
+    "metodo_pago": "metodo_pago",
+    "raw_text": "texto_crudo",
+    "file_path": "ruta_archivo", 
+    "asunto_correo": "asunto_correo",
+    "remitente_correo": "remitente_correo",
+    "correo_cliente": "correo_cliente",
+    "hora_emision": "hora_emision", 
+    "email_proveedor": "email_proveedor" 
+}
+def build_invoice_records(db_session, invoice_data: Dict[str, Any], user_id: Optional[int] = None):
+    """Convierte los datos extraídos en (columnas de Factura, ítems) listos para InvoiceCRUD."""
     invoice_main_data_for_crud = {}
-    for extracted_key, db_column_name in field_name_mapping.items():
+    for extracted_key, db_column_name in INVOICE_FIELD_MAPPING.items():
         value = invoice_data.get(extracted_key)
         if value == "No encontrado" or value == "":
             invoice_main_data_for_crud[db_column_name] = None
@@ -208,31 +287,38 @@ def save_invoice_to_db(invoice_data: Dict[str, Any], user_id: Optional[int] = No
         except Exception as e:
             logger.error(f"Error al buscar usuario por correo '{invoice_main_data_for_crud['correo_cliente']}': {e}")
     invoice_main_data_for_crud['usuario_id'] = current_user_id
-
+    return invoice_main_data_for_crud, items_data_for_crud
+def upsert_invoice(db_session, invoice_main_data_for_crud: Dict[str, Any], items_data_for_crud: List[Dict[str, Any]],
+                   commit: bool = True) -> Optional[Factura]:
+    """Crea la factura o actualiza la existente con la misma ruta, respetando los campos ya corregidos."""
+    invoice_crud = InvoiceCRUD(db_session)
+    existing_invoice = db_session.query(Factura).filter(
+        Factura.ruta_archivo == invoice_main_data_for_crud.get("ruta_archivo")
+    ).first()
+    if existing_invoice:
+        logger.info(f"Actualizando factura existente para: {invoice_main_data_for_crud.get('ruta_archivo')}")
+        corrections = CorrectedFieldCRUD(db_session).get_corrected_fields_for_invoice(existing_invoice.id)
+        corrections_dict = {corr.nombre_campo: corr.valor_corregido for corr in corrections}
+        for db_column_name, extracted_value in list(invoice_main_data_for_crud.items()):
+            if db_column_name in corrections_dict:
+                invoice_main_data_for_crud[db_column_name] = corrections_dict[db_column_name]
+                logger.info(f"Aplicando corrección para '{db_column_name}': {corrections_dict[db_column_name]}")
+        return invoice_crud.update_invoice(existing_invoice.id, invoice_main_data_for_crud, items_data_for_crud, commit=commit)
+    logger.info(f"Creando nueva factura para: {invoice_main_data_for_crud.get('ruta_archivo')}")
+    return invoice_crud.create_invoice(invoice_main_data_for_crud, items_data_for_crud, commit=commit)
+def register_saved_invoice(invoice_data: Dict[str, Any]):
     try:
-        existing_invoice = db_session.query(Factura).filter(
-            Factura.ruta_archivo == invoice_main_data_for_crud.get("ruta_archivo")
-        ).first()
-
-        if existing_invoice:
-            logger.info(f"Actualizando factura existente para: {invoice_main_data_for_crud.get('ruta_archivo')}")
-            corrections = corrected_field_crud.get_corrected_fields_for_invoice(existing_invoice.id)
-            corrections_dict = {corr.nombre_campo: corr.valor_corregido for corr in corrections}
-            for db_column_name, extracted_value in list(invoice_main_data_for_crud.items()):
-                if db_column_name in corrections_dict:
-                    invoice_main_data_for_crud[db_column_name] = corrections_dict[db_column_name]
-                    logger.info(f"Aplicando corrección para '{db_column_name}': {corrections_dict[db_column_name]}")
-            invoice_obj = invoice_crud.update_invoice(existing_invoice.id, invoice_main_data_for_crud, items_data_for_crud)
-        else:
-            logger.info(f"Creando nueva factura para: {invoice_main_data_for_crud.get('ruta_archivo')}")
-            invoice_obj_id = invoice_crud.create_invoice(invoice_main_data_for_crud, items_data_for_crud)
-            if invoice_obj_id:
-                invoice_obj = invoice_crud.get_invoice_by_id(invoice_obj_id)
-            else:
-                invoice_obj = None 
-        db_session.close() 
+        get_supplier_index().register(invoice_data)
+    except Exception as e:
+        logger.error(f"Error al registrar el proveedor en el índice: {e}", exc_info=True)
+def save_invoice_to_db(invoice_data: Dict[str, Any], user_id: Optional[int] = None) -> Optional[int]:
+    db_session = SessionLocal()
+    try:
+        invoice_main_data_for_crud, items_data_for_crud = build_invoice_records(db_session, invoice_data, user_id)
+        invoice_obj = upsert_invoice(db_session, invoice_main_data_for_crud, items_data_for_crud)
         if invoice_obj:
             logger.info(f"Factura guardada/actualizada exitosamente. ID: {invoice_obj.id}")
+            register_saved_invoice(invoice_data)
             return invoice_obj.id
         logger.error(f"Fallo al guardar/actualizar la factura para {invoice_main_data_for_crud.get('ruta_archivo')}.")
         return None
@@ -241,8 +327,83 @@ def save_invoice_to_db(invoice_data: Dict[str, Any], user_id: Optional[int] = No
         logger.error(f"Error inesperado al guardar/actualizar factura: {e}", exc_info=True)
         return None
     finally:
-        if db_session.is_active: 
-            db_session.close()
+        db_session.close()
+def save_invoices_to_db(invoices: List[Dict[str, Any]], user_id: Optional[int] = None) -> List[Optional[int]]:
+    """Guarda varias facturas (p. ej. las de un ZIP) con una sola sesión y una sola transacción.
+
+    Si el lote falla se deshace completo y se guardan una por una, para que una factura con
+    problemas no impida guardar las demás. Devuelve los ID en el mismo orden (None si no se guardó).
+    """
+    if len(invoices) == 1:
+        return [save_invoice_to_db(invoices[0], user_id)]
+    db_session = SessionLocal()
+    try:
+        invoice_objs = []
+        for invoice_data in invoices:
+            invoice_main_data_for_crud, items_data_for_crud = build_invoice_records(db_session, invoice_data, user_id)
+            invoice_objs.append(upsert_invoice(db_session, invoice_main_data_for_crud, items_data_for_crud, commit=False))
+        db_session.commit()
+        invoice_ids = [invoice_obj.id for invoice_obj in invoice_objs]
+    except Exception as e:
+        db_session.rollback()
+        logger.warning(f"Falló el guardado en lote de {len(invoices)} facturas ({e}); se guardarán una por una.")
+        return [save_invoice_to_db(invoice_data, user_id) for invoice_data in invoices]
+    finally:
+        db_session.close()
+    logger.info(f"Lote de {len(invoices)} facturas guardado. IDs: {invoice_ids}")
+    for invoice_data in invoices:
+        register_saved_invoice(invoice_data)
+    return invoice_ids
+HEADER_CORRECTION_FIELDS = [
+    "numero_factura",
+    "fecha_emision",
+    "fecha_vencimiento",
+    "monto_subtotal",
+    "monto_impuesto",
+    "monto_total",
+    "moneda",
+    "nombre_proveedor",
+    "nit_proveedor",
+    "nombre_cliente",
+    "nit_cliente",
+    "cufe",
+    "metodo_pago",
+    "asunto_correo",
+    "remitente_correo",
+    "correo_cliente",
+]
+ITEM_NUMERIC_FIELDS = ["cantidad", "precio_unitario", "total_linea"]
+def coerce_header_correction_value(db_field_name: str, corrected_value: Any) -> Any:
+    value_to_set = corrected_value
+    if "monto" in db_field_name:
+        try:
+            value_to_set = float(str(corrected_value).replace('.', '').replace(',', '.'))
+        except ValueError:
+            logger.warning(f"No se pudo convertir '{corrected_value}' a float para '{db_field_name}'.")
+            value_to_set = corrected_value
+    elif "fecha" in db_field_name:
+        try:
+            if isinstance(corrected_value, str):
+                if len(corrected_value) == 10 and corrected_value.count('-') == 2:
+                    value_to_set = datetime.strptime(corrected_value, "%Y-%m-%d").date()
+                elif len(corrected_value) >= 10 and corrected_value.count('/') == 2:
+                    value_to_set = datetime.strptime(corrected_value.split(',')[0].strip(), "%d/%m/%Y").date()
+                else:
+                    logger.warning(f"Formato de fecha de corrección desconocido para '{corrected_value}'.")
+                    value_to_set = corrected_value
+            elif isinstance(corrected_value, date):
+                value_to_set = corrected_value
+        except ValueError:
+            logger.warning(f"No se pudo parsear fecha '{corrected_value}' para '{db_field_name}'.")
+            value_to_set = corrected_value
+    return value_to_set
+def coerce_item_numeric_value(field_name: str, value: Any) -> Any:
+    if field_name in ITEM_NUMERIC_FIELDS and isinstance(value, str):
+        try:
+            return float(value.replace('.', '').replace(',', '.'))
+        except ValueError:
+            logger.warning(f"No se pudo convertir '{value}' a float para el campo '{field_name}' del ítem.")
+    return value
 def apply_header_correction(invoice_id: int, field_name: str, original_value: str, corrected_value: str):
     db_session = SessionLocal()
     crud_handler = CorrectedFieldCRUD(db_session)
@@ -250,53 +411,14 @@ def apply_header_correction(invoice_id: int, field_name: str, original_value: st
     feedback_handler = FeedbackHandler()
     correction = crud_handler.add_corrected_field(invoice_id, field_name, original_value, corrected_value)
     if correction:
-        field_mapping = {
-            "numero_factura": "numero_factura",
-            "fecha_emision": "fecha_emision",
-            "fecha_vencimiento": "fecha_vencimiento",
-            "monto_subtotal": "monto_subtotal",
-            "monto_impuesto": "monto_impuesto",
-            "monto_total": "monto_total",
-            "moneda": "moneda",
-            "nombre_proveedor": "nombre_proveedor",
-            "nit_proveedor": "nit_proveedor",
-            "nombre_cliente": "nombre_cliente",
-            "nit_cliente": "nit_cliente",
-            "cufe": "cufe",
-            "metodo_pago": "metodo_pago",
-            "asunto_correo": "asunto_correo",
-            "remitente_correo": "remitente_correo",
-            "correo_cliente": "correo_cliente",
-        }
-        db_field_name = field_mapping.get(field_name)
-        if db_field_name:
-            update_data = {}
-            value_to_set = corrected_value
-            if "monto" in db_field_name:
-                try:
-                    value_to_set = float(str(corrected_value).replace('.', '').replace(',', '.'))
-                except ValueError:
-                    logger.warning(f"No se pudo convertir '{corrected_value}' a float para '{db_field_name}'.")
-                    value_to_set = corrected_value
-            elif "fecha" in db_field_name:
-                try:
-                    if isinstance(corrected_value, str):
-                        if len(corrected_value) == 10 and corrected_value.count('-') == 2:
-                            value_to_set = datetime.strptime(corrected_value, "%Y-%m-%d").date()
-                        elif len(corrected_value) >= 10 and corrected_value.count('/') == 2:
-                            value_to_set = datetime.strptime(corrected_value.split(',')[0].strip(), "%d/%m/%Y").date()
-                        else:
-                            logger.warning(f"Formato de fecha de corrección desconocido para '{corrected_value}'.")
-                            value_to_set = corrected_value
-                    elif isinstance(corrected_value, date):
-                        value_to_set = corrected_value
-                except ValueError:
-                    logger.warning(f"No se pudo parsear fecha '{corrected_value}' para '{db_field_name}'.")
-                    value_to_set = corrected_value
-            update_data[db_field_name] = value_to_set
-            invoice_crud.update_invoice(invoice_id, update_data)
+        if field_name in HEADER_CORRECTION_FIELDS:
+            update_data = {field_name: coerce_header_correction_value(field_name, corrected_value)}
+            invoice = invoice_crud.update_invoice(invoice_id, update_data)
+            if invoice:
+                get_template_store().learn_from_corrections(
+                    [(invoice.nit_proveedor, field_name, getattr(invoice, field_name), invoice.texto_crudo)])
         feedback_handler.record_correction(invoice_id, field_name, original_value, corrected_value)
-        feedback_handler.learn_from_corrections()
+        feedback_handler.request_learning()
         feedback_handler.close_db_session()
     db_session.close()
 def apply_item_correction(invoice_id: int, item_id: int, field_name: str, original_value: Any, corrected_value: Any):
@@ -421,7 +543,338 @@ def delete_invoice_item(invoice_id: int, item_id: int):
     finally:
         db_session.close()
 
+def _apply_batch_operation(operation: Dict[str, Any], invoice_crud: InvoiceCRUD, corrected_field_crud: CorrectedFieldCRUD,
+                           item_crud: ItemFacturaCRUD, item_correction_crud: ItemCorrectionCRUD,
+                           template_corrections: Optional[List] = None) -> str:
+    op = operation.get("op")
+    invoice_id = int(operation["invoice_id"])
+    if op == "apply_header_correction":
+        field_name = operation["field_name"]
+        corrected_value = operation["corrected_value"]
+        corrected_field_crud.add_corrected_field(invoice_id, field_name, operation.get("original_value"), corrected_value, commit=False)
+        if field_name in HEADER_CORRECTION_FIELDS:
+            update_data = {field_name: coerce_header_correction_value(field_name, corrected_value)}
+            invoice = invoice_crud.update_invoice(invoice_id, update_data, commit=False)
+            if not invoice:
+                raise ValueError(f"Factura {invoice_id} no encontrada.")
+            if template_corrections is not None:
+                template_corrections.append((invoice.nit_proveedor, field_name, getattr(invoice, field_name), invoice.texto_crudo))
+    elif op == "apply_item_correction":
+        item_id = int(operation["item_id"])
+        field_name = operation["field_name"]
+        corrected_value = operation["corrected_value"]
+        item_correction_crud.add_item_correction(
+            id_factura=invoice_id,
+            id_item_original=item_id,
+            tipo_correccion="item_field_correction",
+            campo_corregido=field_name,
+            valor_original=operation.get("original_value"),
+            valor_corregido=corrected_value,
+            commit=False
+        )
+        if not item_crud.update_item(item_id, {field_name: coerce_item_numeric_value(field_name, corrected_value)}, commit=False):
+            raise ValueError(f"Ítem {item_id} no encontrado.")
+    elif op == "add_item":
+        item_data = operation.get("item") or {}
+        item_data_db = {
+            "descripcion": item_data.get("description"),
+            "cantidad": coerce_item_numeric_value("cantidad", item_data.get("quantity")),
+            "precio_unitario": coerce_item_numeric_value("precio_unitario", item_data.get("unit_price")),
+            "total_linea": coerce_item_numeric_value("total_linea", item_data.get("line_total"))
+        }
+        new_item = item_crud.create_item(invoice_id, dict(item_data_db), commit=False)
+        item_correction_crud.add_item_correction(
+            id_factura=invoice_id,
+            id_item_original=new_item.id,
+            tipo_correccion="add_item",
+            valor_corregido=item_data_db,
+            commit=False
+        )
+    elif op == "update_item":
+        item_id = int(operation["item_id"])
+        original_item = item_crud.get_item_by_id(item_id)
+        if not original_item:
+            raise ValueError(f"Ítem {item_id} no encontrado en la factura {invoice_id}.")
+        item_changes = {}
+        for key, value in (operation.get("changes") or {}).items():
+            original_value = getattr(original_item, key, None)
+            if str(original_value) != str(value):
+                item_correction_crud.add_item_correction(
+                    id_factura=invoice_id,
+                    id_item_original=item_id,
+                    tipo_correccion="item_field_correction",
+                    campo_corregido=key,
+                    valor_original=original_value,
+                    valor_corregido=value,
+                    commit=False
+                )
+            item_changes[key] = coerce_item_numeric_value(key, value)
+        item_crud.update_item(item_id, item_changes, commit=False)
+    elif op == "delete_item":
+        item_id = int(operation["item_id"])
+        original_item = item_crud.get_item_by_id(item_id)
+        if not original_item:
+            raise ValueError(f"Ítem {item_id} no encontrado en la factura {invoice_id}.")
+        item_correction_crud.add_item_correction(
+            id_factura=invoice_id,
+            tipo_correccion="delete_item",
+            valor_original=original_item.as_dict(),
+            valor_corregido={},
+            commit=False
+        )
+        item_crud.delete_item(item_id, commit=False)
+    else:
+        raise ValueError(f"Operación desconocida: {op}")
+    return op
+def apply_corrections_batch(lines, batch_size: Optional[int] = None) -> Dict[str, int]:
+    """Aplica correcciones JSONL (una operación por línea) en transacciones agrupadas y solicita un único aprendizaje al final."""
+    batch_size = batch_size or settings.CORRECTIONS_BATCH_SIZE
+    db_session = SessionLocal()
+    invoice_crud = InvoiceCRUD(db_session)
+    corrected_field_crud = CorrectedFieldCRUD(db_session)
+    item_crud = ItemFacturaCRUD(db_session)
+    item_correction_crud = ItemCorrectionCRUD(db_session)
+    stats = {"aplicadas": 0, "fallidas": 0, "cabecera": 0}
+    template_corrections = []
+    pending = 0
+    try:
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                operation = json.loads(line)
+                with db_session.begin_nested():
+                    op = _apply_batch_operation(operation, invoice_crud, corrected_field_crud, item_crud, item_correction_crud,
+                                                template_corrections)
+            except Exception as e:
+                stats["fallidas"] += 1
+                logger.error(f"Línea {line_number}: no se pudo aplicar la operación: {e}")
+                continue
+            stats["aplicadas"] += 1
+            if op == "apply_header_correction":
+                stats["cabecera"] += 1
+            pending += 1
+            if pending >= batch_size:
+                db_session.commit()
+                logger.info(f"Lote de {pending} correcciones confirmado (hasta la línea {line_number}).")
+                pending = 0
+        db_session.commit()
+    except Exception as e:
+        db_session.rollback()
+        logger.error(f"Error al confirmar el lote de correcciones: {e}", exc_info=True)
+        raise
+    finally:
+        db_session.close()
+    if template_corrections:
+        get_template_store().learn_from_corrections(template_corrections)
+    if stats["cabecera"]:
+        feedback_handler = FeedbackHandler()
+        feedback_handler.request_learning()
+        feedback_handler.close_db_session()
+    logger.info(f"Lote de correcciones finalizado: {stats['aplicadas']} aplicadas, {stats['fallidas']} fallidas.")
+    return stats
+
+def init_processing_worker():
+    """Inicializa un worker: descarta conexiones heredadas y deja cargados los extractores para todos sus documentos."""
+    engine.dispose(close=False)
+    cascade = get_extraction_cascade()
+    get_template_store()
+    get_supplier_index()
+    if settings.PROCESSING_WARM_NLP:
+        try:
+            cascade.nlp_parser
+        except Exception as e:
+            logger.warning(f"No se pudo precargar el modelo spaCy en el worker {os.getpid()}: {e}")
+    logger.info(f"Worker de procesamiento {os.getpid()} listo.")
+def split_pdf_document(file_path: str, page_texts: List[str], email_metadata: Optional[Dict[str, Any]] = None) -> Optional[List[str]]:
+    """Si el PDF concatena varias facturas, deja una por archivo en el spool y devuelve sus rutas; si no, None.
+
+    Las partes llevan los metadatos del correo original, así que sobreviven a un reinicio como cualquier adjunto.
+    """
+    if len(page_texts) < settings.PDF_SPLIT_MIN_PAGES:
+        return None
+    rangos = detectar_facturas(page_texts)
+    if len(rangos) < 2:
+        return None
+    directorio = crear_directorio_correo(f"division_{os.path.splitext(os.path.basename(file_path))[0]}", email_metadata or {})
+    try:
+        paths = confirmar_directorio_correo(directorio, escribir_rangos(file_path, rangos, directorio))
+    except Exception as e:
+        logger.error(f"Error al dividir el PDF {file_path}: {e}", exc_info=True)
+        shutil.rmtree(directorio, ignore_errors=True)
+        return None
+    logger.info(f"PDF {file_path} dividido en {len(paths)} facturas (páginas {rangos}).")
+    return paths
+def registrar_huella_origen(email_metadata: Optional[Dict[str, Any]], huellas: List[Tuple[int, Optional[str]]]):
+    """Si el documento es una parte de un PDF dividido, liga también la huella del PDF original a sus facturas."""
+    sha256_origen = (email_metadata or {}).get("sha256_origen")
+    if sha256_origen and huellas:
+        registrar_huellas(sha256_origen, huellas)
+def process_and_save_document(file_path: str, email_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Extrae y guarda un documento sin mover archivos; devuelve el estado para que el proceso principal lo archive.
+
+    Un ZIP puede traer varias facturas: se guardan en lote y el estado es 'parcial' si solo se guardaron algunas.
+    Un PDF con varias facturas no se extrae aquí: se divide y el estado 'dividido' trae las partes para encolarlas.
+    Las partes llevan el SHA-256 del PDF original en 'sha256_origen' y, al guardarse, lo registran también, así
+    que reenviar el PDF original se reconoce como duplicado sin volver a dividirlo.
+    Un adjunto idéntico (SHA-256) a uno ya extraído, o una factura con un CUFE ya guardado, no se vuelve a
+    guardar: los metadatos del correo se vinculan a la factura existente y el estado es 'duplicado'.
+    """
+    try:
+        sha256 = sha256_de_archivo(file_path)
+        existing_ids = facturas_por_huella(sha256)
+        if existing_ids:
+            registrar_huella_origen(email_metadata, [(invoice_id, None) for invoice_id in existing_ids])
+            vincular_correo_duplicado(existing_ids, sha256, email_metadata, os.path.basename(file_path))
+            logger.info(f"'{file_path}' ya se había extraído (facturas {existing_ids}); se vincula sin procesarlo.")
+            return {"file_path": file_path, "estado": "duplicado", "invoice_id": existing_ids[0], "invoice_ids": existing_ids}
+        page_texts = None
+        if settings.PDF_SPLIT_ENABLED and file_path.lower().endswith('.pdf'):
+            # El texto leído para decidir la división se reutiliza en la extracción si el PDF no se divide
+            page_texts = PDFReader().extract_pages(file_path)
+            metadatos_partes = {**(email_metadata or {}), "sha256_origen": sha256}
+            partes = split_pdf_document(file_path, page_texts, metadatos_partes)
+            if partes:
+                return {"file_path": file_path, "estado": "dividido", "partes": partes, "metadatos_partes": metadatos_partes}
+        invoices = extract_document_invoices(file_path, email_metadata or {}, page_texts)
+        if not invoices:
+            return {"file_path": file_path, "estado": "sin_datos"}
+        cufes = [invoice.get('cufe') if invoice.get('cufe') not in (None, "", "No encontrado") else None for invoice in invoices]
+        invoice_ids = [factura_por_cufe(cufe) if cufe else None for cufe in cufes]
+        new_invoices = [invoice for invoice, invoice_id in zip(invoices, invoice_ids) if not invoice_id]
+        new_ids = iter(save_invoices_to_db(new_invoices) if new_invoices else [])
+        nuevas = [not invoice_id for invoice_id in invoice_ids]
+        invoice_ids = [invoice_id or next(new_ids) for invoice_id in invoice_ids]
+        for indice, (cufe, invoice_id) in enumerate(zip(cufes, invoice_ids)):
+            if cufe and not invoice_id:
+                # Otro worker guardó el mismo CUFE entre la consulta y el guardado: cufes_factura rechazó esta copia
+                invoice_ids[indice] = factura_por_cufe(cufe)
+                nuevas[indice] = False
+        duplicate_ids = [invoice_id for invoice_id, nueva in zip(invoice_ids, nuevas) if invoice_id and not nueva]
+        if duplicate_ids:
+            vincular_correo_duplicado(duplicate_ids, sha256, email_metadata, os.path.basename(file_path))
+            logger.info(f"{len(duplicate_ids)} facturas de '{file_path}' ya estaban guardadas por CUFE: {duplicate_ids}")
+        if all(invoice_ids):
+            # Con facturas sin guardar no se registra la huella, para que el reintento no se tome por duplicado
+            huellas = [(invoice_id, cufe) for cufe, invoice_id in zip(cufes, invoice_ids) if invoice_id]
+            registrar_huellas(sha256, huellas)
+            registrar_huella_origen(email_metadata, huellas)
+        if len(duplicate_ids) == len(invoices):
+            return {"file_path": file_path, "estado": "duplicado", "invoice_id": duplicate_ids[0], "invoice_ids": duplicate_ids}
+        saved_ids = [invoice_id for invoice_id in invoice_ids if invoice_id]
+        if len(saved_ids) == len(invoice_ids):
+            estado = "guardado"
+        else:
+            estado = "parcial" if saved_ids else "no_guardado"
+        return {"file_path": file_path, "estado": estado, "invoice_id": saved_ids[0] if saved_ids else None, "invoice_ids": saved_ids}
+    except Exception as e:
+        logger.error(f"Error general al procesar '{file_path}': {e}", exc_info=True)
+        return {"file_path": file_path, "estado": "error", "error": str(e)}
+def finish_document(file_path: str, resultado: Dict[str, Any], temporal: bool = False):
+    """Mueve el archivo a procesados o errores con un nombre único y libera el adjunto del spool."""
+    try:
+        if os.path.exists(file_path):
+            if resultado["estado"] in ("guardado", "dividido", "duplicado"):
+                destination = move_to_unique_path(file_path, settings.PDF_PROCESSED_DIR)
+                logger.info(f"Archivo '{os.path.basename(file_path)}' procesado y movido a {destination}")
+            else:
+                destination = move_to_unique_path(file_path, settings.PDF_ERROR_DIR)
+                logger.warning(f"Archivo '{os.path.basename(file_path)}' con estado '{resultado['estado']}'. Movido a {destination}")
+    except Exception as e:
+        logger.error(f"Error al mover '{file_path}': {e}", exc_info=True)
+    finally:
+        if temporal:
+            liberar_adjunto(file_path)
+class DocumentWorkerPool:
+    """Procesa documentos en procesos worker con extractores precargados.
+
+    Los workers solo extraen y guardan; los movimientos de archivos los hace el proceso principal
+    a medida que terminan, para que dos documentos con el mismo nombre no choquen.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or settings.PROCESSING_WORKERS
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(settings.PROCESSING_START_METHOD),
+                initializer=init_processing_worker
+            )
+            logger.info(f"Pool de procesamiento iniciado con {self.workers} workers.")
+        return self._executor
+
+    def submit(self, job: DocumentJob) -> Future:
+        if self.workers <= 1:
+            future = Future()
+            future.set_result(process_and_save_document(job[0], job[1]))
+            return future
+        return self._get_executor().submit(process_and_save_document, job[0], job[1])
+
+    def _result(self, future: Future, job: DocumentJob) -> Dict[str, Any]:
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            logger.error(f"Un worker terminó de forma inesperada procesando '{job[0]}': {e}")
+            self.shutdown()
+        except Exception as e:
+            logger.error(f"Error al obtener el resultado de '{job[0]}': {e}", exc_info=True)
+        return {"file_path": job[0], "estado": "error"}
+
+    def process(self, jobs: List[DocumentJob]) -> int:
+        """Procesa una lista de documentos (y las partes de los PDF divididos) y devuelve cuántos se guardaron."""
+        futures = {self.submit(job): job for job in jobs}
+        processed_count = 0
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = futures.pop(future)
+                resultado = self._result(future, job)
+                finish_document(job[0], resultado, job[2])
+                processed_count += resultado["estado"] == "guardado"
+                for parte in resultado.get("partes", []):
+                    parte_job = (parte, resultado["metadatos_partes"], True)
+                    futures[self.submit(parte_job)] = parte_job
+        return processed_count
+
+    def consume(self, document_queue: DocumentQueue, stop_event: threading.Event):
+        """Drena la cola de forma continua con hasta dos documentos en curso por worker.
+
+        Solo se bloquea esperando trabajo cuando no hay nada en curso; si hay documentos en curso,
+        alterna entre recoger resultados y tomar documentos nuevos de la cola. Las partes de un PDF
+        dividido pasan antes que la cola; si el proceso se detiene, siguen en el spool.
+        """
+        in_flight: Dict[Future, DocumentJob] = {}
+        partes: "deque[DocumentJob]" = deque()
+        max_in_flight = max(1, self.workers) * 2
+        while not stop_event.is_set() or in_flight:
+            while len(in_flight) < max_in_flight and not stop_event.is_set():
+                job = partes.popleft() if partes else document_queue.get(timeout=0 if in_flight else 1.0)
+                if job is None:
+                    break
+                in_flight[self.submit(job)] = job
+            if not in_flight:
+                continue
+            done, _ = wait(in_flight, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                resultado = self._result(future, job)
+                finish_document(job[0], resultado, job[2])
+                document_queue.done(job[0])
+                partes.extend((parte, resultado["metadatos_partes"], True) for parte in resultado.get("partes", []))
+                logger.info(f"Documento '{os.path.basename(job[0])}' terminado ({resultado['estado']}). En cola: {document_queue.qsize()}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
 def run_invoice_processing_loop():
+    if not bloquear_spool():
+        logger.critical(f"Otro proceso ya usa el spool {settings.EMAIL_SPOOL_DIR}. Configure un EMAIL_SPOOL_DIR distinto por proceso.")
+        return
     init_db()
     os.makedirs(settings.PDF_INPUT_DIR, exist_ok=True)
     os.makedirs(settings.PDF_PROCESSED_DIR, exist_ok=True)
@@ -434,92 +887,34 @@ def run_invoice_processing_loop():
         logger.info("Patrones de aprendizaje cargados/actualizados.")
     except Exception as e:
         logger.error(f"Error al cargar/actualizar patrones de aprendizaje al inicio: {e}", exc_info=True)
-    while True:
-        logger.info("-" * 50)
-        logger.info("Iniciando ciclo de búsqueda y procesamiento de facturas...")
-        logger.info("Revisando correos para nuevas facturas...")
-        start_time = time.time()
-        logger.info(f"Inicio del procesamiento de correos: {datetime.now()}")
-        try:
-            correos_encontrados = obtener_correos_con_facturas()
-            if not correos_encontrados:
-                logger.info("No se encontraron nuevas facturas en los correos en este ciclo.")
-            else:
-                for correo in correos_encontrados:
-                    logger.info(f"Procesando correo de: {correo['from']} - Asunto: {correo['subject']}")
-                    email_metadata_for_invoice = {
-                        "asunto_correo": correo.get("subject"),
-                        "remitente_correo": correo.get("from"),
-                        "correo_cliente": correo.get("cliente_correo")
-                    }
-                    for adjunto_path_temp in correo["adjuntos_temp_paths"]:
-                        try:
-                            extracted_data = process_document_logic(adjunto_path_temp, email_metadata_for_invoice)
-
-                            if extracted_data:
-                                invoice_id = save_invoice_to_db(extracted_data)
-                                if invoice_id:
-                                    logger.info(f"Archivo '{os.path.basename(extracted_data['file_path'])}' procesado y guardado exitosamente.")
-                                    if not adjunto_path_temp.lower().endswith('.zip') and os.path.exists(adjunto_path_temp):
-                                        destination_path_processed = os.path.join(settings.PDF_PROCESSED_DIR, os.path.basename(adjunto_path_temp))
-                                        shutil.move(adjunto_path_temp, destination_path_processed)
-                                else:
-                                    logger.warning(f"No se pudo guardar la factura para '{adjunto_path_temp}'.")
-                                    if os.path.exists(adjunto_path_temp):
-                                        shutil.move(adjunto_path_temp, os.path.join(settings.PDF_ERROR_DIR, os.path.basename(adjunto_path_temp)))
-                            else:
-                                logger.warning(f"No se pudieron extraer datos de '{adjunto_path_temp}'. Movido a errores.")
-                                if os.path.exists(adjunto_path_temp):
-                                    shutil.move(adjunto_path_temp, os.path.join(settings.PDF_ERROR_DIR, os.path.basename(adjunto_path_temp)))
-
-                        except Exception as e:
-                            logger.error(f"Error general al procesar adjunto '{adjunto_path_temp}': {e}", exc_info=True)
-                            if os.path.exists(adjunto_path_temp):
-                                shutil.move(adjunto_path_temp, os.path.join(settings.PDF_ERROR_DIR, os.path.basename(adjunto_path_temp)))
-                        finally:
-                            if os.path.exists(adjunto_path_temp):
-                                os.remove(adjunto_path_temp)
-        except Exception as e:
-            logger.critical(f"Error crítico en la etapa de ingesta de correos: {e}", exc_info=True)
-        logger.info(f"Tiempo total para procesar correos: {time.time() - start_time} segundos")
-        time.sleep(settings.EMAIL_CHECK_INTERVAL_SECONDS)
-        processed_count = 0
-        inbox_files = os.listdir(settings.PDF_INPUT_DIR)
-        if not inbox_files:
-            logger.info(f"No hay nuevos PDFs en {settings.PDF_INPUT_DIR} para procesar en este ciclo.")
-        for filename in inbox_files:
-            file_full_path = os.path.join(settings.PDF_INPUT_DIR, filename)
-            if os.path.isfile(file_full_path) and (filename.lower().endswith(".pdf") or filename.lower().endswith(".zip")):
-                logger.info(f"Iniciando procesamiento de archivo del inbox: {filename}")
-                email_metadata_for_invoice = {} 
-                parts = filename.split('_')
-                if len(parts) >= 3:
-                    if len(parts) > 3 and '@' in parts[2]:
-                        email_metadata_for_invoice["correo_cliente"] = parts[2]
-                try:
-                    extracted_data = process_document_logic(file_full_path, email_metadata_for_invoice)
-                    if extracted_data:
-                        invoice_id = save_invoice_to_db(extracted_data)
-                        if invoice_id:
-                            processed_count += 1
-                            destination_path_processed = os.path.join(settings.PDF_PROCESSED_DIR, filename)
-                            shutil.move(file_full_path, destination_path_processed)
-                            logger.info(f"Archivo '{filename}' procesado y movido a {destination_path_processed}")
-                        else:
-                            logger.warning(f"No se pudo guardar la factura para '{filename}'. Movido a errores.")
-                            shutil.move(file_full_path, os.path.join(settings.PDF_ERROR_DIR, filename))
-                    else:
-                        logger.warning(f"No se pudieron extraer datos de '{filename}'. Movido a errores.")
-                        shutil.move(file_full_path, os.path.join(settings.PDF_ERROR_DIR, filename))
-                except Exception as e:
-                    logger.error(f"Error fatal al procesar '{filename}': {e}", exc_info=True)
-                    shutil.move(file_full_path, os.path.join(settings.PDF_ERROR_DIR, filename))
-        if processed_count > 0:
-            logger.info(f"Completado el procesamiento de {processed_count} nuevos archivos en este ciclo.")
-        else:
-            logger.info("No se procesaron nuevos archivos del inbox en este ciclo.")
-        logger.info(f"Esperando {settings.PROCESSING_INTERVAL_SECONDS} segundos antes del siguiente ciclo de procesamiento...")
-        time.sleep(settings.PROCESSING_INTERVAL_SECONDS)
+    learning_scheduler = LearningScheduler()
+    learning_scheduler.start()
+    document_queue = DocumentQueue()
+    stop_event = threading.Event()
+    iterar_correos = iterar_correos_con_facturas
+    if settings.EMAIL_IDLE_ENABLED:
+        # Las cuentas en IDLE encolan en cuanto llega el correo; el sondeo queda para las demás
+        idle_supervisor = IdleSupervisor(lambda correos: encolar_correos(document_queue, stop_event, correos), stop_event)
+        iterar_correos = idle_supervisor.iterar_correos
+        logger.info("Modo IDLE de correo activado.")
+    producers = [
+        threading.Thread(target=producir_desde_correos, args=(document_queue, stop_event, iterar_correos), name="productor-correos", daemon=True),
+        threading.Thread(target=producir_desde_inbox, args=(document_queue, stop_event), name="productor-inbox", daemon=True),
+    ]
+    for producer in producers:
+        producer.start()
+    logger.info(f"Procesamiento continuo iniciado (cola de {settings.DOCUMENT_QUEUE_SIZE} documentos).")
+    worker_pool = DocumentWorkerPool()
+    try:
+        worker_pool.consume(document_queue, stop_event)
+    except KeyboardInterrupt:
+        logger.info("Deteniendo el procesamiento de facturas...")
+    finally:
+        stop_event.set()
+        worker_pool.shutdown()
+        get_mailbox_pool().cerrar()
+        if document_queue.qsize():
+            logger.warning(f"Quedaron {document_queue.qsize()} documentos en cola sin procesar.")
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
@@ -588,6 +983,26 @@ if __name__ == "__main__":
             else:
                 logger.error("Uso incorrecto para delete_item: python main.py delete_item <invoice_id> <item_id>")
                 sys.exit(1)
+        elif command == 'apply_corrections_batch':
+            if len(sys.argv) in (2, 3):
+                source = sys.argv[2] if len(sys.argv) == 3 else '-'
+                if source == '-':
+                    stats = apply_corrections_batch(sys.stdin)
+                else:
+                    with open(source, 'r', encoding='utf-8') as f:
+                        stats = apply_corrections_batch(f)
+                sys.exit(0 if stats["fallidas"] == 0 else 1)
+            else:
+                logger.error("Uso incorrecto para apply_corrections_batch: python main.py apply_corrections_batch [<archivo.jsonl>|-]")
+                sys.exit(1)
+        elif command == 'top_corrected_fields':
+            limit = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+            feedback_handler = FeedbackHandler()
+            print(json.dumps(feedback_handler.get_top_corrected_fields(limit), ensure_ascii=False))
+            feedback_handler.close_db_session()
+            sys.exit(0)
+        elif command == 'retraining_service':
+            run_retraining_service()
         else:
             logger.error(f"Comando desconocido: {command}")
             sys.exit(1)
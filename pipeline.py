@@ -1,5 +1,5 @@
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List
 from extraction.classifier import InvoiceClassifier
 from extraction.nlp_parser import NLPParserML
 from learning.feedback_handler import FeedbackHandlerML
@@ -14,17 +14,23 @@ class InvoiceProcessingPipeline:
         self.correction_handler = FeedbackHandlerML(correction_model_path)
 
     def process_invoice(self, text: str) -> Dict[str, Any]:
-        # Clasificar proveedor
-        provider = self.classifier.classify_invoice(text)
-        logger.info(f"Proveedor identificado: {provider}")
+        return self.process_invoices([text])[0]
+
+    def process_invoices(self, texts: List[str]) -> List[Dict[str, Any]]:
+        # Clasificar proveedores en una sola predicción
+        providers = self.classifier.classify_invoices(texts)
+        for provider in providers:
+            logger.info(f"Proveedor identificado: {provider}")
 
         # Extraer entidades
-        extracted_data = self.ner_parser.extract_entities(text)
+        extracted_batch = self.ner_parser.extract_entities_batch(texts)
 
-        # Aplicar correcciones
-        for field, value in extracted_data.items():
-            corrected_value = self.correction_handler.predict_correction(field, value)
-            if not value:  # Solo aplicar corrección si el valor original está vacío
-                extracted_data[field] = corrected_value
+        # Aplicar correcciones solo a los campos vacíos, todas en una sola predicción
+        pending = [(extracted_data, field, value)
+                   for extracted_data in extracted_batch
+                   for field, value in extracted_data.items() if not value]
+        corrected_values = self.correction_handler.predict_corrections([(field, value) for _, field, value in pending])
+        for (extracted_data, field, _), corrected_value in zip(pending, corrected_values):
+            extracted_data[field] = corrected_value
 
-        return extracted_data
\ No newline at end of file
+        return extracted_batch
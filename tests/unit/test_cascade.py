@@ -0,0 +1,51 @@
+from datetime import datetime
+import pytest
+from extraction.cascade import ExtractionCascade, score_fields
+
+TEXT = "Factura No. FE-1001\nFecha: 15/03/2024\nNIT 900.123.456-7\nIVA: 190.00\nTotal a pagar: 1190.00\n"
+
+class FailingStage:
+    def extract_entities(self, text):
+        raise AssertionError("La etapa no debía ejecutarse")
+
+    def pdf_to_text_ocr(self, pdf_path):
+        raise AssertionError("La etapa no debía ejecutarse")
+
+class FakeNLP:
+    def __init__(self):
+        self.calls = 0
+
+    def extract_entities(self, text):
+        self.calls += 1
+        return {"issue_date": "01/02/2024", "supplier_name": "ACME SAS"}
+
+@pytest.fixture
+def cascade():
+    cascade = ExtractionCascade()
+    cascade._ocr_engine = FailingStage()
+    return cascade
+
+def test_regex_satisfies_required_fields_without_nlp_or_ocr(cascade):
+    cascade._nlp_parser = FailingStage()
+    result = cascade.run(TEXT, "factura.pdf")
+    assert result["total_amount"] == 1190.0
+    assert result["field_sources"]["total_amount"] == "regex"
+    assert result["field_confidence"]["total_amount"] >= 0.9
+
+def test_nlp_only_asked_for_missing_fields(cascade):
+    cascade._nlp_parser = FakeNLP()
+    result = cascade.run(TEXT.replace("Fecha: 15/03/2024\n", ""), None)
+    assert cascade._nlp_parser.calls == 1
+    assert result["issue_date"] == datetime(2024, 2, 1)
+    assert result["field_sources"]["issue_date"] == "nlp"
+    assert result["field_sources"]["invoice_number"] == "regex"
+
+def test_prior_stage_skips_later_stages(cascade):
+    cascade._nlp_parser = FailingStage()
+    template = {"invoice_number": "FE-1001", "issue_date": datetime(2024, 3, 15), "total_amount": 1190.0}
+    result = cascade.run("", "factura.pdf", prior_results=[("plantilla", template)])
+    assert result["field_sources"] == {"invoice_number": "plantilla", "issue_date": "plantilla", "total_amount": "plantilla"}
+
+def test_inconsistent_totals_lower_confidence():
+    scores = score_fields({"subtotal_amount": 100.0, "tax_amount": 19.0, "total_amount": 500.0}, "regex")
+    assert scores["total_amount"] < 0.9
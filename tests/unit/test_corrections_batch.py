@@ -0,0 +1,53 @@
+import json
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import main
+from database.models import Base, CampoCorregido, Factura
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(main, "SessionLocal", factory)
+    learned = []
+    monkeypatch.setattr(main, "get_template_store", lambda: type("Store", (), {"learn_from_corrections": lambda self, c: learned.extend(c)})())
+    monkeypatch.setattr(main, "FeedbackHandler", lambda: type("Handler", (), {"request_learning": lambda self: None,
+                                                                             "close_db_session": lambda self: None})())
+    session = factory()
+    session.add_all([Factura(id=1, ruta_archivo="a.pdf", numero_factura="FE-1"), Factura(id=2, ruta_archivo="b.pdf", numero_factura="FE-2")])
+    session.commit()
+    factory.learned = learned
+    return factory
+
+def header(invoice_id, value):
+    return json.dumps({"op": "apply_header_correction", "invoice_id": invoice_id, "field_name": "numero_factura",
+                       "original_value": "FE", "corrected_value": value})
+
+def test_failed_line_keeps_earlier_lines(session_factory):
+    lines = [header(1, "FE-10"), header(2, None), header(2, "FE-20"), "no es json"]
+    stats = main.apply_corrections_batch(lines, batch_size=100)
+    assert stats == {"aplicadas": 2, "fallidas": 2, "cabecera": 2}
+    session = session_factory()
+    assert {f.id: f.numero_factura for f in session.query(Factura)} == {1: "FE-10", 2: "FE-20"}
+    assert [(c.id_factura, c.valor_corregido) for c in session.query(CampoCorregido).order_by(CampoCorregido.id)] == [(1, "FE-10"), (2, "FE-20")]
+    assert [c[2] for c in session_factory.learned] == ["FE-10", "FE-20"]
+
+def test_batch_size_commits_intermediate_batches(session_factory, monkeypatch):
+    commits = []
+    def counting_factory():
+        session = session_factory()
+        commit = session.commit
+        def counting_commit():
+            commits.append(session.query(CampoCorregido).count())
+            commit()
+        session.commit = counting_commit
+        return session
+    monkeypatch.setattr(main, "SessionLocal", counting_factory)
+    stats = main.apply_corrections_batch([header(1, "FE-10"), header(2, "FE-20"), header(1, "FE-11")], batch_size=2)
+    assert stats["aplicadas"] == 3
+    # Una confirmación tras las dos primeras líneas y otra al final; la tercera re-corrige la factura 1
+    assert commits == [2, 2]
+    assert session_factory().get(Factura, 1).numero_factura == "FE-11"
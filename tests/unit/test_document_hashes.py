@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import main
+from database import models
+from database.models import Base, CufeFactura, Factura
+from ingestion import utils
+
+CUFE = "c" * 96
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    for module in (main, utils, models):
+        monkeypatch.setattr(module, "SessionLocal", factory)
+    monkeypatch.setattr(main, "register_saved_invoice", lambda invoice_data: None)
+    return factory
+
+def test_concurrent_save_of_same_cufe_links_instead_of_duplicating(session_factory, monkeypatch, tmp_path):
+    existing_id = main.save_invoice_to_db({"file_path": "otra.zip::fe1.xml", "numero_factura": "FE-1", "cufe": CUFE})
+    adjunto = tmp_path / "fe1.xml"
+    adjunto.write_bytes(b"<Invoice/>")
+    monkeypatch.setattr(main, "extract_document_invoices",
+                        lambda file_path, metadata, page_texts=None: [{"file_path": file_path, "numero_factura": "FE-1", "cufe": CUFE}])
+    # El otro worker aún no había guardado la factura cuando este consultó el CUFE
+    lookups = iter([None])
+    monkeypatch.setattr(main, "factura_por_cufe", lambda cufe: next(lookups, existing_id))
+
+    resultado = main.process_and_save_document(str(adjunto), {"asunto_correo": "reenvío"})
+
+    assert resultado["estado"] == "duplicado"
+    assert resultado["invoice_ids"] == [existing_id]
+    session = session_factory()
+    assert session.query(Factura).count() == 1
+    assert [c.asunto_correo for c in session.get(Factura, existing_id).correos_duplicados] == ["reenvío"]
+
+def test_backfill_registers_cufes_of_existing_invoices(session_factory):
+    session = session_factory()
+    session.add_all([Factura(ruta_archivo="a.pdf", cufe=CUFE), Factura(ruta_archivo="b.pdf", cufe=CUFE),
+                     Factura(ruta_archivo="c.pdf", cufe="No encontrado")])
+    session.commit()
+    models._backfill_cufes()
+    assert [(c.cufe, c.id_factura) for c in session_factory().query(CufeFactura)] == [(CUFE, 1)]
+    assert utils.factura_por_cufe(CUFE) == 1
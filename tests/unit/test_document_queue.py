@@ -0,0 +1,26 @@
+import threading
+from ingestion import spool
+from ingestion.document_queue import DocumentQueue, producir_desde_correos
+
+def test_same_path_is_not_queued_twice():
+    cola, stop_event = DocumentQueue(maxsize=5), threading.Event()
+    assert cola.put(("/inbox/a.pdf", {}, False), stop_event)
+    assert not cola.put(("/inbox/a.pdf", {}, False), stop_event)
+    assert cola.get(timeout=0)[0] == "/inbox/a.pdf"
+    cola.done("/inbox/a.pdf")
+    assert cola.put(("/inbox/a.pdf", {}, False), stop_event)
+
+def test_full_queue_blocks_producer_until_stopped(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool.settings, "EMAIL_SPOOL_DIR", str(tmp_path / "spool"))
+    cola, stop_event = DocumentQueue(maxsize=1), threading.Event()
+    correos = [{"from": "a@acme.co", "subject": "Factura", "cliente_correo": "c@empresa.co",
+                "adjuntos_temp_paths": ["/tmp/1.pdf", "/tmp/2.pdf"]}]
+    producer = threading.Thread(target=producir_desde_correos, args=(cola, stop_event, lambda: iter([correos])))
+    producer.start()
+    producer.join(timeout=1.5)
+    assert producer.is_alive() and cola.qsize() == 1
+    stop_event.set()
+    producer.join(timeout=3)
+    assert not producer.is_alive()
+    job = cola.get(timeout=0)
+    assert job == ("/tmp/1.pdf", {"asunto_correo": "Factura", "remitente_correo": "a@acme.co", "correo_cliente": "c@empresa.co"}, True)
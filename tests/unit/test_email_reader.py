@@ -0,0 +1,122 @@
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database.models import Base, CorreoDuplicado, Factura
+from ingestion import email_reader, mailbox_pool, utils
+
+def test_accounts_are_fetched_concurrently_and_streamed(monkeypatch):
+    usuarios = [{"correo": "lento@acme.co", "password": "x"}, {"correo": "rapido@acme.co", "password": "x"},
+                {"correo": "roto@acme.co", "password": "x"}]
+    demoras = {"lento@acme.co": 0.5, "rapido@acme.co": 0.0}
+
+    def obtener_correos_de_cuenta(usuario):
+        if usuario["correo"] == "roto@acme.co":
+            raise ConnectionError("servidor caído")
+        time.sleep(demoras[usuario["correo"]])
+        return [{"correo_cliente": usuario["correo"]}]
+
+    monkeypatch.setattr(email_reader, "obtener_usuarios_db", lambda: usuarios)
+    monkeypatch.setattr(email_reader, "obtener_correos_de_cuenta", obtener_correos_de_cuenta)
+    inicio = time.monotonic()
+    lotes = list(email_reader.iterar_correos_con_facturas())
+    assert [lote[0]["correo_cliente"] for lote in lotes] == ["rapido@acme.co", "lento@acme.co"]
+    assert time.monotonic() - inicio < 0.9
+
+class FakeClient:
+    """Responde UID FETCH como imaplib: cada literal {n} va en una tupla (línea, contenido)."""
+
+    def __init__(self, mailbox):
+        self.mailbox, self.comandos = mailbox, []
+
+    def uid(self, command, uid_set, items):
+        self.comandos.append(items)
+        data = []
+        for uid in uid_set.split(","):
+            if "BODYSTRUCTURE" in items:
+                cabeceras = f"Subject: {self.mailbox.messages[int(uid)]}\r\nFrom: Ventas <ventas@acme.co>\r\n\r\n".encode()
+                data += [(f'1 (UID {uid} BODYSTRUCTURE (("TEXT" "PLAIN" NIL NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+                          f'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 12 NIL ("ATTACHMENT" ("FILENAME" "factura.pdf")) NIL)'
+                          f'("IMAGE" "JPEG" NIL NIL NIL "BASE64" 900000000 NIL ("ATTACHMENT" ("FILENAME" "foto.jpg")) NIL) "MIXED")'
+                          f' BODY[HEADER.FIELDS (FROM SUBJECT)] {{{len(cabeceras)}}}'.encode(), cabeceras), b")"]
+            else:
+                # BODY.PEEK[2]<inicio.tamaño>: se entrega el tramo pedido del contenido codificado
+                inicio, tamano = map(int, items[items.index("<") + 1:items.index(">")].split("."))
+                bloque = b"JVBERi0x\r\nLjQ="[inicio:inicio + tamano]
+                data += [(f"1 (UID {uid} BODY[2]<{inicio}> {{{len(bloque)}}}".encode(), bloque), b")"]
+        return "OK", data
+
+class FakeMailBox:
+    def __init__(self, messages, uidvalidity=7):
+        self.messages, self.uidvalidity, self.criterios = messages, uidvalidity, []
+        self.folder = self
+        self.client = FakeClient(self)
+
+    def status(self, folder, items):
+        return {"UIDVALIDITY": self.uidvalidity, "UIDNEXT": max(self.messages) + 1}
+
+    def uids(self, criteria, charset=None):
+        self.criterios.append(str(criteria))
+        return [str(uid) for uid, subject in self.messages.items() if "Factura" in subject]
+
+def test_watermark_only_reads_new_uids(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(utils, "SessionLocal", sessionmaker(bind=engine))
+    monkeypatch.setattr(email_reader.settings, "EMAIL_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(email_reader.settings, "EMAIL_FETCH_CHUNK_BYTES", 5)
+    buzon = FakeMailBox({1: "Factura 1", 2: "Hola", 3: "Factura 3"})
+    logins = []
+    monkeypatch.setattr(mailbox_pool, "MailBox", lambda *args, **kwargs: type("Login", (), {
+        "login": lambda self, *a: logins.append(a) or buzon})())
+    pool = mailbox_pool.MailboxPool()
+    monkeypatch.setattr(email_reader, "get_mailbox_pool", lambda: pool)
+    usuario = {"correo": "cliente@empresa.co", "password": "x"}
+    correos = email_reader.obtener_correos_de_cuenta(usuario)
+    assert [correo["uid"] for correo in correos] == ["1", "3"]
+    assert correos[0]["from"] == "ventas@acme.co" and correos[0]["subject"] == "Factura 1"
+    with open(correos[0]["adjuntos_temp_paths"][0], "rb") as f:
+        assert f.read() == b"%PDF-1.4"
+    # Solo se pide la parte PDF, por tramos; la imagen no se descarga
+    assert [comando for comando in buzon.client.comandos if "BODYSTRUCTURE" not in comando][:3] == [
+        "(BODY.PEEK[2]<0.5>)", "(BODY.PEEK[2]<5.5>)", "(BODY.PEEK[2]<10.5>)"]
+    assert email_reader.cargar_marca_uid("cliente@empresa.co") == {"uidvalidity": 7, "uid": 3}
+
+    buzon.messages[4] = "Factura 4"
+    assert [correo["uid"] for correo in email_reader.obtener_correos_de_cuenta(usuario)] == ["4"]
+    assert "UID 4:*" in buzon.criterios[-1]
+
+    # Ya completados en el registro: no se vuelven a leer aunque la búsqueda los devuelva
+    monkeypatch.setattr(email_reader.settings, "EMAIL_UID_WATERMARK", False)
+    assert email_reader.obtener_correos_de_cuenta(usuario) == []
+    monkeypatch.setattr(email_reader.settings, "EMAIL_UID_WATERMARK", True)
+
+    buzon.uidvalidity = 8
+    assert len(email_reader.obtener_correos_de_cuenta(usuario)) == 3
+    assert "UID" not in buzon.criterios[-1]
+    # La sesión se reutiliza entre ciclos: un solo login
+    assert len(logins) == 1
+
+def test_exact_duplicate_attachments_are_linked_instead_of_spooled(monkeypatch, tmp_path):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(utils, "SessionLocal", factory)
+    monkeypatch.setattr(email_reader.settings, "EMAIL_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(email_reader.settings, "EMAIL_UID_WATERMARK", False)
+    buzon = FakeMailBox({1: "Factura 1"})
+
+    correos = email_reader.leer_correos_de_buzon(buzon, "cliente@empresa.co")
+    path = correos[0]["adjuntos_temp_paths"][0]
+    session = factory()
+    session.add(Factura(id=10, ruta_archivo=path))
+    session.commit()
+    assert utils.registrar_huellas(utils.sha256_de_archivo(path), [(10, None)])
+
+    # El mismo adjunto reenviado en otro correo: no se encola y el correo queda leído
+    buzon.messages[2] = "Factura 2"
+    assert email_reader.leer_correos_de_buzon(buzon, "cliente@empresa.co") == []
+    assert email_reader.leer_correos_de_buzon(buzon, "cliente@empresa.co") == []
+    vinculos = session.query(CorreoDuplicado).all()
+    assert [(v.id_factura, v.correo_cliente, v.ruta_archivo) for v in vinculos] == [(10, "cliente@empresa.co", "factura.pdf")]
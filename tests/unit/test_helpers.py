@@ -0,0 +1,14 @@
+import os
+from utils.helpers import move_to_unique_path
+
+def test_move_to_unique_path_keeps_both_files(tmp_path):
+    destination_dir = tmp_path / "procesados"
+    first, second = tmp_path / "a" / "factura.pdf", tmp_path / "b" / "factura.pdf"
+    for path, content in ((first, "uno"), (second, "dos")):
+        path.parent.mkdir()
+        path.write_text(content)
+    first_destination = move_to_unique_path(str(first), str(destination_dir))
+    second_destination = move_to_unique_path(str(second), str(destination_dir))
+    assert os.path.basename(first_destination) == "factura.pdf"
+    assert first_destination != second_destination
+    assert sorted(open(path).read() for path in (first_destination, second_destination)) == ["dos", "uno"]
@@ -0,0 +1,61 @@
+import threading
+from ingestion import idle_listener
+
+class FakeIdle:
+    def __init__(self, eventos):
+        self.eventos = eventos
+
+    def wait(self, timeout):
+        evento = self.eventos.pop(0) if self.eventos else []
+        if isinstance(evento, Exception):
+            raise evento
+        return evento
+
+class FakeMailBox:
+    """Sustituto local de un servidor IMAP: cada conexión entrega una secuencia de respuestas IDLE."""
+
+    def __init__(self, eventos, capabilities=("IMAP4REV1", "IDLE")):
+        self.idle = FakeIdle(eventos)
+        self.client = type("Client", (), {"capabilities": capabilities})()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def test_listener_reads_on_exists_and_reconnects_after_drop(monkeypatch):
+    stop_event = threading.Event()
+    conexiones = [FakeMailBox([[b"* 4 EXISTS"], ConnectionResetError("caída")]),
+                  FakeMailBox([[], [b"* 5 EXISTS"]])]
+    lecturas, entregados = [], []
+
+    def leer_correos_de_buzon(mailbox, email):
+        lecturas.append(mailbox)
+        if len(lecturas) == 4:
+            stop_event.set()
+        return [{"uid": str(len(lecturas))}]
+
+    def mailbox_factory(email, password):
+        return conexiones.pop(0)
+
+    monkeypatch.setattr(idle_listener, "leer_correos_de_buzon", leer_correos_de_buzon)
+    listener = idle_listener.IdleListener({"correo": "a@b.co", "password": "x"}, entregados.extend, stop_event,
+                                          mailbox_factory, backoff_base=0.01, backoff_max=0.01)
+    listener.start()
+    listener.join(timeout=5)
+    # Lectura al conectar, por el EXISTS, al reconectar y por el segundo EXISTS
+    assert [correo["uid"] for correo in entregados] == ["1", "2", "3", "4"]
+    assert listener.estado == "detenido"
+
+def test_accounts_without_idle_fall_back_to_polling(monkeypatch):
+    stop_event = threading.Event()
+    monkeypatch.setattr(idle_listener, "leer_correos_de_buzon", lambda mailbox, email: [])
+    supervisor = idle_listener.IdleSupervisor(lambda correos: None, stop_event,
+                                              lambda email, password: FakeMailBox([], capabilities=("IMAP4REV1",)))
+    supervisor.sincronizar([{"correo": "a@b.co", "password": "x"}])
+    supervisor.listeners["a@b.co"].join(timeout=5)
+    assert supervisor.listeners["a@b.co"].estado == "sin_idle"
+    assert supervisor.cuentas_atendidas() == set()
+    assert 0.5 <= idle_listener.espera_con_jitter(1, 1, 60) <= 1
+    assert 30 <= idle_listener.espera_con_jitter(10, 1, 60) <= 60
@@ -0,0 +1,38 @@
+from ingestion.imap_parts import parsear_respuesta_fetch, partes_de_factura
+
+# multipart/mixed: (alternative: texto + html), PDF con nombre en literal, imagen y XML con nombre RFC 2231
+BODYSTRUCTURE = (
+    b'((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 12 1 NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 40 2 NIL NIL NIL) "ALTERNATIVE")'
+    b'("APPLICATION" "PDF" ("NAME" {13}'
+)
+
+CABECERAS = b'Subject: Factura\r\nFrom: a@b.co\r\n\r\n'
+
+def respuesta_fetch():
+    resto = (
+        b') NIL NIL "BASE64" 2048 NIL ("ATTACHMENT" ("FILENAME" "factura 1.pdf")) NIL)'
+        b'("IMAGE" "PNG" ("NAME" "logo.png") NIL NIL "BASE64" 90000 NIL ("INLINE" NIL) NIL)'
+        b'("TEXT" "XML" NIL NIL NIL "BASE64" 300 5 NIL ("ATTACHMENT" ("FILENAME*" "utf-8\'\'f%C3%A9.xml")) NIL)'
+        b' "MIXED" ("BOUNDARY" "xyz") NIL NIL) BODY[HEADER.FIELDS (FROM SUBJECT)] {' + str(len(CABECERAS)).encode() + b'}'
+    )
+    return [
+        (b'3 (UID 17 BODYSTRUCTURE ' + BODYSTRUCTURE, b'factura 1.pdf'),
+        (resto, CABECERAS),
+        b')',
+        b'4 (UID 18 BODYSTRUCTURE ("TEXT" "PLAIN" NIL NIL NIL "7BIT" 3 1 NIL NIL NIL))',
+    ]
+
+def test_parse_fetch_response_and_select_invoice_parts():
+    mensajes = parsear_respuesta_fetch(respuesta_fetch())
+    assert set(mensajes) == {"17", "18"}
+    assert mensajes["17"]["BODY[HEADER.FIELDS (FROM SUBJECT)]"].startswith(b"Subject: Factura")
+
+    partes = partes_de_factura(mensajes["17"]["BODYSTRUCTURE"])
+    assert [(p["seccion"], p["filename"], p["size"]) for p in partes] == [("2", "factura 1.pdf", 2048), ("4", "fé.xml", 300)]
+    assert partes[0]["encoding"] == "base64"
+    assert partes_de_factura(mensajes["18"]["BODYSTRUCTURE"]) == []
+
+def test_unnamed_pdf_gets_section_name():
+    estructura = parsear_respuesta_fetch([b'1 (UID 5 BODYSTRUCTURE ("APPLICATION" "PDF" NIL NIL NIL "BASE64" 8 NIL NIL NIL))'])["5"]["BODYSTRUCTURE"]
+    assert partes_de_factura(estructura)[0]["filename"] == "adjunto_1.pdf"
@@ -0,0 +1,50 @@
+import pytest
+from learning.incremental_model import IncrementalCorrectionModel, build_correction_text
+
+def make_batch(field, pairs):
+    return [build_correction_text(field, original) for original, _ in pairs], [corrected for _, corrected in pairs]
+
+def test_predict_without_training_raises():
+    with pytest.raises(ValueError):
+        IncrementalCorrectionModel().predict(["nombre_proveedor ACME"])
+
+def test_partial_fit_learns_new_labels_across_batches():
+    model = IncrementalCorrectionModel()
+    for _ in range(5):
+        model.partial_fit(*make_batch("nombre_proveedor", [("ACME S.A.S", "ACME SAS"), ("ACM SAS", "ACME SAS")]))
+        model.partial_fit(*make_batch("moneda", [("C0P", "COP"), ("pesos", "COP")]))
+    assert model.labels == ["ACME SAS", "COP"]
+    predictions = model.predict([build_correction_text("nombre_proveedor", "ACME S.A.S"), build_correction_text("moneda", "C0P")])
+    assert list(predictions) == ["ACME SAS", "COP"]
+
+def test_label_set_is_bounded():
+    model = IncrementalCorrectionModel(n_features=2 ** 10, max_labels=3)
+    model.partial_fit(*make_batch("moneda", [("C0P", "COP"), ("USS", "USD"), ("EUk", "EUR"), ("MXM", "MXN")]))
+    assert model.labels == ["COP", "USD", "EUR"]
+    assert model.muestras == 3
+    assert model.classifier.coef_.shape == (3, 2 ** 10)
+
+def test_checkpoint_round_trip(tmp_path):
+    model_path = str(tmp_path / "correction_model.pkl")
+    model = IncrementalCorrectionModel()
+    model.partial_fit(*make_batch("moneda", [("C0P", "COP")]))
+    model.ultimo_id = 7
+    model.save(model_path)
+    loaded = IncrementalCorrectionModel.load(model_path)
+    assert loaded.ultimo_id == 7
+    assert loaded.muestras == 1
+    assert list(loaded.predict([build_correction_text("moneda", "C0P")])) == ["COP"]
+
+def test_feedback_handler_ml_batches_predictions(tmp_path):
+    from learning.feedback_handler import FeedbackHandlerML
+    model_path = str(tmp_path / "correction_model.pkl")
+    model = IncrementalCorrectionModel()
+    for _ in range(5):
+        model.partial_fit(*make_batch("nombre_proveedor", [("ACME S.A.S", "ACME SAS")]))
+        model.partial_fit(*make_batch("moneda", [("C0P", "COP")]))
+    model.save(model_path)
+    handler = FeedbackHandlerML(model_path)
+    fields = [("moneda", "C0P"), ("nombre_proveedor", "ACME S.A.S"), ("moneda", "C0P")]
+    assert handler.predict_corrections(fields) == ["COP", "ACME SAS", "COP"]
+    assert handler.predict_correction("moneda", "C0P") == "COP"
+    assert handler.predict_corrections([]) == []
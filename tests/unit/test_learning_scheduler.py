@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from learning.learning_scheduler import learning_due
+
+NOW = datetime(2025, 6, 1, 12, 0, 0)
+
+def make_state(solicitado_hace=None, pendiente_hace=None, aprendido_hace=None):
+    def ago(seconds):
+        return NOW - timedelta(seconds=seconds) if seconds is not None else None
+    return SimpleNamespace(
+        solicitado_en=ago(solicitado_hace),
+        pendiente_desde=ago(pendiente_hace),
+        aprendido_en=ago(aprendido_hace)
+    )
+
+def test_no_request_is_not_due():
+    assert not learning_due(make_state(), NOW, 15, 300)
+    assert not learning_due(None, NOW, 15, 300)
+
+def test_request_waits_for_quiet_period():
+    assert not learning_due(make_state(solicitado_hace=5, pendiente_hace=5), NOW, 15, 300)
+    assert learning_due(make_state(solicitado_hace=20, pendiente_hace=20), NOW, 15, 300)
+
+def test_continuous_requests_fire_after_max_delay():
+    state = make_state(solicitado_hace=1, pendiente_hace=400)
+    assert learning_due(state, NOW, 15, 300)
+
+def test_request_already_learned_is_not_due():
+    state = make_state(solicitado_hace=60, pendiente_hace=60, aprendido_hace=30)
+    assert not learning_due(state, NOW, 15, 300)
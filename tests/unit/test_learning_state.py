@@ -0,0 +1,50 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database.models import Base, CampoCorregido, ORIGEN_CABECERA
+from database.crud import CorrectedFieldCRUD, LearningStateCRUD
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+def consume(state_crud):
+    state = state_crud.get_state(for_update=True)
+    hasta_id, _ = state_crud.get_batch_end(ORIGEN_CABECERA, state.cabecera_ultimo_id, 100)
+    rows = state_crud.aggregate_corrections(ORIGEN_CABECERA, state.cabecera_ultimo_id, hasta_id)
+    state_crud.add_counts(ORIGEN_CABECERA, {(campo, valor): count for campo, valor, count in rows})
+    state.cabecera_ultimo_id = hasta_id
+    state_crud.db.commit()
+
+def counts(state_crud):
+    return {(row.nombre_campo, row.valor_corregido): row.conteo for row in state_crud.get_counts(ORIGEN_CABECERA)}
+
+def test_recorrection_replaces_its_count(session):
+    fields, state_crud = CorrectedFieldCRUD(session), LearningStateCRUD(session)
+    fields.add_corrected_field(1, "moneda", "USD", "COP")
+    fields.add_corrected_field(2, "moneda", "USD", "COP")
+    session.commit()
+    consume(state_crud)
+    assert counts(state_crud) == {("moneda", "COP"): 2}
+
+    fields.add_corrected_field(1, "moneda", "COP", "EUR")
+    session.commit()
+    assert counts(state_crud) == {("moneda", "COP"): 1, ("moneda", "EUR"): 1}
+    assert state_crud.get_batch_end(ORIGEN_CABECERA, state_crud.get_state().cabecera_ultimo_id, 100) is None
+
+def test_watermark_ignores_correction_dates(session):
+    fields, state_crud = CorrectedFieldCRUD(session), LearningStateCRUD(session)
+    fields.add_corrected_field(1, "moneda", "USD", "COP")
+    session.commit()
+    consume(state_crud)
+    # Una corrección con fecha anterior a la ya consumida se sigue leyendo por su id
+    late = fields.add_corrected_field(2, "moneda", "USD", "COP")
+    session.flush()
+    session.query(CampoCorregido).filter_by(id=late.id).update({"fecha_correccion": datetime(2000, 1, 1)})
+    session.commit()
+    consume(state_crud)
+    assert counts(state_crud) == {("moneda", "COP"): 2}
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database.models import Base, CorreoProcesado
+from database.crud import MailLedgerCRUD
+from ingestion import utils
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(utils, "SessionLocal", factory)
+    return factory
+
+def test_claims_are_exclusive_until_stale(session_factory):
+    nodo_a, nodo_b = MailLedgerCRUD(session_factory()), MailLedgerCRUD(session_factory())
+    assert nodo_a.claim("a@b.co", 7, [1, 2, 3], "a", 600) == ([1, 2, 3], [])
+    assert nodo_b.claim("a@b.co", 7, [2, 3, 4], "b", 600) == ([4], [2, 3])
+    # Otra UIDVALIDITY es otro buzón
+    assert nodo_b.claim("a@b.co", 8, [2], "b", 600) == ([2], [])
+
+    nodo_a.complete("a@b.co", 7, [1, 2])
+    nodo_a.release("a@b.co", 7, [3], "a")
+    assert nodo_b.claim("a@b.co", 7, [1, 2, 3], "b", 600) == ([3], [])
+
+    session = session_factory()
+    session.query(CorreoProcesado).filter_by(uid=4).update({"reclamado_en": datetime.now() - timedelta(hours=1)})
+    session.commit()
+    assert nodo_a.claim("a@b.co", 7, [4], "a", 600) == ([4], [])
+    assert session.query(CorreoProcesado).filter_by(uidvalidity=7, uid=4).one().nodo == "a"
+
+def test_watermark_only_advances_and_legacy_files_migrate(session_factory, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "uids_procesados_a_b_co.txt").write_text("5\n9\n")
+    (tmp_path / "marca_uid_a_b_co.json").write_text('{"uidvalidity": 7, "uid": 9}')
+    utils.migrar_registros_locales("a@b.co", 7)
+    assert utils.cargar_marca_uid("a@b.co") == {"uidvalidity": 7, "uid": 9}
+    assert utils.reclamar_uids("a@b.co", 7, [5, 9, 10]) == ([10], [])
+    assert (tmp_path / "uids_procesados_a_b_co.txt.migrado").exists()
+
+    utils.guardar_marca_uid("a@b.co", 7, 4)
+    assert utils.cargar_marca_uid("a@b.co")["uid"] == 9
+    utils.guardar_marca_uid("a@b.co", 8, 2)
+    assert utils.cargar_marca_uid("a@b.co") == {"uidvalidity": 8, "uid": 2}
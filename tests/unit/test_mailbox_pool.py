@@ -0,0 +1,58 @@
+from ingestion import mailbox_pool
+from ingestion.mailbox_pool import MailboxPool
+
+class FakeMailBox:
+    def __init__(self, email):
+        self.email, self.noop_ok, self.noops, self.cerrado = email, True, 0, False
+        self.client = self
+
+    def noop(self):
+        self.noops += 1
+        if not self.noop_ok:
+            raise ConnectionResetError("sesión caída")
+        return "OK", [b"NOOP completed"]
+
+    def logout(self):
+        self.cerrado = True
+
+def crear_pool(monkeypatch, **settings):
+    for name, value in {"EMAIL_POOL_HEALTHCHECK_SECONDS": 0, "EMAIL_POOL_KEEPALIVE_SECONDS": 0,
+                        "EMAIL_POOL_IDLE_EVICT_SECONDS": 3600, **settings}.items():
+        monkeypatch.setattr(mailbox_pool.settings, name, value)
+    abiertos = []
+
+    def factory(email, password):
+        abiertos.append(FakeMailBox(email))
+        return abiertos[-1]
+
+    monkeypatch.setattr(MailboxPool, "_iniciar_keepalive", lambda self: None)
+    return MailboxPool(factory, max_size=2), abiertos
+
+def test_sessions_are_reused_checked_and_replaced(monkeypatch):
+    pool, abiertos = crear_pool(monkeypatch)
+    with pool.sesion("a@b.co", "x") as primera:
+        pass
+    with pool.sesion("a@b.co", "x") as segunda:
+        assert segunda is primera and primera.noops == 1
+    primera.noop_ok = False
+    with pool.sesion("a@b.co", "x") as tercera:
+        assert tercera is not primera and primera.cerrado
+    try:
+        with pool.sesion("a@b.co", "x"):
+            raise TimeoutError("lectura")
+    except TimeoutError:
+        pass
+    assert tercera.cerrado and len(pool) == 0
+    assert len(abiertos) == 2
+
+def test_pool_size_and_idle_eviction(monkeypatch):
+    pool, abiertos = crear_pool(monkeypatch)
+    for email in ("a@b.co", "c@d.co", "e@f.co"):
+        with pool.sesion(email, "x"):
+            pass
+    assert len(pool) == 2 and abiertos[0].cerrado
+    pool.mantener()
+    assert len(pool) == 2 and abiertos[1].noops == 1
+    monkeypatch.setattr(mailbox_pool.settings, "EMAIL_POOL_IDLE_EVICT_SECONDS", 0)
+    pool.mantener()
+    assert len(pool) == 0 and abiertos[2].cerrado
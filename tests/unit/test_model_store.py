@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from learning.model_store import ReloadableModel
+from utils.helpers import save_joblib_atomic
+
+def test_missing_model_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ReloadableModel(str(tmp_path / "model.pkl"))
+
+def test_reloads_after_atomic_replace(tmp_path):
+    model_path = str(tmp_path / "model.pkl")
+    save_joblib_atomic({"version": 1}, model_path)
+    model = ReloadableModel(model_path)
+    first = model.get()
+    assert model.get() is first
+    save_joblib_atomic({"version": 2}, model_path)
+    assert model.get() == {"version": 2}
+
+def test_model_arrays_are_memory_mapped(tmp_path):
+    model_path = str(tmp_path / "model.pkl")
+    save_joblib_atomic({"coef": np.zeros((2, 1024))}, model_path)
+    assert isinstance(ReloadableModel(model_path).get()["coef"], np.memmap)
@@ -0,0 +1,30 @@
+import json
+import os
+import pytest
+from learning.pattern_store import LearnedPatternStore
+
+@pytest.fixture
+def store(tmp_path):
+    return LearnedPatternStore(str(tmp_path / "learned_patterns.json"))
+
+def test_missing_file_returns_empty_patterns(store):
+    patterns, version = store.get_with_version()
+    assert version == 0
+    assert patterns["regex_patterns"] == {}
+
+def test_save_increments_version(store):
+    assert store.save({"regex_patterns": {"currency": "(COP)"}, "nlp_terms": []}) == 1
+    assert store.save({"regex_patterns": {}, "nlp_terms": ["ACME SAS"]}) == 2
+    with open(store.path, encoding='utf-8') as f:
+        assert json.load(f)["version"] == 2
+    assert not [name for name in os.listdir(os.path.dirname(store.path)) if name.endswith('.tmp')]
+
+def test_reader_reloads_only_on_change(store):
+    reader = LearnedPatternStore(store.path)
+    store.save({"nlp_terms": ["ACME SAS"]})
+    first = reader.get()
+    assert reader.get() is first
+    store.save({"nlp_terms": ["OTRA SAS"]})
+    patterns, version = reader.get_with_version()
+    assert version == 2
+    assert patterns["nlp_terms"] == ["OTRA SAS"]
@@ -0,0 +1,38 @@
+import pypdfium2 as pdfium
+from extraction.pdf_splitter import detectar_facturas, escribir_rangos
+
+CUFE_A = "a" * 96
+CUFE_B = "b" * 96
+
+def test_boundaries_from_invoice_number_and_cufe():
+    paginas = [
+        "ACME S.A.S.\nFactura electrónica de venta No. FE-101\nDetalle",
+        f"Continuación\nCUFE: {CUFE_A}",
+        "ACME S.A.S.\nFactura electrónica de venta No. FE-102\nDetalle",
+        f"Totales\nCUFE: {CUFE_B}",
+        "ACME S.A.S.\nFactura electrónica de venta No. FE-103",
+    ]
+    assert detectar_facturas(paginas) == [(0, 2), (2, 4), (4, 5)]
+    assert detectar_facturas(paginas[:2]) == [(0, 2)]
+
+def test_repeated_header_splits_documents_without_identifiers():
+    encabezado = "Distribuidora XYZ\nNit 900.123.456-7\nCalle 1 # 2-3\nBogotá\nTel 555 1234\n"
+    paginas = [encabezado + "Item 1\nTOTAL A PAGAR: 1.000", encabezado.replace("1234", "9999") + "Item 2", "Anexo sin encabezado"]
+    assert detectar_facturas(paginas) == [(0, 1), (1, 3)]
+    assert detectar_facturas(["Página 1 de 2", "Página 2 de 2", "Página 1 de 1"]) == [(0, 2), (2, 3)]
+
+def test_repeated_header_without_total_stays_one_invoice():
+    encabezado = "Distribuidora XYZ\nNit 900.123.456-7\nCalle 1 # 2-3\nBogotá\nTel 555 1234\n"
+    paginas = [encabezado + "Descripción  Cant  Valor Total\nItem 1  2  1.000", encabezado + "Item 2  1  500\nTOTAL: 1.500"]
+    assert detectar_facturas(paginas) == [(0, 2)]
+
+def test_write_ranges(tmp_path):
+    doc = pdfium.PdfDocument.new()
+    for _ in range(5):
+        doc.new_page(200, 200)
+    origen = tmp_path / "lote.pdf"
+    doc.save(str(origen))
+    doc.close()
+    paths = escribir_rangos(str(origen), [(0, 2), (2, 5)], str(tmp_path))
+    assert [p.rsplit("/", 1)[1] for p in paths] == ["lote_p001-002.pdf", "lote_p003-005.pdf"]
+    assert [len(pdfium.PdfDocument(p)) for p in paths] == [2, 3]
@@ -0,0 +1,47 @@
+import base64
+import json
+import pytest
+from ingestion import spool
+from ingestion.spool import DecodificadorIncremental
+
+def decodificar_por_bloques(datos, encoding, tamano):
+    decodificador = DecodificadorIncremental(encoding)
+    salida = b"".join(decodificador.feed(datos[i:i + tamano]) for i in range(0, len(datos), tamano))
+    return salida + decodificador.flush()
+
+def test_incremental_decoding_matches_whole_payload():
+    contenido = bytes(range(256)) * 20
+    codificado = base64.encodebytes(contenido)
+    assert all(decodificar_por_bloques(codificado, "base64", tamano) == contenido for tamano in (1, 3, 7, 1000))
+    texto = "Factura n=C3=BAmero 1=\r\n con salto suave\r\ncaf=C3=A9\r\n".encode()
+    assert decodificar_por_bloques(texto, "quoted-printable", 4) == "Factura número 1 con salto suave\r\ncafé\r\n".encode()
+
+def test_recover_spool_and_release_attachments(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool.settings, "EMAIL_SPOOL_DIR", str(tmp_path))
+    metadatos = {"asunto_correo": "Factura", "correo_cliente": "a@b.co"}
+    directorio = spool.crear_directorio_correo("a_b_co_7", metadatos)
+    (tmp_path / directorio / "7_2_factura.pdf").write_bytes(b"%PDF")
+    (tmp_path / directorio / "7_3_factura.xml").write_bytes(b"<Invoice/>")
+    paths = spool.confirmar_directorio_correo(directorio, [f"{directorio}/7_2_factura.pdf", f"{directorio}/7_3_factura.xml"])
+    incompleto = spool.crear_directorio_correo("a_b_co_8", metadatos)
+
+    trabajos = spool.recuperar_spool()
+    assert trabajos == [(path, metadatos, True) for path in paths]
+    assert not (tmp_path / incompleto).exists()
+    assert spool.uso_spool() == len(b"%PDF") + len(b"<Invoice/>") + len(json.dumps(metadatos).encode())
+
+    spool.liberar_adjunto(paths[0])
+    assert (tmp_path / paths[1]).exists()
+    spool.liberar_adjunto(paths[1])
+    assert list(tmp_path.iterdir()) == []
+
+def test_spool_locked_by_another_process_is_not_recovered(monkeypatch, tmp_path):
+    fcntl = pytest.importorskip("fcntl")
+    monkeypatch.setattr(spool.settings, "EMAIL_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(spool, "_bloqueos", {})
+    en_curso = spool.crear_directorio_correo("a_b_co_9", {})
+    with open(str(tmp_path / "spool") + spool.SUFIJO_BLOQUEO, "w") as otro_proceso:
+        fcntl.flock(otro_proceso, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert not spool.bloquear_spool()
+        assert spool.recuperar_spool() == []
+        assert (tmp_path / en_curso).exists()
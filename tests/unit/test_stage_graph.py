@@ -0,0 +1,33 @@
+import threading
+import pytest
+from extraction.stage_graph import Stage, StageGraph
+
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def wait_for_sibling(value):
+        barrier.wait()
+        return value
+
+    graph = StageGraph([
+        Stage("texto", lambda path: f"texto de {path}", ["pdf_path"]),
+        Stage("tablas", wait_for_sibling, ["pdf_path"]),
+        Stage("ocr", wait_for_sibling, ["texto"]),
+        Stage("resultado", lambda tablas, ocr: (tablas, ocr), ["tablas", "ocr"]),
+    ])
+    results = graph.run({"pdf_path": "factura.pdf"})
+    assert results["resultado"] == ("factura.pdf", "texto de factura.pdf")
+
+def test_stage_errors_propagate():
+    def fail(path):
+        raise RuntimeError("fallo")
+
+    graph = StageGraph([Stage("texto", fail, ["pdf_path"])])
+    with pytest.raises(RuntimeError):
+        graph.run({"pdf_path": "factura.pdf"})
+
+def test_unknown_inputs_and_cycles_are_rejected():
+    with pytest.raises(ValueError):
+        StageGraph([Stage("a", len, ["inexistente"])]).run({})
+    with pytest.raises(ValueError):
+        StageGraph([Stage("a", len, ["b"]), Stage("b", len, ["a"])]).run({})
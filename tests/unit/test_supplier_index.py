@@ -0,0 +1,37 @@
+import time
+import pytest
+from extraction.supplier_index import SupplierIndex, header_fingerprint, email_domain, CLAVE_NIT, CLAVE_REMITENTE, CLAVE_DOMINIO, CLAVE_HUELLA
+
+HEADER = "ACME S.A.S\nNIT 900.123.456-7\nCalle 10 # 20-30\nTel 601 555 1234\nFactura electrónica de venta\n"
+
+@pytest.fixture
+def index():
+    supplier_index = SupplierIndex(refresh_seconds=3600)
+    supplier_index._loaded_at = time.monotonic()
+    supplier_index._classifier_loaded = True
+    supplier_index._keys = {
+        (CLAVE_NIT, "9001234567"): ("9001234567", "ACME SAS"),
+        (CLAVE_REMITENTE, "facturas@acme.com.co"): ("9001234567", "ACME SAS"),
+        (CLAVE_DOMINIO, "acme.com.co"): ("9001234567", "ACME SAS"),
+        (CLAVE_DOMINIO, "plataforma.co"): (None, None),
+        (CLAVE_HUELLA, header_fingerprint(HEADER)): ("9001234567", "ACME SAS"),
+    }
+    return supplier_index
+
+def test_fingerprint_ignores_digits_and_spacing():
+    other_invoice = HEADER.replace("555 1234", "555  9876")
+    assert header_fingerprint(other_invoice) == header_fingerprint(HEADER)
+    assert header_fingerprint("solo una línea") is None
+
+def test_generic_domains_are_not_keys():
+    assert email_domain("Juan <juan@gmail.com>") is None
+    assert email_domain("Facturas <facturas@acme.com.co>") == "acme.com.co"
+
+def test_identify_by_subject_nit(index):
+    proveedor = index.identify(asunto="900.123.456-7;ACME S.A.S;FE;1001;01")
+    assert proveedor == {"nit": "9001234567", "nombre": "ACME SAS", "fuente": "asunto"}
+
+def test_identify_by_sender_domain_and_fingerprint(index):
+    assert index.identify(remitente="Ventas <ventas@acme.com.co>")["fuente"] == "dominio"
+    assert index.identify(remitente="otro@plataforma.co", text=HEADER)["fuente"] == "huella"
+    assert index.identify(remitente="otro@plataforma.co", text="sin\nencabezado") is None
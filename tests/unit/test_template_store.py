@@ -0,0 +1,40 @@
+from datetime import datetime
+import pytest
+from extraction.template_store import SupplierTemplateStore, validate_extraction
+
+PAGE_ONE = "ACME S.A.S\nNIT 900.123.456-7\nFactura de venta No. FE-1001\nFecha de emisión: 15/03/2024\n"
+TOTALS = "Descripción Cantidad Valor\nSubtotal: {:.2f}\nIVA 19%: {:.2f}\nTotal a pagar: {:.2f}\n"
+PAGE_TWO = TOTALS.format(1000000, 190000, 1190000)
+
+@pytest.fixture
+def store(tmp_path):
+    return SupplierTemplateStore(str(tmp_path / "supplier_templates.json"))
+
+def test_validate_requires_consistent_totals():
+    assert validate_extraction({"invoice_number": "FE-1001", "total_amount": 1190000.0,
+                                "subtotal_amount": 1000000.0, "tax_amount": 190000.0})
+    assert not validate_extraction({"invoice_number": "FE-1001", "total_amount": 1500000.0,
+                                    "subtotal_amount": 1000000.0, "tax_amount": 190000.0})
+    assert not validate_extraction({"invoice_number": "FE-1001", "total_amount": 1.0}, expect_items=True)
+
+def test_learned_template_extracts_next_invoice(store):
+    data = {"invoice_number": "FE-1001", "issue_date": datetime(2024, 3, 15), "total_amount": 1190000.0,
+            "subtotal_amount": 1000000.0, "tax_amount": 190000.0}
+    assert store.learn_from_extraction("9001234567", [PAGE_ONE, PAGE_TWO], data)
+    template = store.get("9001234567")
+    assert template["fields"]["total_amount"]["page"] == 1
+
+    next_pages = [PAGE_ONE.replace("FE-1001", "FE-1002").replace("15/03/2024", "02/04/2024"),
+                  TOTALS.format(2000000, 380000, 2380000)]
+    extracted = store.extract("9001234567", next_pages, "factura.pdf")
+    assert extracted["invoice_number"] == "FE-1002"
+    assert extracted["total_amount"] == 2380000.0
+    assert extracted["issue_date"] == datetime(2024, 4, 2)
+
+def test_failing_template_is_discarded(store, monkeypatch):
+    monkeypatch.setattr("config.settings.settings.TEMPLATE_MAX_FAILURES", 2)
+    store.learn_from_corrections([("9001234567", "monto_total", 1190000.0, PAGE_TWO)])
+    assert store.extract("9001234567", ["sin datos"], "factura.pdf") is None
+    assert store.get("9001234567") is not None
+    store.extract("9001234567", ["sin datos"], "factura.pdf")
+    assert store.get("9001234567") is None
@@ -0,0 +1,43 @@
+import io
+import zipfile
+from ingestion import zip_handler
+from ingestion.zip_handler import emparejar_facturas, leer_archivos_de_zip
+
+def crear_zip(miembros):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archivo_zip:
+        for nombre, contenido in miembros.items():
+            archivo_zip.writestr(nombre, contenido)
+    return buffer.getvalue()
+
+def test_reads_pdf_and_xml_members_including_nested_zips(tmp_path):
+    interno = crear_zip({"factura.xml": b"<Invoice/>", "otro.zip": crear_zip({"anexo.pdf": b"%PDF-2"})})
+    ruta = tmp_path / "adjunto.zip"
+    ruta.write_bytes(crear_zip({"factura.pdf": b"%PDF-1", "leeme.txt": b"hola", "interno.zip": interno}))
+
+    encontrados = leer_archivos_de_zip(str(ruta))
+    assert encontrados["pdfs"] == [("factura.pdf", b"%PDF-1"), ("interno.zip/otro.zip/anexo.pdf", b"%PDF-2")]
+    assert encontrados["xmls"] == [("interno.zip/factura.xml", b"<Invoice/>")]
+    assert list(tmp_path.iterdir()) == [ruta]
+
+def test_rejects_zips_over_the_decompressed_limit(monkeypatch):
+    bomba = crear_zip({"a.xml": b"0" * 10000, "b.pdf": b"0" * 10000})
+    assert leer_archivos_de_zip(bomba, limite=15000) == {"pdfs": [], "xmls": []}
+    assert len(leer_archivos_de_zip(bomba, limite=20000)["pdfs"]) == 1
+
+    monkeypatch.setattr(zip_handler.settings, "ZIP_MAX_NESTING", 1)
+    anidado = crear_zip({"n1.zip": crear_zip({"n2.zip": crear_zip({"c.pdf": b"%PDF"})}), "d.xml": b"<x/>"})
+    assert leer_archivos_de_zip(anidado) == {"pdfs": [], "xmls": [("d.xml", b"<x/>")]}
+
+def test_pairs_each_xml_with_its_pdf():
+    encontrados = leer_archivos_de_zip(crear_zip({
+        "ad0900123450002400000101.xml": b"<a1/>", "fv0900123450002400000101.pdf": b"%PDF-1",
+        "ad0900123450002400000102.xml": b"<a2/>", "FV0900123450002400000102.PDF": b"%PDF-2",
+        "ad0900123450002400000103.xml": b"<a3/>", "soporte.pdf": b"%PDF-3", "extra.zip": crear_zip({"anexo.pdf": b"%PDF-4"}),
+    }))
+    facturas = emparejar_facturas(encontrados)
+    assert [(f["xml"] and f["xml"][1], f["pdf"] and f["pdf"][1]) for f in facturas] == [
+        (b"<a1/>", b"%PDF-1"), (b"<a2/>", b"%PDF-2"), (b"<a3/>", None), (None, b"%PDF-3"), (None, b"%PDF-4")]
+
+    unica = emparejar_facturas(leer_archivos_de_zip(crear_zip({"ad123.xml": b"<a/>", "Factura FE-123.pdf": b"%PDF"})))
+    assert unica == [{"xml": ("ad123.xml", b"<a/>"), "pdf": ("Factura FE-123.pdf", b"%PDF")}]
@@ -21,4 +21,50 @@ def validate_invoice_data(data):
 def extract_filename_without_extension(file_path):
     """Extract the filename without its extension from a file path."""
     import os
-    return os.path.splitext(os.path.basename(file_path))[0]
\ No newline at end of file
+    return os.path.splitext(os.path.basename(file_path))[0]
+def write_atomic(file_path, write, binary=False):
+    """Write a file atomically: write(file) fills a temp file in the same directory, which then replaces file_path."""
+    import os
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w', **({} if binary else {'encoding': 'utf-8'})) as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+def save_json_atomic(data, file_path):
+    """Save data to a JSON file atomically (temp file in the same directory plus rename)."""
+    import json
+    write_atomic(file_path, lambda file: json.dump(data, file, indent=4, ensure_ascii=False))
+def save_joblib_atomic(obj, file_path):
+    """Dump an object with joblib atomically, uncompressed so it can be loaded with mmap_mode."""
+    import joblib
+    write_atomic(file_path, lambda file: joblib.dump(obj, file), binary=True)
+def file_signature(file_path):
+    """Return a cheap change marker for a file (inode, mtime, size), or None if it does not exist."""
+    import os
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+def move_to_unique_path(file_path, directory):
+    """Move a file into directory, adding a timestamp and random suffix if the name is taken. Returns the new path."""
+    import os
+    import shutil
+    import uuid
+    from datetime import datetime
+    os.makedirs(directory, exist_ok=True)
+    destination = os.path.join(directory, os.path.basename(file_path))
+    if os.path.exists(destination):
+        name, extension = os.path.splitext(os.path.basename(file_path))
+        destination = os.path.join(directory, f"{name}_{datetime.now():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}{extension}")
+    shutil.move(file_path, destination)
+    return destination